@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.autotune` --- runtime selection of the fastest kernel
+================================================================
+
+Which of the kernels in :mod:`MCEq.kernels` is the fastest depends on
+the hardware, the installed libraries and the size and sparsity of the
+matrices. If ``kernel_config`` is set to ``'auto'`` in :mod:`mceq_config`,
+:func:`tune_kernel` integrates a short burst of steps with every available
+combination of backend, matrix format and (for MKL) thread count and
+selects the fastest one. Kernels registered as experimental in 
+:mod:`MCEq.kernels` are not considered. Formats storing the matrices with
+reduced precision (:data:`MCEq.kernels.lossy_formats`) are only timed if
+``autotune_lossy`` is set.
+
+The result is stored in the file ``autotune_cache_file`` in the data
+directory, using the host name and a fingerprint of the sparsity pattern
+of the matrices as key. Later runs with the same matrices on the same
+machine skip the timing.
+"""
+
+import numpy as np
+from time import time
+from mceq_config import config, dbg
+import kernels
+
+
+def matrix_fingerprint(int_m, dec_m):
+    """Returns a hash of the shape and sparsity pattern of the matrices.
+
+    The values are not part of the fingerprint, since they do not
+    affect the performance of the kernels.
+    """
+    from hashlib import md5
+    h = md5()
+    for mat in [int_m, dec_m]:
+        csr = kernels.matrix_formats['csr'](mat, None)
+        h.update(str(csr.shape))
+        h.update(np.ascontiguousarray(csr.indptr).tostring())
+        h.update(np.ascontiguousarray(csr.indices).tostring())
+    return h.hexdigest()
+
+
+def time_kernel(kernel, int_m, dec_m, phi0, nsteps):
+    """Measures the time per integration step of a kernel.
+
+    A few steps are integrated first, such that the setup of libraries and
+    handles does not enter the measurement.
+
+    Returns:
+      (float): time per step in seconds
+    """
+    dX = np.ones(nsteps, dtype=np.float32) * 1e-3
+    rho_inv = np.ones(nsteps, dtype=np.float32)
+    nwarm = max(1, nsteps / 10)
+    kernel(nwarm, dX, rho_inv, int_m, dec_m, np.copy(phi0), [])
+    start = time()
+    kernel(nsteps, dX, rho_inv, int_m, dec_m, np.copy(phi0), [])
+    return (time() - start) / nsteps
+
+
+def _load_cache(fname):
+    import cPickle as pickle
+    try:
+        return pickle.load(open(fname, 'rb'))
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return {}
+
+
+def _save_cache(fname, cache):
+    import cPickle as pickle
+    try:
+        pickle.dump(cache, open(fname, 'wb'), protocol=-1)
+    except IOError:
+        print "autotune::_save_cache(): Can not write to", fname
+
+
+def tune_kernel(int_m, dec_m, phi0, block_size, use_cache=True):
+    """Selects the fastest kernel for the given matrices.
+
+    Args:
+      int_m (numpy.array): interaction matrix in any format
+      dec_m (numpy.array): decay matrix in any format
+      phi0 (numpy.array): initial state vector
+      block_size (int): size of the blocks for block formats, i.e. the
+        number of energy bins
+      use_cache (bool,optional): look up and store the result in the
+        ``autotune_cache_file``
+    Returns:
+      (dict): with keys 'backend', 'format', 'threads' (``None`` for
+      backends other than MKL) and 'timings', a list of
+      (backend, format, threads, seconds per step)
+    Raises:
+      Exception: if none of the registered kernels can be used
+    """
+    from os.path import join
+    from socket import gethostname
+    from functools import partial
+
+    fname = join(config['data_dir'], config['autotune_cache_file'])
+    key = (gethostname(), matrix_fingerprint(int_m, dec_m))
+    cache = _load_cache(fname) if use_cache else {}
+    candidates = [(backend, fmt) for backend, fmt in 
+                  kernels.available_kernels(experimental=False)
+                  if config['autotune_lossy'] or 
+                  fmt not in kernels.lossy_formats]
+
+    choice = cache.get(key)
+    if (choice is not None and
+        (choice['backend'], choice['format']) in candidates):
+        if dbg > 0:
+            print ("autotune::tune_kernel(): Using cached selection " +
+                   "{0}/{1}.").format(choice['format'], choice['backend'])
+        return choice
+
+    timings = []
+    for backend, fmt in candidates:
+        if fmt == 'dense' and int_m.shape[0] > config['autotune_max_dense']:
+            continue
+        kernel = kernels.get_kernel(backend, fmt)
+        mats = [kernels.matrix_formats[fmt](m, block_size)
+                for m in [int_m, dec_m]]
+        for threads in (config['autotune_threads'] if backend == 'MKL'
+                        else [None]):
+            try:
+                t = time_kernel(kernel if threads is None else
+                                partial(kernel, threads=threads),
+                                mats[0], mats[1], phi0,
+                                config['autotune_steps'])
+            except Exception, e:
+                print ("autotune::tune_kernel(): Skipping {0}/{1}: " +
+                       "{2}").format(fmt, backend, e)
+                continue
+            timings.append((backend, fmt, threads, t))
+            if dbg > 0:
+                print ("autotune::tune_kernel(): {0:>6s}/{1:<6s} " +
+                       "threads={2}: {3:8.3g} s/step").format(
+                        fmt, backend, threads or "-", t)
+
+    if not timings:
+        raise Exception("autotune::tune_kernel(): No usable kernel found.")
+
+    best = min(timings, key=lambda tm: tm[3])
+    choice = {'backend': best[0], 'format': best[1], 'threads': best[2],
+              'timings': timings}
+    print ("autotune::tune_kernel(): Selected {0}/{1}" +
+           (" with {2} threads." if best[2] else ".")).format(
+            best[1], best[0], best[2])
+
+    if use_cache:
+        cache = _load_cache(fname)
+        cache[key] = choice
+        _save_cache(fname, cache)
+
+    return choice
@@ -101,6 +101,23 @@ class MCEqRun():
         # Store vetos
         self.vetos = vetos
 
+        #: progress monitor selected with :func:`set_monitor`, ``None`` 
+        #: for the default from the config
+        self._monitor = None
+
+        # Transformation of the state vector inside the solver, see
+        # :func:`select_species`, :func:`set_energy_window`,
+        # :func:`set_state_ordering` and :func:`decouple_sinks`
+        self._ordering, self._decouple_sinks = 'natural', False
+        self._species_mask, self._dropped_species = None, []
+        self._bin_mask, self._natural_m = None, None
+        self._perm, self._perm_inv, self._solver_maps = None, None, None
+        self._sink_maps = None
+        #: (float) largest inverse interaction length in the energy window
+        #: divided by ``window_step_fraction``, limits the step size 
+        #: together with :attr:`max_ldec`
+        self.max_lint = 0.
+
         # Save observer id
         self.set_obs_particles(obs_ids)
 
@@ -314,17 +331,30 @@ class MCEqRun():
                             for p in self.cascade_particles])
         self.max_ldec = np.max(self.Lambda_dec)
     
+    def _apply_yield_scales(self):
+        """Multiplies the blocks of :math:`\\boldsymbol{C}` by the 
+        factors of :func:`scale_yield`. Particles, which are not part of
+        the current state vector, are skipped."""
+        for (proj, sec), factor in self._yield_scales.iteritems():
+            if proj not in self.pname2pref or sec not in self.pname2pref:
+                continue
+            proj, sec = self.pname2pref[proj], self.pname2pref[sec]
+            self.C[sec.lidx():sec.uidx(), proj.lidx():proj.uidx()] *= factor
+
     def _convert_to_sparse(self):
-        """Converts interaction and decay matrix into sparse format using
-        :class:`scipy.sparse.csr_matrix`.
+        """Converts interaction and decay matrix into the sparse format 
+        selected by ``sparse_format`` in :mod:`mceq_config`, for example
+        :class:`scipy.sparse.csr_matrix`. See :mod:`MCEq.formats` for the
+        block formats.
         """
-        
-        from scipy.sparse import csr_matrix
+        import kernels
+        fmt = config['sparse_format']
         if dbg > 0:
             print (self.cname + "::_convert_to_sparse():" + 
-                   "Converting to sparse (CSR) matrix format.")
-        self.int_m = csr_matrix(self.int_m)
-        self.dec_m = csr_matrix(self.dec_m)
+                   "Converting to sparse ({0}) matrix format.").format(
+                    fmt.upper())
+        self.int_m = kernels.matrix_formats[fmt](self.int_m, self.d)
+        self.dec_m = kernels.matrix_formats[fmt](self.dec_m, self.d)
     
     def _init_default_matrices(self):
         """Constructs the matrices for calculation.
@@ -341,6 +371,7 @@ class MCEqRun():
         print self.cname + "::_init_default_matrices():Start filling matrices."
 
         self._fill_matrices()
+        self._apply_yield_scales()
 
         # interaction part
         self.int_m = (-self.I + self.C) * self.Lambda_int
@@ -351,51 +382,614 @@ class MCEqRun():
         
         if config['use_sparse']:
             self._convert_to_sparse()
+
+        self._perm, self._perm_inv, self._solver_maps = None, None, None
+        self._sink_maps = None
+        self._species_mask, self._dropped_species = None, []
+        self._solver_d, self._natural_m = self.d, None
+        self._ordering = config['state_ordering']
+        self._decouple_sinks = config['decouple_sinks']
+        self._bin_mask = self._energy_window_mask(config['energy_window'])
+
+        if config['prune_threshold'] > 0.:
+            self.prune_matrices()
+        elif (self._ordering != 'natural' or self._decouple_sinks or 
+              self._bin_mask is not None):
+            self._set_solver_matrices(*self._natural_matrices())
+
+        # Handles and kernel selection for previous matrices are not 
+        # valid anymore
+        import kernels
+        kernels.release_kernel_caches()
+        self._kernel_choice = None
+        self._tuned_m = None
             
         if dbg > 0:
-            int_m_density = (float(np.count_nonzero(self.int_m)) / 
-                         float(self.int_m.size))
-            dec_m_density = (float(np.count_nonzero(self.dec_m)) / 
-                         float(self.dec_m.size))
+            from MCEq.formats import to_csr
+            int_m_density = (float(to_csr(self.int_m).nnz) / 
+                         float(np.prod(self.int_m.shape)))
+            dec_m_density = (float(to_csr(self.dec_m).nnz) / 
+                         float(np.prod(self.dec_m.shape)))
             print "C Matrix info:"
             print "    density    :", int_m_density
             print "    shape      :", self.int_m.shape
             if config['use_sparse']:
                 print "    nnz        :", self.int_m.nnz
             if dbg > 1:
-                print "    sum        :", np.sum(self.int_m)
+                print "    sum        :", to_csr(self.int_m).sum()
             print "D Matrix info:"
             print "    density    :", dec_m_density
             print "    shape      :", self.dec_m.shape
             if config['use_sparse']:
                 print "    nnz        :", self.dec_m.nnz
             if dbg > 1:
-                print "    sum        :", np.sum(self.int_m)
+                print "    sum        :", to_csr(self.dec_m).sum()
 
 
         print self.cname + "::_init_default_matrices():Done filling matrices."
     
-    def _init_progress_bar(self, maximum):
-        """Initializes the progress bar.
-        
-        The progress bar is a small python package which shows a progress
-        bar and remaining time. It should you cost no time to install it
-        from your favorite repositories such as pip, easy_install, anaconda, etc.
-        
-        Raises:
-          ImportError: if package not available
+    def prune_matrices(self, threshold=None, mode=None):
+        """Removes negligible elements from the interaction and decay 
+        matrices using :func:`MCEq.formats.prune_matrix`.
+
+        The pruned matrices are converted back into the configured 
+        format. Use :func:`prune_threshold_scan` to find a safe threshold.
+
+        Args:
+          threshold (float, optional): relative threshold, default is 
+            ``prune_threshold`` from :mod:`mceq_config`
+          mode (str, optional): 'column' or 'block', default is 
+            ``prune_mode`` from :mod:`mceq_config`
+        """
+        from MCEq.formats import prune_matrix
+
+        threshold = config['prune_threshold'] if threshold == None \
+            else threshold
+        mode = config['prune_mode'] if mode == None else mode
+
+        int_m, dec_m = self._natural_matrices()
+        nnz_before = int_m.nnz + dec_m.nnz
+        int_m = prune_matrix(int_m, threshold, self.d, mode)
+        dec_m = prune_matrix(dec_m, threshold, self.d, mode)
+        nnz_after = int_m.nnz + dec_m.nnz
+
+        self._set_solver_matrices(int_m, dec_m)
+
+        print ("{0}::prune_matrices(): threshold {1:3.1e} ({2}) removed " + 
+               "{3} of {4} non-zero elements.").format(self.cname, 
+                threshold, mode, nnz_before - nnz_after, nnz_before)
+
+    def prune_threshold_scan(self, observables, thresholds=None, mag=0.,
+                             tolerance=1e-3, mode=None, rel_cut=1e-10):
+        """Estimates the effect of :func:`prune_matrices` on observables.
+
+        For each threshold, copies of the current matrices are pruned and 
+        integrated along the current integration path. The observables at 
+        the surface are compared to the solution with the unpruned 
+        matrices. Only bins, in which the reference is larger than 
+        ``rel_cut`` times the maximum of the observable, are considered.
+
+        Args:
+          observables (list of str): reference observables, see
+            :func:`get_solution`
+          thresholds (list, optional): relative thresholds to test, default
+            is 1e-12 ... 1e-2
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+          tolerance (float, optional): maximal accepted relative deviation
+          mode (str, optional): 'column' or 'block', default is 
+            ``prune_mode`` from :mod:`mceq_config`
+          rel_cut (float, optional): relative threshold of considered bins
+        Returns:
+          (dict): with keys 'thresholds', 'nnz', 'max_rel_dev' (lists) and
+          'suggested', the largest threshold for which the deviations of 
+          this and all smaller thresholds are below ``tolerance``, or 
+          ``None``
+        """
+        import kernels
+        from MCEq.formats import prune_matrix
+
+        mode = config['prune_mode'] if mode == None else mode
+        thresholds = np.logspace(-12, -2, 11) if thresholds is None \
+            else np.sort(thresholds)
+        if not self.integration_path:
+            self._calculate_integration_path(None, 'X')
+        nsteps, dX, rho_inv, _ = self.integration_path
+
+        def solve(int_m, dec_m):
+            phi, _ = kernels.kern_numpy(nsteps, dX, rho_inv, int_m, dec_m,
+                                        np.copy(self.phi0), [])
+            return self._observables(phi, observables, mag)
+
+        int_m, dec_m = self._natural_matrices()
+        ref = solve(int_m, dec_m)
+        sel = np.abs(ref) > rel_cut * np.max(np.abs(ref), axis=1)[:, None]
+
+        result = {'thresholds': [], 'nnz': [], 'max_rel_dev': [], 
+                  'suggested': None}
+        print ("{0}::prune_threshold_scan(): {1} non-zero elements " + 
+               "without pruning.").format(self.cname, int_m.nnz + dec_m.nnz)
+        # only thresholds for which all smaller ones pass are suggested
+        threshold_prev = None
+        for threshold in thresholds:
+            p_int_m = prune_matrix(int_m, threshold, self.d, mode)
+            p_dec_m = prune_matrix(dec_m, threshold, self.d, mode)
+            dev = np.max(np.abs(solve(p_int_m, p_dec_m)[sel] / ref[sel] - 1.))
+            result['thresholds'].append(threshold)
+            result['nnz'].append(p_int_m.nnz + p_dec_m.nnz)
+            result['max_rel_dev'].append(dev)
+            if dev <= tolerance and result['suggested'] == threshold_prev:
+                result['suggested'] = threshold
+            threshold_prev = threshold
+            print "    {0:8.1e}: nnz = {1:8d}, max. deviation = {2:8.2e}".format(
+                threshold, result['nnz'][-1], dev)
+
+        print ("{0}::prune_threshold_scan(): suggested threshold for " + 
+               "tolerance {1:3.1e}: {2}").format(self.cname, tolerance, 
+                result['suggested'])
+        return result
+
+    def select_species(self, observables=None, tolerance=None):
+        """Removes species, which do not contribute to the requested 
+        observables, from the solver.
+
+        The contributions are determined on the graph of the (mother, 
+        daughter) blocks of the interaction and decay matrices, which 
+        contains the secondaries of the interactions, the decay 
+        channels including the resonance chains and the alias and 
+        ``obs_`` categories, see :func:`MCEq.formats.species_relevance`.
+        Species, which can not be reached from the primaries in 
+        :attr:`phi0` (or from nucleons, if no primary flux is set yet), 
+        and species, from which no observable can be reached, are 
+        removed. With ``tolerance`` > 0, also species with a weak 
+        coupling are removed. 
+
+        The fluxes of removed species are not calculated and 
+        :func:`get_solution` refuses them. A copy of the full matrices is
+        kept, such that the selection can be changed by another call.
+
+        Args:
+          observables (list of str, optional): names in the format 
+            accepted by :func:`get_solution`. If ``None``, all species
+            are restored.
+          tolerance (float, optional): minimal relevance, default is
+            ``species_tolerance`` from :mod:`mceq_config`
+        """
+        from MCEq.formats import species_relevance
+
+        if observables == None:
+            int_m, dec_m = self._natural_matrices()
+            self._species_mask, self._dropped_species = None, []
+            self._set_solver_matrices(int_m, dec_m)
+            return
+
+        tolerance = config['species_tolerance'] if tolerance == None \
+            else tolerance
+        targets = [self.pname2pref[pname].nceidx for name in observables
+                   for pname in self._obs_components(name)]
+        if getattr(self, 'phi0', None) is None:
+            sources = [self.pdg2nceidx[2212], self.pdg2nceidx[2112]]
+        else:
+            sources = np.flatnonzero(np.any(self.phi0.reshape(
+                self.n_tot_species, self.d) != 0., axis=1))
+
+        int_m, dec_m = self._natural_matrices()
+        relevance = species_relevance(int_m, dec_m, self.d, sources, targets)
+        keep = (relevance > 0.) & (relevance >= tolerance)
+        keep[targets] = True
+
+        self._species_mask = keep
+        self._dropped_species = [p.name for p in self.cascade_particles
+                                 if not keep[p.nceidx]]
+        self._set_solver_matrices(int_m, dec_m)
+
+        print ("{0}::select_species(): {1} of {2} species kept for " + 
+               "{3}.").format(self.cname, np.count_nonzero(keep),
+                              self.n_tot_species, ", ".join(observables))
+        if dbg > 0:
+            print "    removed:", ", ".join(self._dropped_species)
+
+    def set_energy_window(self, window=None):
+        """Restricts the solver to the energy bins inside a window.
+
+        Interactions and decays move particles only to equal or lower
+        energies. The fluxes above ``E_min`` are therefore not affected 
+        by the bins below, which are removed from the solver. Bins above 
+        ``E_max`` are removed as well, i.e. the primary flux is cut off 
+        there. The step size is limited by the shortest decay length 
+        within the window and by the fraction ``window_step_fraction`` of
+        the shortest interaction length, which results in much fewer 
+        steps if ``E_min`` is high.
+
+        The solutions are returned on the full :attr:`e_grid` with 
+        zeros outside of the window.
+
+        Args:
+          window (tuple, optional): (E_min, E_max) in GeV, compared to the
+            bin centers. Each limit can be ``None``. If ``window`` is 
+            ``None``, the full energy range is restored.
+        """
+        int_m, dec_m = self._natural_matrices()
+        self._bin_mask = self._energy_window_mask(window)
+        self._set_solver_matrices(int_m, dec_m)
+        self.integration_path = None
+
+        if dbg > 0:
+            print ("{0}::set_energy_window(): {1} of {2} energy bins " + 
+                   "kept.").format(self.cname, self._solver_d, self.d)
+
+    def _energy_window_mask(self, window):
+        """Returns a mask of the energy bins inside ``window`` or ``None``
+        if no bin is excluded."""
+        if window == None:
+            return None
+        E_min, E_max = window
+        mask = np.ones(self.d, dtype=bool)
+        if E_min != None:
+            mask &= self.e_grid >= E_min
+        if E_max != None:
+            mask &= self.e_grid <= E_max
+        if not np.any(mask):
+            raise Exception(("{0}::_energy_window_mask(): No energy bin " + 
+                             "in window {1}.").format(self.cname, window))
+        return None if np.all(mask) else mask
+
+    def set_state_ordering(self, ordering=None):
+        """Permutes the matrices to improve the memory locality of the 
+        matrix-vector products, see :func:`MCEq.formats.state_permutation`.
+
+        The permutation is only applied inside the solver. The initial
+        state is permuted before it is passed to the kernels and the 
+        results are mapped back, such that :attr:`phi0`, :attr:`solution`,
+        the longitudinal solutions and the index tables, like 
+        :attr:`pdg2nceidx` or the ``lidx()``/``uidx()`` of the particles,
+        keep the natural species-by-species order. The same holds for
+        :attr:`Lambda_int` and :attr:`Lambda_dec`.
+
+        Args:
+          ordering (str, optional): 'natural', 'rcm' or 'energy_major', 
+            default is ``state_ordering`` from :mod:`mceq_config`
+        """
+        int_m, dec_m = self._natural_matrices()
+        self._ordering = (config['state_ordering'] if ordering == None 
+                          else ordering)
+        self._set_solver_matrices(int_m, dec_m)
+
+        if dbg > 0:
+            bandwidth = lambda m: (np.max(np.abs(m.tocoo().row - 
+                                                 m.tocoo().col)) 
+                                   if m.nnz else 0)
+            print ("{0}::set_state_ordering(): '{1}' ordering, bandwidth " + 
+                   "of int_m {2} -> {3}.").format(self.cname, self._ordering,
+                    bandwidth(int_m), bandwidth(self._natural_matrices(
+                        natural=False)[0]))
+
+    def decouple_sinks(self, decouple=True):
+        """Removes species, which neither interact nor decay, from the
+        matrix-vector products of the solver.
+
+        The fluxes of these sinks, e.g. the neutrinos, are not part of the
+        state vector of the solver. They are restored from their initial 
+        values and sums of the other species over the integration path, 
+        see :func:`MCEq.formats.sink_reduction`. Like for 
+        :func:`set_state_ordering`, the results are mapped back and 
+        :func:`get_solution` is not affected.
+
+        Args:
+          decouple (bool, optional): enable or disable the reduction, the
+            default for new matrices is ``decouple_sinks`` from 
+            :mod:`mceq_config`
         """
+        int_m, dec_m = self._natural_matrices()
+        self._decouple_sinks = decouple
+        self._set_solver_matrices(int_m, dec_m)
+
+        if dbg > 0:
+            print ("{0}::decouple_sinks(): {1} elements in the " + 
+                   "solver.").format(self.cname, self.int_m.shape[0])
+
+    def scale_yield(self, projectile, secondary, factor):
+        """Multiplies the yield of a secondary from a projectile by
+        ``factor`` without rebuilding the matrices.
+
+        Only the values of the interaction matrix are changed, the
+        sparsity pattern is kept (see :func:`_scale_int_m`). As in
+        :func:`solve_sensitivity`, products of the secondary, which are
+        added to other species by the resonance approximation, are not
+        scaled. The factors are applied again when the matrices are 
+        rebuilt, e.g. by :func:`set_obs_particles`, until they are reset 
+        by :func:`set_interaction_model`.
+
+        Args:
+          projectile (str or int): particle name or PDG ID
+          secondary (str or int): particle name or PDG ID
+          factor (float or numpy.array): scale factor, or one factor per
+            energy bin of the projectile
+        """
+        proj, sec = self._pref(projectile), self._pref(secondary)
+        factor = np.broadcast_to(np.asarray(factor, dtype='double'),
+                                 (self.d,))
+        key = (proj.name, sec.name)
+        self._yield_scales[key] = self._yield_scales.get(key, 1.) * factor
+
+        def update(data, rows, cols):
+            # the diagonal of the projectile contains the loss term
+            loss = (np.zeros_like(data) if sec is not proj else
+                    (rows == cols) * self.Lambda_int[proj.lidx() + cols])
+            data[:] = (data + loss) * factor[cols] - loss
+
+        self._scale_int_m(sec, proj, update)
+
+    def scale_cross_section(self, particle, factor):
+        """Multiplies the inelastic cross section of a projectile by
+        ``factor`` without rebuilding the matrices.
+
+        The interaction lengths :attr:`Lambda_int` and the columns of
+        the projectile in the interaction matrix are scaled. The scaled
+        interaction lengths are kept when the matrices are rebuilt, e.g.
+        by :func:`set_obs_particles`, until they are reinitialized by
+        :func:`set_interaction_model`.
+
+        Args:
+          particle (str or int): particle name or PDG ID
+          factor (float or numpy.array): scale factor, or one factor per
+            energy bin
+        """
+        proj = self._pref(particle)
+        factor = np.broadcast_to(np.asarray(factor, dtype='double'),
+                                 (self.d,))
+        self.Lambda_int[proj.lidx():proj.uidx()] *= factor
+        self.integration_path = None
+
+        def update(data, rows, cols):
+            data *= factor[cols]
+
+        self._scale_int_m(None, proj, update)
+
+    def _pref(self, particle):
+        """Returns the particle reference for a name or a PDG ID."""
         try:
-            from progressbar import ProgressBar, Percentage, Bar, ETA
-        except ImportError:
-            print "Failed to import 'progressbar' progress indicator."
-            print "Install the module with 'easy_install progressbar', or",
-            print "get it from http://qubit.ic.unicamp.br/~nilton"
-            raise ImportError("It's easy do do this...")
-        self.progressBar = ProgressBar(maxval=maximum,
-                                       widgets=[Percentage(), ' ',
-                                                Bar(), ' ',
-                                                ETA()])
+            return self.pdg2pref[int(particle)]
+        except ValueError:
+            return self.pname2pref[particle]
+
+    def _scale_int_m(self, secondary, projectile, update):
+        """Changes the values of a block of the interaction matrix.
+
+        The positions of the non-zero elements of the block in the data
+        array of the matrix are determined once per block and matrix. If
+        the solver integrates the natural interaction matrix in the ``csr``
+        format, the values are updated in place. Otherwise the natural
+        matrices are updated and transformed again by
+        :func:`_set_solver_matrices`, which is still much faster than
+        :func:`_init_default_matrices`.
+
+        Args:
+          secondary (:class:`MCEq.data.MCEqParticle`): particle of the rows
+            or ``None`` for all rows
+          projectile (:class:`MCEq.data.MCEqParticle`): particle of the
+            columns
+          update (function): called with the values, the energy bins of
+            the secondary and the energy bins of the projectile, changes
+            the values in place
+        """
+        import kernels
+        from scipy.sparse import isspmatrix_csr
+
+        in_place = (self._perm is None and self._solver_maps is None and
+                    isspmatrix_csr(self.int_m))
+        if in_place:
+            int_m, dec_m = self.int_m, self.dec_m
+        else:
+            int_m, dec_m = self._natural_matrices()
+
+        if getattr(self, '_slots', None) == None or self._slots[0] is not int_m:
+            self._slots = (int_m, {})
+        key = (None if secondary is None else secondary.pdgid,
+               projectile.pdgid)
+        if key not in self._slots[1]:
+            r0, r1 = ((0, int_m.shape[0]) if secondary is None
+                      else (secondary.lidx(), secondary.uidx()))
+            idx = np.arange(int_m.indptr[r0], int_m.indptr[r1])
+            rows = np.repeat(np.arange(r0, r1),
+                             np.diff(int_m.indptr[r0:r1 + 1]))
+            cols = int_m.indices[idx]
+            sel = (cols >= projectile.lidx()) & (cols < projectile.uidx())
+            self._slots[1][key] = (idx[sel], (rows[sel] - r0) % self.d,
+                                   cols[sel] - projectile.lidx())
+
+        idx, rows, cols = self._slots[1][key]
+        data = int_m.data[idx]
+        update(data, rows, cols)
+        int_m.data[idx] = data
+
+        if in_place:
+            # sorted matrices and library handles contain copies of the values
+            kernels.release_kernel_caches()
+            self._adjoint_m = None
+            self._tuned_m = None
+        else:
+            self._set_solver_matrices(int_m, dec_m)
+
+    def _natural_matrices(self, natural=True):
+        """Returns the interaction and decay matrices as 
+        :class:`scipy.sparse.csr_matrix` in the natural order of the state
+        vector (or as used by the solver if ``natural`` is False)."""
+        from MCEq.formats import to_csr, permute_matrix
+
+        if natural and self._natural_m is not None:
+            return self._natural_m
+        mats = [to_csr(self.int_m), to_csr(self.dec_m)]
+        if natural and self._perm is not None:
+            mats = [permute_matrix(m, self._perm_inv) for m in mats]
+        if natural and self._solver_maps is not None:
+            embed, restore = self._solver_maps
+            mats = [restore.dot(m).dot(embed).tocsr() for m in mats]
+            for m in mats:
+                m.sort_indices()
+        return mats[0], mats[1]
+
+    def _set_solver_matrices(self, int_m, dec_m):
+        """Stores matrices given in natural order as :attr:`int_m` and 
+        :attr:`dec_m`, applying the selection by :func:`select_species`
+        and :func:`set_energy_window`, the reduction by 
+        :func:`decouple_sinks`, the permutation of the state vector and 
+        the configured matrix format. The :attr:`integration_path` is 
+        discarded if the limits of the step size changed."""
+        import kernels
+        from scipy.sparse import identity
+        from MCEq.formats import (permute_matrix, sink_reduction, 
+                                  state_permutation, to_csr)
+
+        step_limits = (getattr(self, 'max_ldec', None), self.max_lint)
+        fmt = config['sparse_format'] if config['use_sparse'] else 'dense'
+        int_m, dec_m = to_csr(int_m), to_csr(dec_m)
+        species_mask = (np.ones(self.n_tot_species, dtype=bool) 
+                        if self._species_mask is None else self._species_mask)
+        bin_mask = (np.ones(self.d, dtype=bool) if self._bin_mask is None 
+                    else self._bin_mask)
+        # block size of the solver
+        self._solver_d = np.count_nonzero(bin_mask)
+
+        self.max_ldec = np.max(self.Lambda_dec)
+        self.max_lint = 0.
+        maps = []
+        # The selections discard matrix elements, keep the full matrices
+        self._natural_m = None
+        if self._species_mask is not None or self._bin_mask is not None:
+            self._natural_m = (int_m, dec_m)
+            kept = np.flatnonzero(np.outer(species_mask, bin_mask).ravel())
+            select = identity(self.dim_states, format='csr')[kept]
+            int_m = int_m[kept][:, kept]
+            dec_m = dec_m[kept][:, kept]
+            maps.append((select, select.T.tocsr()))
+        if self._bin_mask is not None:
+            window = np.tile(self._bin_mask, self.n_tot_species)
+            self.max_ldec = np.max(self.Lambda_dec[window])
+            self.max_lint = (np.max(self.Lambda_int[window]) / 
+                             config['window_step_fraction'])
+        if step_limits != (self.max_ldec, self.max_lint):
+            self.integration_path = None
+        self._sink_maps = None
+        if self._decouple_sinks:
+            int_m, dec_m, embed, restore, carry, integral = sink_reduction(
+                int_m, dec_m, self._solver_d)
+            if embed is not None:
+                if maps:
+                    # the selection precedes the reduction
+                    carry = maps[0][1].dot(carry).dot(maps[0][0]).tocsr()
+                    integral = maps[0][1].dot(integral).tocsr()
+                self._sink_maps = (carry, integral)
+                maps.append((embed, restore))
+        self._solver_maps = maps[0] if maps else None
+        for embed, restore in maps[1:]:
+            self._solver_maps = (embed.dot(self._solver_maps[0]).tocsr(),
+                                 self._solver_maps[1].dot(restore).tocsr())
+        self._perm = state_permutation(int_m, dec_m, self._solver_d, 
+                                       self._ordering)
+        self._perm_inv = (None if self._perm is None 
+                          else np.argsort(self._perm))
+        if self._perm is not None:
+            int_m = permute_matrix(int_m, self._perm)
+            dec_m = permute_matrix(dec_m, self._perm)
+        self.int_m = kernels.matrix_formats[fmt](int_m, self._solver_d)
+        self.dec_m = kernels.matrix_formats[fmt](dec_m, self._solver_d)
+
+        kernels.release_kernel_caches()
+        self._kernel_choice = None
+        self._tuned_m = None
+
+    def _to_solver(self, phi):
+        """Returns a copy of the state vector(s) ``phi`` as used by 
+        the solver."""
+        if (self._species_mask is not None and np.any(phi.reshape(
+                self.n_tot_species, -1)[~self._species_mask] != 0.)):
+            raise Exception(self.cname + "::_to_solver(): The state " +
+                "contains species removed by select_species().")
+        res = phi if self._solver_maps is None else self._solver_maps[0].dot(phi)
+        res = res if self._perm is None else res[self._perm]
+        return np.copy(res) if res is phi else res
+
+    def _from_solver(self, phi, phi_in):
+        """Returns a copy of the state vector(s) ``phi`` in natural order.
+
+        Args:
+          phi (numpy.array): state vector(s) of the solver
+          phi_in (numpy.array): state vector(s) in natural order, which 
+            were passed to :func:`_to_solver` at the start of the 
+            integration. The species decoupled by :func:`decouple_sinks`
+            carry over their values.
+        """
+        res = phi if self._perm is None else phi[self._perm_inv]
+        res = res if self._solver_maps is None else self._solver_maps[1].dot(res)
+        if self._sink_maps is not None:
+            res = res + self._sink_maps[0].dot(phi_in)
+        return np.copy(res) if res is phi else res
+
+    def _sink_integrals(self, phi):
+        """Returns the integrals :math:`u` over the path of the species, 
+        which feed the sinks decoupled by :func:`decouple_sinks`, from the
+        state vector(s) ``phi`` of the solver (see 
+        :func:`MCEq.formats.sink_reduction`), or ``None`` if no sinks are
+        decoupled."""
+        if self._sink_maps is None:
+            return None
+        res = phi if self._perm is None else phi[self._perm_inv]
+        return self._sink_maps[1].dot(res)
+
+    def _solver_projection(self, proj_m):
+        """Adapts a projection matrix to state vectors of the solver. If 
+        ``proj_m`` is ``None``, the projection restores the natural state 
+        vector, or ``None`` is returned if the solver uses the natural 
+        state vector."""
+        from scipy.sparse import identity
+        restore = None if self._solver_maps is None else self._solver_maps[1]
+        if self._perm is not None:
+            restore = (identity(len(self._perm), format='csr')[self._perm_inv]
+                       if restore is None 
+                       else restore.tocsc()[:, self._perm].tocsr())
+        if restore is None:
+            return proj_m
+        elif proj_m is None:
+            return restore
+        return proj_m.dot(restore).tocsr()
+
+    def set_monitor(self, monitor=None, stride=None):
+        """Selects how the progress of the calculations is reported.
+
+        Args:
+          monitor (str, callable or object, optional): 'bar', 'print',
+            'none', a function which receives the reports or an instance of
+            :class:`MCEq.monitor.ProgressMonitor`. If ``None``, the
+            ``progress_monitor`` setting in :mod:`mceq_config` is used.
+          stride (int, optional): number of steps between two reports,
+            default is ``progress_stride`` in :mod:`mceq_config`
+        """
+        from MCEq.monitor import ProgressMonitor, make_monitor
+
+        if isinstance(monitor, ProgressMonitor) or monitor == None:
+            self._monitor = monitor
+        else:
+            self._monitor = make_monitor(monitor, stride)
+
+    def _init_monitor(self, maximum, dX=None, rho_inv=None):
+        """Starts the progress monitor selected with :func:`set_monitor`.
+
+        Args:
+          maximum (float): number of steps or depth at which the 
+            calculation is finished
+          dX (numpy.array,optional): step sizes of the integration path
+          rho_inv (numpy.array,optional): inverse densities of the
+            integration path
+        Returns:
+          (:class:`MCEq.monitor.ProgressMonitor`): started monitor
+        """
+        from MCEq.monitor import make_monitor
+
+        monitor = self._monitor
+        if monitor == None:
+            monitor = make_monitor()
+        monitor.start(maximum, dX, rho_inv)
+        return monitor
     
     def _alias(self, mother, daughter):
         """Returns pair of alias indices, if ``mother``/``daughter`` combination
@@ -459,38 +1053,93 @@ class MCEqRun():
           grid_idx (int, optional): if the integrator has been configured to save
             intermediate solutions on a depth grid, then ``grid_idx`` specifies 
             the index of the depth grid for which the solution is retrieved. If
-            not specified the flux at the surface is returned 
+            not specified the flux at the surface is returned. The grid can
+            be defined in slant depth, vertical depth or height, see 
+            :func:`_convert_int_grid`. Depending on the ``grid_sol_storage``
+            setting the solution may be read lazily from disk, see 
+            :mod:`MCEq.snapshots`
         
         Returns:
           (numpy.array): flux of particles on energy grid :attr:`e_grid`
         """
-        res = np.zeros(self.d)
-        ref = self.pname2pref
         sol = None
         if grid_idx == None:
             sol = self.solution
+        elif self.grid_obs != None:
+            # Longitudinal solutions contain only the projected observables
+            if particle_name not in self.grid_obs:
+                raise Exception(("MCEqRun::get_solution(): {0} is not " + 
+                    "among the observables saved on the grid.").format(
+                    particle_name))
+            i = self.grid_obs.index(particle_name)
+            return self.grid_sol[grid_idx][i * self.d:(i + 1) * self.d] * \
+                self.e_grid ** mag
         else:
             sol = self.grid_sol[grid_idx]
-            
+
+        return self._observables(sol, [particle_name], mag)[0]
+
+    def _obs_components(self, particle_name):
+        """Resolves the special prefixes of :func:`get_solution` into the
+        list of particle names, which have to be summed up.
+
+        Args:
+          particle_name (str): particle name, optionally with ``total_``
+            or ``conv_`` prefix
+        Returns:
+          (list of str): names of the entries in :attr:`pname2pref`
+        """
         if particle_name.startswith('total'):
             lep_str = particle_name.split('_')[1]
-            for prefix in ('pr_', 'pi_', 'k_', ''):
-                particle_name = prefix + lep_str
-                res += sol[ref[particle_name].lidx():
-                           ref[particle_name].uidx()] * \
-                    self.e_grid ** mag
+            return [prefix + lep_str for prefix in ('pr_', 'pi_', 'k_', '')]
         elif particle_name.startswith('conv'):
             lep_str = particle_name.split('_')[1]
-            for prefix in ('pi_', 'k_', ''):
-                particle_name = prefix + lep_str
-                res += sol[ref[particle_name].lidx():
-                           ref[particle_name].uidx()] * \
-                    self.e_grid ** mag
+            return [prefix + lep_str for prefix in ('pi_', 'k_', '')]
         else:
-            res = sol[ref[particle_name].lidx():
-                      ref[particle_name].uidx()] * \
-                self.e_grid ** mag
-        return res
+            return [particle_name]
+
+    def _obs_projection(self, observables):
+        """Constructs a sparse matrix, which projects the state vector onto
+        the fluxes of the requested observables.
+
+        The rows ``i * d`` to ``(i + 1) * d`` of the result of the projection
+        contain the flux of ``observables[i]`` on the energy grid.
+
+        Args:
+          observables (list of str): particle names in the format 
+            accepted by :func:`get_solution`
+        Returns:
+          (scipy.sparse.csr_matrix): matrix of shape 
+          (len(observables) * :attr:`d`, :attr:`dim_states`)
+        """
+        from scipy.sparse import coo_matrix
+        ref = self.pname2pref
+        rows, cols = [], []
+        for i, particle_name in enumerate(observables):
+            for pname in self._obs_components(particle_name):
+                if pname in self._dropped_species:
+                    raise Exception(("MCEqRun::_obs_projection(): {0} " + 
+                        "has been removed by select_species().").format(
+                        pname))
+                rows.append(np.arange(i * self.d, (i + 1) * self.d))
+                cols.append(np.arange(ref[pname].lidx(), ref[pname].uidx()))
+        rows, cols = np.hstack(rows), np.hstack(cols)
+        return coo_matrix((np.ones(rows.size), (rows, cols)),
+            shape=(len(observables) * self.d, self.dim_states)).tocsr()
+
+    def _observables(self, sol, observables, mag=0.):
+        """Computes the fluxes of several observables from a state vector.
+
+        Args:
+          sol (numpy.array): state vector of size :attr:`dim_states`
+          observables (list of str): particle names in the format 
+            accepted by :func:`get_solution`
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+        Returns:
+          (numpy.array): array of shape (len(observables), :attr:`d`)
+        """
+        res = self._obs_projection(observables).dot(sol)
+        return res.reshape(len(observables), self.d) * self.e_grid ** mag
 
     def set_obs_particles(self, obs_ids):
         """Adds a list of mother particle strings which decay products
@@ -545,6 +1194,8 @@ class MCEqRun():
         # Initialize default run
         self._init_Lambda_int()
         self._init_Lambda_dec()
+        self._yield_scales = {}
+        self.integration_path = None
 
         for p in self.particle_species:
             if p.pdgid in self.y.projectiles:
@@ -689,23 +1340,33 @@ class MCEqRun():
         self.phi0[self.pdg2pref[2112].lidx() + idx_lo] = n_neutrons * wE_lo / widths[idx_lo] ** 2
         self.phi0[self.pdg2pref[2112].lidx() + idx_up] = n_neutrons * wE_up / widths[idx_up] ** 2
         
-    def set_atm_model(self, atm_config):
+    def _create_atm_model(self, atm_config):
+        """Instantiates a density profile from a configuration tuple.
+
+        Args:
+          atm_config (tuple of strings): (base model, location, season)
+        Returns:
+          (:class:`MCEq.density_profiles.CascadeAtmosphere`): atmosphere object
+        """
         from MCEq.density_profiles import CorsikaAtmosphere, MSIS00Atmosphere
 
         base_model, location, season = atm_config
 
-        if dbg:
-            print 'MCEqRun::set_atm_model(): ', base_model, location, season
-
         if base_model == 'MSIS00':
-            self.atm_model = MSIS00Atmosphere(
-                location, season)
+            return MSIS00Atmosphere(location, season)
         elif base_model == 'CORSIKA':
-            self.atm_model = CorsikaAtmosphere(
-                location, season)
+            return CorsikaAtmosphere(location, season)
         else:
             raise Exception(
                 'MCEqRun::set_atm_model(): Unknown atmospheric base model.')
+
+    def set_atm_model(self, atm_config):
+        base_model, location, season = atm_config
+
+        if dbg:
+            print 'MCEqRun::set_atm_model(): ', base_model, location, season
+
+        self.atm_model = self._create_atm_model(atm_config)
         self.atm_config = atm_config
 
         if self.theta_deg != None:
@@ -858,7 +1519,7 @@ class MCEqRun():
             return (self.int_m + self.dec_m * ri(X)).todense()
 
         # Initial condition
-        phi0 = np.copy(self.phi0)
+        phi0 = self._to_solver(self.phi0)
 
         # Setup solver
         r = ode(dPhi_dX).set_integrator(
@@ -869,75 +1530,1093 @@ class MCEqRun():
         # Solve
         X_surf = self.atm_model.X_surf
         
-        self._init_progress_bar(X_surf)
-        self.progressBar.start()
+        monitor = self._init_monitor(X_surf)
         start = time()
 
+        step, next_report = 0, 0
         while r.successful() and r.t < X_surf:
-            self.progressBar.update(r.t)
-#             if (i % 100) == 0:
-#                 print "Solving at depth X =", r.t, X_i
+            if step == next_report:
+                monitor.update(r.t, X=r.t, rho_inv=ri(r.t))
+                next_report += monitor.stride
             r.integrate(r.t + dXstep)
+            step += 1
         
         # Do last step to make sure the rational number X_surf is reached
         r.integrate(X_surf)
         
-        self.progressBar.finish()
+        monitor.finish()
 
         print ("\n{0}::vode(): time elapsed during " + 
                "integration: {1} sec").format(self.cname, time() - start)
         
-        self.solution = r.y
+        self.solution = self._from_solver(r.y, self.phi0)
+        self.solution_X = X_surf
+
+    def solve_time_series(self, atmospheres, theta_deg, observables, mag=0.):
+        """Solves the cascade equations for a sequence of density profiles,
+        e.g. one per day of the year, and returns only selected observables.
+
+        The interaction and decay matrices are assembled only once. The 
+        profiles are consumed one-by-one from ``atmospheres`` (which may be
+        a generator) and the integration path for the next profile is 
+        calculated in a background thread, while the kernel integrates 
+        the current one. The current :attr:`atm_model` is not modified.
+
+        Args:
+          atmospheres (iterable): configuration tuples as accepted by
+            :func:`set_atm_model` or instances of 
+            :class:`MCEq.density_profiles.CascadeAtmosphere`
+          theta_deg (float): zenith angle :math:`\\theta` in degrees
+          observables (list of str): particle names in the format accepted
+            by :func:`get_solution`
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+        Returns:
+          (numpy.array): fluxes of shape (n_atmospheres, len(observables), :attr:`d`)
+        """
+        kernel = self._get_kernel()
+        int_m, dec_m = self._kernel_matrices()
+
+        start = time()
+        res = []
+        for nsteps, dX, rho_inv, grid_idcs in self._stream_integration_paths(
+                atmospheres, theta_deg):
+            phi, _ = kernel(nsteps, dX, rho_inv, int_m, dec_m,
+                            self._to_solver(self.phi0), grid_idcs, None)
+            res.append(self._observables(self._from_solver(phi, self.phi0), 
+                                         observables, mag))
+            if dbg > 1:
+                print ("{0}::solve_time_series(): profile {1} done, " + 
+                       "{2} steps.").format(self.cname, len(res), nsteps)
+
+        if dbg > 0:
+            print ("{0}::solve_time_series(): {1} profiles solved in " + 
+                   "{2} sec").format(self.cname, len(res), time() - start)
+
+        return np.array(res)
+
+    def solve_zenith_scan(self, thetas, observables, mag=0.):
+        """Solves the cascade equations for several zenith angles in a 
+        single integration.
+
+        The state vectors for all angles are stored as columns of a 
+        matrix, which is advanced on a common grid in slant depth 
+        :math:`X` using the batched kernels, e.g. 
+        :func:`kernels.kern_numpy_batch`. The density :math:`\\rho(X)` is 
+        applied column-wise and each column stops at its own surface depth.
+        Interaction and decay matrices are shared, such that each step 
+        requires only one pass over the matrices for the entire scan.
+
+        The density splines are calculated for the exact angles. The 
+        atmosphere cache, which returns the spline of a cached angle less 
+        than 1 degree away, is only used for angles found in the cache, 
+        such that close angles of the scan are not merged.
+
+        Args:
+          thetas (list of floats): zenith angles :math:`\\theta` in degrees
+          observables (list of str): particle names in the format accepted
+            by :func:`get_solution`
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+        Returns:
+          (numpy.array): fluxes of shape (len(thetas), len(observables), :attr:`d`)
+        """
+        from copy import copy
+
+        if self.atm_config == None or not bool(self.atm_model):
+            raise Exception(
+                'MCEqRun::solve_zenith_scan(): The zenith scan requires ' +
+                'an initialized atmospheric model, see set_atm_model().')
+
+        atm_models = []
+        for theta_deg in thetas:
+            atm = copy(self.atm_model)
+            atm.set_theta(theta_deg)
+            if atm.theta_deg != theta_deg:
+                use_atm_cache = config['use_atm_cache']
+                config['use_atm_cache'] = False
+                try:
+                    atm.set_theta(theta_deg)
+                finally:
+                    config['use_atm_cache'] = use_atm_cache
+            atm_models.append(atm)
+
+        monitor = self._init_monitor(max([atm.X_surf for atm in atm_models]))
+        nsteps, dX, rho_inv = self._gen_batch_integration_path(
+            atm_models, monitor)
+        monitor.finish()
+
+        if dbg > 0:
+            print ("{0}::solve_zenith_scan(): Solver will perform {1} " + 
+                   "integration steps for {2} angles.").format(
+                    self.cname, nsteps, len(thetas))
+
+        kernel = self._get_kernel(batch=True)
+        int_m, dec_m = self._kernel_matrices()
+        phi = np.repeat(self._to_solver(self.phi0)[:, np.newaxis], 
+                        len(thetas), axis=1)
+
+        monitor = self._init_monitor(nsteps, dX, rho_inv)
+        start = time()
+
+        phi = self._from_solver(kernel(nsteps, dX, rho_inv, int_m, 
+                                       dec_m, phi, monitor),
+                                self.phi0[:, np.newaxis])
+
+        monitor.finish()
+        if dbg > 0:
+            print ("\n{0}::solve_zenith_scan(): time elapsed during " +
+                   "integration: {1} sec").format(self.cname, time() - start)
+
+        return np.array([self._observables(phi[:, i], observables, mag)
+                         for i in xrange(len(thetas))])
+
+    def _gen_batch_integration_path(self, atm_models, monitor=None):
+        """Calculates a common integration path for several density profiles.
+
+        The step size is limited by the lowest density among the profiles
+        at the current depth. Once the depth exceeds the surface depth of 
+        a profile, the step sizes of the corresponding column are set to 0. 
+        The last step of each column ends exactly at its surface.
+
+        Args:
+          atm_models (list): instances of :class:`MCEq.density_profiles.CascadeAtmosphere`
+            with zenith angles already set
+          monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+        Returns:
+          (tuple): (nsteps, dX, rho_inv) where dX and rho_inv have the 
+          shape (nsteps, len(atm_models))
+        """
+        X_surf = np.array([atm.X_surf for atm in atm_models])
+        max_ldec = self.max_ldec
+
+        dX_vec = []
+        rho_inv_vec = []
+
+        X = 0.
+        step = 0
+        next_report = 0 if monitor else -1
+        while X < np.max(X_surf):
+            active = X < X_surf
+            ri_x = np.array([atm.r_X2rho(X) if act else 0.
+                             for atm, act in zip(atm_models, active)])
+            if step == next_report:
+                monitor.update(X, X=X, rho_inv=ri_x)
+                next_report += monitor.stride
+            dX = 1. / max(max_ldec * np.max(ri_x), self.max_lint)
+            dX_vec.append(np.where(active, np.minimum(dX, X_surf - X), 0.))
+            rho_inv_vec.append(ri_x)
+            X = X + dX
+            step += 1
+
+        dX_vec = np.array(dX_vec, dtype=np.float64)
+        rho_inv_vec = np.array(rho_inv_vec, dtype=np.float64)
+        return dX_vec.shape[0], dX_vec, rho_inv_vec
+
+    def _stream_integration_paths(self, atmospheres, theta_deg, prefetch=2):
+        """Generator, which yields integration paths for a sequence of
+        density profiles.
+
+        The splines and paths are calculated in a separate thread, such that 
+        at most ``prefetch`` paths are computed ahead of the consumer. If 
+        the consumer stops early, e.g. due to an exception in the kernel, 
+        the thread finishes the current path and exits.
+
+        Args:
+          atmospheres (iterable): see :func:`solve_time_series`
+          theta_deg (float): zenith angle :math:`\\theta` in degrees
+          prefetch (int, optional): size of the path queue
+        Yields:
+          (tuple): integration path as in :attr:`integration_path`
+        """
+        import sys
+        from threading import Thread, Event
+        from Queue import Queue, Full
+        from MCEq.density_profiles import CascadeAtmosphere
+
+        queue = Queue(maxsize=prefetch)
+        stop = Event()
+
+        def put(item):
+            # returns False if the consumer has stopped
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for atm in atmospheres:
+                    if stop.is_set():
+                        return
+                    if not isinstance(atm, CascadeAtmosphere):
+                        atm = self._create_atm_model(atm)
+                    atm.set_theta(theta_deg)
+                    if not put((None, self._gen_integration_path(atm, None))):
+                        return
+                put((None, None))
+            except Exception:
+                put((sys.exc_info(), None))
+
+        producer = Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+
+        try:
+            while True:
+                exc_info, path = queue.get()
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                if path is None:
+                    break
+                yield path
+        finally:
+            stop.set()
+            producer.join()
+
+    def compute_response(self, observables, fname=None):
+        """Computes the response of the observables at the surface to
+        the nucleon part of the initial state.
+
+        Each proton and neutron energy bin is integrated as a unit initial
+        state. The columns are advanced together with the batched kernels,
+        e.g. :func:`kernels.kern_numpy_batch`, in groups of
+        ``response_batch_size`` columns along the current integration path.
+        The result depends on the zenith angle, the atmosphere and the
+        matrices, but not on the primary model, see :mod:`MCEq.response`.
+
+        Args:
+          observables (list of str): particle names in the format
+            accepted by :func:`get_solution`
+          fname (str, optional): if specified, the table is also written
+            to this file
+        Returns:
+          (:class:`MCEq.response.ResponseTable`): response table
+        """
+        from MCEq.response import ResponseTable
+
+        if not self.integration_path:
+            self._calculate_integration_path(None, 'X')
+        nsteps, dX, rho_inv, _ = self.integration_path
+
+        inputs = np.hstack([np.arange(self.pdg2pref[pdgid].lidx(),
+                                      self.pdg2pref[pdgid].uidx())
+                            for pdgid in [2212, 2112]])
+        batch_size = max(1, int(config['response_batch_size']))
+
+        if dbg > 0:
+            print ("{0}::compute_response(): Solver will perform {1} " +
+                   "integration steps for {2} columns.").format(
+                    self.cname, nsteps, inputs.size)
 
-    def _forward_euler(self, int_grid=None, grid_var='X'):
+        proj_m = self._obs_projection(observables)
+        kernel = self._get_kernel(batch=True)
+        int_m, dec_m = self._kernel_matrices()
+        G = np.zeros((proj_m.shape[0], inputs.size))
 
+        monitor = self._init_monitor(inputs.size)
+        start = time()
+
+        for first in xrange(0, inputs.size, batch_size):
+            cols = inputs[first:first + batch_size]
+            phi = np.zeros((self.dim_states, cols.size))
+            phi[cols, np.arange(cols.size)] = 1.
+            res = kernel(nsteps,
+                         np.broadcast_to(dX[:, np.newaxis],
+                                         (nsteps, cols.size)),
+                         np.broadcast_to(rho_inv[:, np.newaxis],
+                                         (nsteps, cols.size)),
+                         int_m, dec_m, self._to_solver(phi), None)
+            G[:, first:first + cols.size] = proj_m.dot(
+                self._from_solver(res, phi))
+            if monitor:
+                monitor.update(first + cols.size)
+
+        monitor.finish()
+        print ("\n{0}::compute_response(): time elapsed during " +
+               "integration: {1} sec").format(self.cname, time() - start)
+
+        table = ResponseTable(G, observables, self.e_grid,
+            {'theta_deg': self.atm_model.theta_deg,
+             'atm_config': self.atm_config,
+             'interaction_model': self.yields_params['interaction_model']})
+        if fname != None:
+            table.save(fname)
+
+        return table
+
+    def evaluate_response(self, table, mclass, tag, mag=0.):
+        """Computes the fluxes of the observables in a response table for
+        a primary model, without integrating the cascade equations.
+
+        The initial state is constructed in the same way as in
+        :func:`set_primary_model`, but :attr:`phi0` is not modified.
+
+        Args:
+          table (:class:`MCEq.response.ResponseTable`): table from
+            :func:`compute_response` or :func:`MCEq.response.load_response`
+          mclass (:class:`CRFluxModel.PrimaryFlux`): reference to primary
+            model class
+          tag (tuple): positional argument list for model class
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+        Returns:
+          (numpy.array): fluxes of shape (len(observables), :attr:`d`)
+        """
+        if not np.allclose(table.e_grid, self.e_grid):
+            raise Exception('MCEqRun::evaluate_response(): The energy ' +
+                            'grid of the table does not match.')
+        return table.evaluate_model(mclass(tag), mag)
+
+    def _get_kernel(self, batch=False):
+        """Selects the forward-euler kernel from the registry in
+        :mod:`MCEq.kernels` according to the ``kernel_config`` and 
+        ``use_sparse`` settings.
+
+        If ``kernel_config`` is ``'auto'``, the fastest kernel is determined
+        by :func:`_tune_kernel`. The selected number of MKL threads is bound
+        to the returned kernel and does not change ``MKL_threads``. If the 
+        library of the configured backend is not installed, the :mod:`numpy`
+        kernel is used instead.
+
+        Args:
+          batch (bool, optional): select the kernel integrating a 
+            matrix of state vectors, e.g. :func:`kernels.kern_numpy_batch`
+        Returns:
+          (function): kernel function
+        Raises:
+          Exception: if combination of settings is not supported
+        """
+        import kernels
+
+        backend = config['kernel_config']
+        if backend == 'auto':
+            choice = self._tune_kernel()
+            backend, fmt = choice['backend'], choice['format']
+            if (backend, fmt, batch) not in kernels.kernel_registry:
+                backend = 'numpy'
+            elif choice['threads'] != None:
+                from functools import partial
+                return partial(kernels.get_kernel(backend, fmt, batch),
+                               threads=choice['threads'])
+        else:
+            fmt = config['sparse_format'] if config['use_sparse'] else 'dense'
+            if (backend in kernels.backend_available and
+                not kernels.backend_available[backend]()):
+                print ("{0}::_get_kernel(): Libraries for kernel '{1}' " + 
+                       "not available, falling back to numpy.").format(
+                        self.cname, backend)
+                backend = 'numpy'
+            elif (batch and (backend, fmt, True) not in 
+                  kernels.kernel_registry):
+                # e.g. 'active' integrates single state vectors
+                backend = 'numpy'
+
+        return kernels.get_kernel(backend, fmt, batch)
+
+    def _tune_kernel(self):
+        """Selects the fastest kernel for the current matrices using 
+        :func:`MCEq.autotune.tune_kernel` and converts copies of the 
+        matrices into the required format. The selection is kept until 
+        the matrices are rebuilt. :attr:`int_m` and :attr:`dec_m` keep 
+        their format and precision.
+
+        Returns:
+          (dict): selection, see :func:`MCEq.autotune.tune_kernel`
+        """
+        import kernels
+        from MCEq.autotune import tune_kernel
+
+        if getattr(self, '_kernel_choice', None) == None:
+            self._kernel_choice = tune_kernel(self.int_m, self.dec_m,
+                                              self._to_solver(self.phi0), 
+                                              self._solver_d)
+            self._tuned_m = None
+        if getattr(self, '_tuned_m', None) == None:
+            convert = kernels.matrix_formats[self._kernel_choice['format']]
+            self._tuned_m = (convert(self.int_m, self._solver_d),
+                             convert(self.dec_m, self._solver_d))
+
+        return self._kernel_choice
+
+    def _kernel_matrices(self):
+        """Returns the interaction and decay matrices in the format of the
+        kernel returned by :func:`_get_kernel`."""
+        if config['kernel_config'] != 'auto':
+            return self.int_m, self.dec_m
+        self._tune_kernel()
+        return self._tuned_m
+
+    def compact_accuracy_report(self, dtype='float32', rel_cut=1e-20):
+        """Compares the :class:`MCEq.formats.CompactCSR` representation of
+        the matrices with the double precision CSR representation on 
+        the current integration path.
+
+        Both calculations start from :attr:`phi0`. The deviation is 
+        calculated for each particle species at the surface, considering
+        only bins where the reference flux is larger than ``rel_cut`` 
+        times the largest flux of the species.
+
+        Args:
+          dtype (str, optional): precision of the compact values
+          rel_cut (float, optional): relative threshold for the comparison
+        Returns:
+          (dict): with keys 'bytes_csr' and 'bytes_compact' (bytes read from
+          the matrices per step) and 'max_rel_dev', a dictionary of the 
+          largest relative deviation per particle name
+        """
+        import kernels
+        from MCEq.formats import CompactCSR, to_csr
+
+        if not self.integration_path:
+            self._calculate_integration_path(None, 'X')
+        nsteps, dX, rho_inv, _ = self.integration_path
+
+        csr = [to_csr(m).astype(np.float64) for m in [self.int_m, self.dec_m]]
+        compact = [CompactCSR(m, self._solver_d, dtype) for m in csr]
+
+        ref, _ = kernels.kern_numpy(nsteps, dX, rho_inv, csr[0], csr[1],
+                                    self._to_solver(self.phi0), [])
+        kernel = (kernels.kern_compact if kernels.backend_available['numba']()
+                  else kernels.kern_numpy)
+        sol, _ = kernel(nsteps, dX, rho_inv, compact[0], compact[1],
+                        self._to_solver(self.phi0), [])
+        ref = self._from_solver(ref, self.phi0)
+        sol = self._from_solver(sol, self.phi0)
+
+        max_rel_dev = {}
+        for p in self.cascade_particles:
+            r, c = ref[p.lidx():p.uidx()], sol[p.lidx():p.uidx()]
+            sel = np.abs(r) > rel_cut * np.max(np.abs(r))
+            max_rel_dev[p.name] = (np.max(np.abs(c[sel] / r[sel] - 1.))
+                                   if np.any(sel) else 0.)
+
+        report = {'bytes_csr': sum([m.data.nbytes + m.indices.nbytes + 
+                                    m.indptr.nbytes for m in csr]),
+                  'bytes_compact': sum([m.nbytes for m in compact]),
+                  'max_rel_dev': max_rel_dev}
+
+        print ("{0}::compact_accuracy_report(): {1} bytes per step " + 
+               "for CSR, {2} for compact {3}.").format(self.cname,
+                report['bytes_csr'], report['bytes_compact'], dtype)
+        for pname in sorted(max_rel_dev, key=max_rel_dev.get, reverse=True):
+            print "    {0:15s}: {1:8.3g}".format(pname, max_rel_dev[pname])
+
+        return report
+
+    def _forward_euler(self, int_grid=None, grid_var='X', observables=None):
+        """Integrates the cascade equations with the forward-euler method.
+
+        Args:
+          int_grid (numpy.array, optional): grid of depths, at which 
+            intermediate (longitudinal) solutions are saved
+          grid_var (str, optional): variable of ``int_grid``, see
+            :func:`_convert_int_grid`
+          observables (list of str, optional): if specified, only the 
+            fluxes of these observables are saved on ``int_grid``
+            instead of the full state vector. The projection 
+            :func:`_obs_projection` is applied inside the kernel.
+        """
         # Calculate integration path if not yet happened
         self._calculate_integration_path(int_grid, grid_var)
 
-        phi0 = np.copy(self.phi0)
         nsteps, dX, rho_inv, grid_idcs = self.integration_path
 
         if dbg > 0:
             print ("{0}::_forward_euler(): Solver will perform {1} " + 
                    "integration steps.").format(self.cname, nsteps)
 
-        self._init_progress_bar(nsteps)
-        self.progressBar.start()
+        grid_sol, proj_m = self._init_grid_sol(observables)
+        
+        self.solution, self.grid_sol = self._integrate(self.phi0, 0, 
+                                                       grid_sol, proj_m)
+
+    def _init_grid_sol(self, observables, resume=False):
+        """Creates the sink for the longitudinal solutions and the 
+        projection matrix for the current integration path.
+
+        Args:
+          observables (list of str): observables to be saved or ``None``
+          resume (bool, optional): reopen the storage of an interrupted
+            integration, see :func:`MCEq.snapshots.make_sink`
+        Returns:
+          (tuple): (sink, projection matrix or ``None``)
+        """
+        from MCEq.snapshots import make_sink
+
+        grid_idcs = self.integration_path[3]
+        proj_m = None
+        self.grid_obs = None
+        if observables != None and grid_idcs:
+            proj_m = self._obs_projection(observables)
+            self.grid_obs = list(observables)
+        proj_m = self._solver_projection(proj_m)
+        grid_sol = make_sink(len(grid_idcs), self.dim_states if proj_m is None
+                             else proj_m.shape[0], resume)
+
+        return grid_sol, proj_m
+
+    def _integrate(self, phi_in, step_start, grid_sol, proj_m):
+        """Runs the kernel along :attr:`integration_path` starting from
+        step ``step_start``.
+
+        If ``checkpoint_interval`` in :mod:`mceq_config` is larger than 0,
+        the path is integrated in segments of this number of steps and
+        a checkpoint is written after each segment, see :func:`resume`.
+
+        Args:
+          phi_in (numpy.array): state vector at step ``step_start`` in 
+            natural order
+          step_start (int): index of the first step
+          grid_sol (object): sink for longitudinal solutions
+          proj_m (scipy.sparse.csr_matrix): projection matrix for state
+            vectors of the solver or ``None``, see 
+            :func:`_solver_projection`
+        Returns:
+          (tuple): (state vector at the end of the path in natural order, 
+          sink)
+        """
+        from MCEq.snapshots import OffsetSink
+
+        nsteps, dX, rho_inv, grid_idcs = self.integration_path
+        interval = config['checkpoint_interval']
+        seg_len = interval if interval > 0 else nsteps
+
+        monitor = self._init_monitor(nsteps, dX, rho_inv)
 
         start = time()
 
-        import kernels
-        if config['kernel_config'] == 'numpy':
-            kernel = kernels.kern_numpy
+        kernel = self._get_kernel()
+        int_m, dec_m = self._kernel_matrices()
+
+        # snapshots of decoupled sinks include their initial values
+        phi = self._to_solver(phi_in)
+        sink = grid_sol
+        if self._sink_maps is not None:
+            offset = self._sink_maps[0].dot(phi_in)
+            if self.grid_obs is not None:
+                offset = self._obs_projection(self.grid_obs).dot(offset)
+            sink = OffsetSink(grid_sol, offset)
+
+        step = step_start
+        while step < nsteps:
+            end = min(step + seg_len, nsteps)
+            seg_idcs = [idx - step for idx in grid_idcs if step <= idx < end]
+            phi, _ = kernel(end - step, dX[step:end], rho_inv[step:end],
+                int_m, dec_m, phi, seg_idcs, 
+                monitor if interval <= 0 else None,
+                sink, proj_m)
+            step = end
+            if interval > 0:
+                monitor.update(step)
+                self._save_checkpoint(self._from_solver(phi, phi_in), step, 
+                                      grid_sol)
+
+        grid_sol.finish()
+        monitor.finish()
+        self.solution_X = np.sum(dX, dtype='double')
 
-        elif (config['kernel_config'] == 'CUDA' and 
-              config['use_sparse'] == False):
-            kernel = kernels.kern_CUDA_dense
-        
-        elif (config['kernel_config'] == 'CUDA' and 
-              config['use_sparse'] == True):
-            kernel = kernels.kern_CUDA_sparse
+        print ("\n{0}::_forward_euler(): time elapsed during " + 
+               "integration: {1} sec").format(self.cname, time() - start)
 
-        elif (config['kernel_config'] == 'MKL' and 
-              config['use_sparse'] == True):
-            kernel = kernels.kern_MKL_sparse
-        else:
+        return self._from_solver(phi, phi_in), grid_sol
+
+    def _save_checkpoint(self, phi, step, grid_sol):
+        """Writes the state vector, the position on the integration path
+        and the number of longitudinal solutions collected so far to the
+        file ``checkpoint_file`` defined in :mod:`mceq_config`.
+
+        The longitudinal solutions are made persistent by the sink, see
+        :func:`MCEq.snapshots.SnapshotSink.save`. Solutions kept in memory
+        are appended to the file ``checkpoint_file + '.grid_sol'``, such
+        that each solution is written once. The checkpoint is first 
+        written to a temporary location and then renamed, such that an
+        interruption does not leave a corrupt checkpoint behind.
+        """
+        import os
+        fname = config['checkpoint_file']
+        int_grid = self.int_grid if self.int_grid is not None else []
+
+        grid_sol.save(fname + '.grid_sol')
+        with open(fname + '.tmp', 'wb') as f:
+            np.savez(f, phi=phi, step=step,
+                     nsteps=self.integration_path[0],
+                     theta_deg=self.atm_model.theta_deg,
+                     int_grid=np.array(int_grid, dtype='double'),
+                     grid_var=self.grid_var,
+                     observables=np.array(self.grid_obs or [], dtype=str),
+                     n_snapshots=len(grid_sol))
+        os.rename(fname + '.tmp', fname)
+
+        if dbg > 1:
+            print ("{0}::_save_checkpoint(): step {1} saved to " + 
+                   "{2}.").format(self.cname, step, fname)
+
+    def resume(self, fname=None):
+        """Continues an interrupted integration from a checkpoint.
+
+        Checkpoints are written by the forward-euler integrator if 
+        ``checkpoint_interval`` in :mod:`mceq_config` is set. The 
+        zenith angle, the grid of the longitudinal solutions and the 
+        position on the integration path are restored from the file. 
+        The matrices and the initial condition have to be configured 
+        in the same way as for the interrupted run. Longitudinal solutions
+        in a ``grid_sol_file`` (``'memmap'`` storage) are continued in
+        this file.
+
+        Args:
+          fname (str, optional): checkpoint file, default is 
+            ``checkpoint_file`` from :mod:`mceq_config`
+        Raises:
+          Exception: if the integration path does not match the checkpoint
+        """
+        fname = config['checkpoint_file'] if fname == None else fname
+        ckpt = np.load(fname)
+
+        theta_deg = float(ckpt['theta_deg'])
+        int_grid = ckpt['int_grid'] if ckpt['int_grid'].size else None
+        observables = [str(obs) for obs in ckpt['observables']] or None
+
+        if self.atm_model.theta_deg != theta_deg:
+            self.set_theta_deg(theta_deg)
+        self._calculate_integration_path(int_grid, str(ckpt['grid_var']))
+
+        if self.integration_path[0] != int(ckpt['nsteps']):
             raise Exception(
-                ("MCEq::_forward_euler(): " + 
-                "Unsupported integrator settings '{0}/{1}'."
-                 ).format(
-                'sparse' if config['use_sparse'] else 'dense',
-                config['kernel_config']))
-        
-        
-        self.solution, self.grid_sol = kernel(nsteps, dX, rho_inv,
-            self.int_m, self.dec_m, phi0, grid_idcs, self.progressBar)
+                'MCEqRun::resume(): The integration path does not match ' + 
+                'the checkpoint {0}.'.format(fname))
+
+        step = int(ckpt['step'])
+        if dbg > 0:
+            print ("{0}::resume(): Continuing at step {1} of {2}.").format(
+                self.cname, step, self.integration_path[0])
 
-        self.progressBar.finish()
+        grid_sol, proj_m = self._init_grid_sol(observables, resume=True)
+        grid_sol.load(fname + '.grid_sol', int(ckpt['n_snapshots']))
 
-        print ("\n{0}::_forward_euler(): time elapsed during " + 
+        self.solution, self.grid_sol = self._integrate(
+            np.array(ckpt['phi']), step, grid_sol, proj_m)
+
+    def extend_to(self, X):
+        """Continues the current solution to a larger slant depth.
+
+        The integration starts from :attr:`solution` at the depth 
+        :attr:`solution_X`, where the previous integration stopped. Only 
+        the path segment between these depths is calculated and integrated,
+        e.g. to obtain the flux at a lower observation level. The density
+        spline is not extrapolated, i.e. the current density profile has to
+        cover ``X``, see ``h_obs`` in :mod:`mceq_config`.
+
+        Args:
+          X (float): target slant depth in g/cm**2
+        Raises:
+          Exception: if ``X`` is not larger than :attr:`solution_X` or 
+            beyond the surface depth of the density profile
+        """
+        if getattr(self, 'solution_X', None) == None:
+            raise Exception('MCEqRun::extend_to(): No solution to extend.')
+        if X <= self.solution_X:
+            raise Exception(
+                ('MCEqRun::extend_to(): The solution has already been ' + 
+                 'calculated up to X={0:5.3g} g/cm2.').format(self.solution_X))
+
+        nsteps, dX, rho_inv, _ = self._gen_integration_path(
+            self.atm_model, None, X_start=self.solution_X, X_end=X)
+
+        if dbg > 0:
+            print ("{0}::extend_to(): Integrating {1} steps from " + 
+                   "X={2:5.3g} to X={3:5.3g} g/cm2.").format(
+                    self.cname, nsteps, self.solution_X, X)
+
+        kernel = self._get_kernel()
+        int_m, dec_m = self._kernel_matrices()
+        phi, _ = kernel(nsteps, dX, rho_inv, int_m, dec_m,
+                        self._to_solver(self.solution), [], None)
+        self.solution = self._from_solver(phi, self.solution)
+        self.solution_X = X
+
+    def solve_adjoint(self, observable, weights=None):
+        """Computes the importance of each element of the initial state
+        for a weighted observable at the surface.
+
+        The forward-euler integration maps the initial state onto the
+        surface state via the product of the step matrices
+        :math:`M_i = 1 + \\Delta X_i (\\boldsymbol{C} +
+        \\frac{1}{\\rho(X_i)}\\boldsymbol{D})`. The adjoint state
+        :math:`\\Psi` starts from the observable weights at the surface and
+        is advanced with the transposed matrices :math:`M_i^T` along the
+        reversed integration path. The result fulfills
+
+        .. math::
+
+           \\sum_k w_k \\Phi_{obs}(E_k, X_{surf}) = \\Psi \\cdot \\Phi_0
+
+        for any initial state :math:`\\Phi_0`, such that a single
+        backward integration replaces one forward integration per initial
+        condition or source term. The current :attr:`integration_path` is
+        reused or calculated as in :func:`solve`.
+
+        Args:
+          observable (str): particle name in the format accepted by
+            :func:`get_solution`
+          weights (numpy.array, optional): weights :math:`w_k` of the
+            energy bins, e.g. an indicator of an energy range. Default is
+            the sum over all bins.
+        Returns:
+          (numpy.array): importance function :math:`\\Psi` of size
+          :attr:`dim_states` in natural order
+        """
+        if not self.integration_path:
+            self._calculate_integration_path(None, 'X')
+        nsteps, dX, rho_inv, _ = self.integration_path
+
+        weights = np.ones(self.d) if weights is None else np.asarray(weights)
+        if weights.shape != (self.d,):
+            raise Exception(('MCEqRun::solve_adjoint(): Expected {0} ' +
+                             'weights, got {1}.').format(self.d, weights.shape))
+
+        obs_m = self._obs_projection([observable])
+        proj_m = self._solver_projection(obs_m)
+        psi = np.asarray(proj_m.T.dot(weights), dtype='double')
+
+        if dbg > 0:
+            print ("{0}::solve_adjoint(): Solver will perform {1} " +
+                   "integration steps.").format(self.cname, nsteps)
+
+        kernel = self._get_kernel()
+        int_t, dec_t = self._adjoint_matrices()
+
+        monitor = self._init_monitor(nsteps)
+        start = time()
+
+        psi, _ = kernel(nsteps, np.ascontiguousarray(dX[::-1]),
+                        np.ascontiguousarray(rho_inv[::-1]), int_t, dec_t,
+                        psi, [], monitor)
+
+        monitor.finish()
+        print ("\n{0}::solve_adjoint(): time elapsed during " +
+               "integration: {1} sec").format(self.cname, time() - start)
+
+        psi = self._adjoint_from_solver(psi)
+        if self._sink_maps is not None:
+            # decoupled sinks keep their initial values
+            psi += self._sink_maps[0].T.dot(obs_m.T.dot(weights))
+        return psi
+
+    def _adjoint_matrices(self):
+        """Returns the transposed interaction and decay matrices in the
+        format of the current kernel. They are kept until the matrices
+        are replaced."""
+        import kernels
+
+        cached = getattr(self, '_adjoint_m', None)
+        if (cached == None or cached[0] is not self.int_m or
+            cached[1] is not self.dec_m):
+            if config['kernel_config'] == 'auto':
+                fmt = self._tune_kernel()['format']
+            else:
+                fmt = config['sparse_format'] if config['use_sparse'] else 'dense'
+            to_csr = kernels.matrix_formats['csr']
+            self._adjoint_m = (self.int_m, self.dec_m) + tuple(
+                kernels.matrix_formats[fmt](to_csr(m, None).T.tocsr(),
+                                            self._solver_d)
+                for m in [self.int_m, self.dec_m])
+
+        return self._adjoint_m[2:]
+
+    def _adjoint_from_solver(self, psi):
+        """Applies the transpose of :func:`_to_solver` to an adjoint
+        state, i.e. returns the importance of the natural state vector."""
+        res = psi if self._perm is None else psi[self._perm_inv]
+        res = (res if self._solver_maps is None
+               else self._solver_maps[0].T.dot(res))
+        return np.copy(res) if res is psi else res
+
+    def solve_sensitivity(self, params, observables, mag=0.):
+        """Computes the fluxes of observables and their derivatives with
+        respect to scalings of blocks of the yield matrix :math:`C`.
+
+        The parameter :math:`\\epsilon_j` multiplies the yields of a
+        secondary from a projectile by :math:`1 + \\epsilon_j`, optionally
+        only in a range of the energy fraction
+        :math:`x = E_{sec} / E_{proj}`, the lab-frame approximation of
+        :math:`x_F`. The derivatives at :math:`\\epsilon = 0` are integrated
+        together with the state vector by
+        :func:`kernels.kern_numpy_tangent`, such that one integration
+        replaces two reruns per parameter for finite differences.
+
+        Only the block of the secondary in :math:`C` is scaled, i.e.
+        products of the secondary, which are added to other species by the
+        resonance approximation, are not varied.
+
+        Args:
+          params (list of tuples): (projectile, secondary) or
+            (projectile, secondary, (x_min, x_max)) with particle names
+            as in :attr:`pname2pref`
+          observables (list of str): particle names in the format
+            accepted by :func:`get_solution`
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+        Returns:
+          (tuple): fluxes of shape (len(observables), :attr:`d`) and
+          derivatives of shape (len(params), len(observables), :attr:`d`)
+        """
+        import kernels
+        from scipy.sparse import vstack
+
+        if not self.integration_path:
+            self._calculate_integration_path(None, 'X')
+        nsteps, dX, rho_inv, _ = self.integration_path
+
+        int_m = self._natural_matrices()[0]
+        derivs = [self._yield_derivative(int_m, param) for param in params]
+        sens_m = vstack([self._solver_operator(deriv) 
+                         for deriv in derivs]).tocsr()
+
+        phi = np.zeros((sens_m.shape[1], 1 + len(params)))
+        phi[:, 0] = self._to_solver(self.phi0)
+        phi_in = np.zeros((self.dim_states, 1 + len(params)))
+        phi_in[:, 0] = self.phi0
+
+        if dbg > 0:
+            print ("{0}::solve_sensitivity(): Solver will perform {1} " +
+                   "integration steps for {2} parameters.").format(
+                    self.cname, nsteps, len(params))
+
+        monitor = self._init_monitor(nsteps, dX, rho_inv)
+        start = time()
+
+        phi = kernels.kern_numpy_tangent(nsteps, dX, rho_inv, self.int_m, 
+                                         self.dec_m, phi, sens_m, monitor)
+        u = self._sink_integrals(phi[:, 0])
+        phi = self._from_solver(phi, phi_in)
+        if u is not None:
+            # derivative of the restored sinks, see sink_reduction()
+            for i, deriv in enumerate(derivs):
+                phi[:, 1 + i] += self._sink_maps[0].dot(deriv.dot(u))
+
+        monitor.finish()
+        print ("\n{0}::solve_sensitivity(): time elapsed during " +
+               "integration: {1} sec").format(self.cname, time() - start)
+
+        return self._tangent_observables(phi, observables, mag)
+
+    def solve_atmosphere_sensitivity(self, variations, observables, mag=0.):
+        """Computes the fluxes of observables and their derivatives with
+        respect to parameters of the density profile.
+
+        The derivatives of :math:`\\frac{1}{\\rho}` along the current 
+        :attr:`integration_path` and of the surface depth are obtained from
+        :func:`MCEq.density_profiles.CascadeAtmosphere.r_X2rho_derivatives`,
+        without calculating a spline for each variant of the profile. 
+        They are integrated together with the state vector by 
+        :func:`kernels.kern_numpy_tangent`. The shift of the surface adds
+        the derivative of the state vector with respect to :math:`X` at 
+        the end of the path.
+
+        Example:
+          Derivatives with respect to the density in two height layers
+          and to a parameter of a CORSIKA profile::
+
+            $ atm = mceq_run.atm_model
+            $ variations = (atm.layer_variations([(0., 1e6), (1e6, 2e6)]) +
+                            atm.parameter_variations([('c', 1)]))
+            $ flux, deriv = mceq_run.solve_atmosphere_sensitivity(
+                  variations, ['mu+', 'numu'])
+
+        Args:
+          variations (list of functions): derivatives of the density with
+            respect to the parameters as functions of the height in cm, e.g.
+            from :func:`MCEq.density_profiles.CascadeAtmosphere.layer_variations`
+          observables (list of str): particle names in the format
+            accepted by :func:`get_solution`
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+        Returns:
+          (tuple): fluxes of shape (len(observables), :attr:`d`) and
+          derivatives of shape (len(variations), len(observables), :attr:`d`)
+        """
+        import kernels
+
+        if not self.integration_path:
+            self._calculate_integration_path(None, 'X')
+        nsteps, dX, rho_inv, _ = self.integration_path
+
+        X = np.cumsum(dX, dtype='double') - dX
+        drho_inv, dX_surf = self.atm_model.r_X2rho_derivatives(X, variations)
+
+        phi = np.zeros((self.int_m.shape[0], 1 + len(variations)))
+        phi[:, 0] = self._to_solver(self.phi0)
+        phi_in = np.zeros((self.dim_states, 1 + len(variations)))
+        phi_in[:, 0] = self.phi0
+
+        if dbg > 0:
+            print ("{0}::solve_atmosphere_sensitivity(): Solver will " + 
+                   "perform {1} integration steps for {2} parameters."
+                   ).format(self.cname, nsteps, len(variations))
+
+        monitor = self._init_monitor(nsteps, dX, rho_inv)
+        start = time()
+
+        phi = kernels.kern_numpy_tangent(nsteps, dX, rho_inv, self.int_m,
+            self.dec_m, phi, None, monitor, drho_inv)
+        ri_surf = self.atm_model.r_X2rho(np.sum(dX, dtype='double'))
+        phi[:, 1:] += np.outer(self.int_m.dot(phi[:, 0]) + 
+                               self.dec_m.dot(phi[:, 0]) * ri_surf, dX_surf)
+
+        monitor.finish()
+        print ("\n{0}::solve_atmosphere_sensitivity(): time elapsed " +
+               "during integration: {1} sec").format(self.cname, 
+                                                     time() - start)
+
+        return self._tangent_observables(self._from_solver(phi, phi_in), 
+                                         observables, mag)
+
+    def _tangent_observables(self, phi, observables, mag):
+        """Stores the state vector in the first column of ``phi`` as 
+        :attr:`solution` and projects all columns onto the observables.
+
+        Returns:
+          (tuple): fluxes and derivatives, see :func:`solve_sensitivity`
+        """
+        self.solution = phi[:, 0]
+        self.solution_X = np.sum(self.integration_path[1], dtype='double')
+
+        res = (self._obs_projection(observables).dot(phi).T.reshape(
+            phi.shape[1], len(observables), self.d) * self.e_grid ** mag)
+        return res[0], res[1:]
+
+    def solve_ensemble(self, variations, observables, mag=0.):
+        """Computes the fluxes of observables for an ensemble of variations
+        of the interaction matrix in a single integration.
+
+        Each variation is a function, which receives this object and
+        changes the interaction matrix with :func:`scale_yield` and
+        :func:`scale_cross_section`, e.g. with random factors. The
+        variations are applied one after another, each to the current 
+        matrices and interaction lengths, which are restored afterwards.
+        The resulting matrices are
+        combined into a :class:`MCEq.formats.EnsembleCSR` and
+        :attr:`phi0` is integrated for all members together by
+        :func:`kernels.kern_ensemble` along the current
+        :attr:`integration_path`.
+
+        Example:
+          Uncertainty band from random rescalings of the pion yields::
+
+            $ factors = np.random.normal(1., 0.1, 100)
+            $ variations = [lambda run, f=f: run.scale_yield(2212, 211, f)
+                            for f in factors]
+            $ fluxes = mceq_run.solve_ensemble(variations, ['numu'])
+
+        Args:
+          variations (list of functions): modifications of the matrices
+          observables (list of str): particle names in the format
+            accepted by :func:`get_solution`
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+        Returns:
+          (numpy.array): fluxes of shape (len(variations),
+          len(observables), :attr:`d`)
+        """
+        import kernels
+        from MCEq.formats import to_csr, to_ensemble
+
+        if not self.integration_path:
+            self._calculate_integration_path(None, 'X')
+        nsteps, dX, rho_inv, _ = self.integration_path
+
+        int_m, dec_m = self._natural_matrices()
+        Lambda_int = np.copy(self.Lambda_int)
+        integration_path = self.integration_path
+        members, deltas = [], []
+        try:
+            for variation in variations:
+                self.Lambda_int = np.copy(Lambda_int)
+                self._set_solver_matrices(int_m.copy(), dec_m)
+                variation(self)
+                members.append(to_csr(self.int_m))
+                if self._sink_maps is not None:
+                    # the rows of decoupled sinks are restored afterwards
+                    deltas.append(self._natural_matrices()[0] - int_m)
+        finally:
+            self.Lambda_int = Lambda_int
+            self._set_solver_matrices(int_m, dec_m)
+            self.integration_path = integration_path
+        ens_m = to_ensemble(members)
+
+        if dbg > 0:
+            print ("{0}::solve_ensemble(): Solver will perform {1} " +
+                   "integration steps for {2} members.").format(
+                    self.cname, nsteps, len(members))
+
+        phi = np.repeat(self._to_solver(self.phi0)[:, np.newaxis],
+                        len(members), axis=1)
+
+        monitor = self._init_monitor(nsteps, dX, rho_inv)
+        start = time()
+
+        phi = kernels.kern_ensemble(nsteps, dX, rho_inv, ens_m, 
+                                    to_csr(self.dec_m), phi, monitor)
+        u = self._sink_integrals(phi)
+        phi = self._from_solver(phi, self.phi0[:, np.newaxis])
+        for i, delta in enumerate(deltas):
+            phi[:, i] += self._sink_maps[0].dot(delta.dot(u[:, i]))
+
+        monitor.finish()
+        print ("\n{0}::solve_ensemble(): time elapsed during " +
                "integration: {1} sec").format(self.cname, time() - start)
 
+        return (self._obs_projection(observables).dot(phi).T.reshape(
+            len(members), len(observables), self.d) * self.e_grid ** mag)
+
+    def _yield_derivative(self, int_m, param):
+        """Returns the derivative of the natural interaction matrix
+        ``int_m`` with respect to the scaling of a yield, see
+        :func:`solve_sensitivity`."""
+        from scipy.sparse import coo_matrix
+
+        proj, sec = self.pname2pref[param[0]], self.pname2pref[param[1]]
+        x_range = param[2] if len(param) > 2 else (None, None)
+
+        block = int_m[sec.lidx():sec.uidx(),
+                      proj.lidx():proj.uidx()].tocoo()
+        data = np.copy(block.data)
+        if sec is proj:
+            # remove the loss term -Lambda_int from the diagonal
+            diag = block.row == block.col
+            data[diag] += self.Lambda_int[proj.lidx() + block.col[diag]]
+
+        x = self.e_grid[block.row] / self.e_grid[block.col]
+        keep = data != 0.
+        if x_range[0] != None:
+            keep &= x >= x_range[0]
+        if x_range[1] != None:
+            keep &= x <= x_range[1]
+        if not np.any(keep):
+            raise Exception(("MCEqRun::_yield_derivative(): No yields of " +
+                             "{1} from {0} in the selected range.").format(
+                                param[0], param[1]))
+
+        return coo_matrix((data[keep], (sec.lidx() + block.row[keep],
+                                        proj.lidx() + block.col[keep])),
+                          shape=int_m.shape).tocsr()
+
+    def _solver_operator(self, mat):
+        """Transforms a matrix acting on natural state vectors, e.g. a
+        part of the interaction matrix, into the space of the solver.
+
+        Rows of the species decoupled by :func:`decouple_sinks` are 
+        dropped. Their part of the product follows from the integrals 
+        returned by :func:`_sink_integrals`.
+        """
+        from MCEq.formats import to_csr, permute_matrix
+
+        res = to_csr(mat)
+        if self._solver_maps is not None:
+            embed = self._solver_maps[0]
+            res = embed.dot(res).dot(embed.T).tocsr()
+        if self._perm is not None:
+            res = permute_matrix(res, self._perm)
+        return res
+
     def _calculate_integration_path(self, int_grid, grid_var):
 
         print "MCEqRun::_calculate_integration_path():"
@@ -946,31 +2625,113 @@ class MCEqRun():
             np.alltrue(self.grid_var == grid_var)):
             return   
         
+        X_grid = self._convert_int_grid(int_grid, grid_var)
         self.int_grid, self.grid_var = int_grid, grid_var
-        if grid_var != 'X':
-            raise NotImplementedError('MCEqRun::_calculate_integration_path():' + 
-               'choice of grid variable other than the depth X are not possible, yet.')
             
-        X_surf = self.atm_model.X_surf
-        ri = self.atm_model.r_X2rho
+        monitor = self._init_monitor(self.atm_model.X_surf)
+
+        self.integration_path = self._gen_integration_path(
+            self.atm_model, X_grid, monitor)
+
+        monitor.finish()
+
+    def _convert_int_grid(self, int_grid, grid_var):
+        """Converts the grid of intermediate solutions into slant depth.
+
+        Supported grid variables are:
+
+        - ``'X'``: slant depth in g/cm**2
+        - ``'Xv'``: vertical depth in g/cm**2
+        - ``'h'``: height above sea level in cm, e.g. the altitudes of 
+          several detectors. Heights below the observation level 
+          ``h_obs`` are beyond the surface.
+
+        Heights are mapped to slant depths along the current trajectory
+        with :func:`MCEq.density_profiles.CascadeAtmosphere.h2X`. The 
+        intermediate solutions at all levels are saved during a single 
+        integration.
+
+        Args:
+          int_grid (numpy.array): grid values or ``None``
+          grid_var (str): grid variable
+        Returns:
+          (numpy.array): slant depths in g/cm**2 or ``None`` if the grid
+          is ``None`` or empty
+        Raises:
+          NotImplementedError: if ``grid_var`` unknown
+          Exception: if the grid is not ordered along the trajectory or 
+            extends beyond the surface
+        """
+        if int_grid is None or not len(int_grid):
+            return None
+
+        atm = self.atm_model
+        if grid_var == 'X':
+            X_grid = np.array(int_grid, dtype='double')
+        elif grid_var == 'Xv':
+            X_grid = np.array([atm.h2X(atm.depth2height(x_v))
+                               for x_v in int_grid])
+        elif grid_var == 'h':
+            X_grid = np.array([atm.h2X(h_cm) for h_cm in int_grid])
+        else:
+            raise NotImplementedError('MCEqRun::_convert_int_grid():' + 
+               'unknown grid variable {0}.'.format(grid_var))
+
+        if np.any(np.diff(X_grid) <= 0.):
+            raise Exception('MCEqRun::_convert_int_grid(): the grid has ' + 
+                'to be ordered from the top of the atmosphere to the surface.')
+        if X_grid[-1] > atm.X_surf * 1.001:
+            raise Exception('MCEqRun::_convert_int_grid(): the grid ' + 
+                'extends beyond the surface.')
+
+        return np.clip(X_grid, 0., atm.X_surf)
+
+    def _gen_integration_path(self, atm_model, int_grid, monitor=None,
+                              X_start=0., X_end=None):
+        """Calculates the step sizes and inverse densities along the
+        slant depth of a density profile.
+
+        Args:
+          atm_model (:class:`MCEq.density_profiles.CascadeAtmosphere`): density
+            profile with zenith angle already set
+          int_grid (numpy.array): depths :math:`X` in g/cm**2, at which 
+            intermediate solutions are saved, or ``None``
+          monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+          X_start (float,optional): first depth of the path
+          X_end (float,optional): if specified, the path ends at this
+            depth instead of the surface depth of ``atm_model``. The last
+            step is shortened, such that the path ends exactly at this depth.
+        Returns:
+          (tuple): (nsteps, dX, rho_inv, grid_idcs)
+        Raises:
+          Exception: if ``X_end`` is beyond the surface depth of ``atm_model``
+        """
+        if X_end != None and X_end > atm_model.X_surf:
+            raise Exception(
+                ("MCEqRun::_gen_integration_path(): X={0:5.3g} g/cm2 is " +
+                 "beyond the surface depth {1:5.3g} g/cm2 of the density " +
+                 "profile. Decrease h_obs to cover deeper levels.").format(
+                    X_end, atm_model.X_surf))
+        X_surf = atm_model.X_surf if X_end == None else X_end
+        ri = atm_model.r_X2rho
         max_ldec = self.max_ldec
 
         dX_vec = []
         rho_inv_vec = []
         
-        X = 0.
+        X = X_start
         step = 0
         grid_step = 0
         grid_idcs = []
-        
-        self._init_progress_bar(X_surf)
-        self.progressBar.start()
+        next_report = 0 if monitor else -1
         
         while X < X_surf:
-            self.progressBar.update(X)
             ri_x = ri(X)
-            dX = 1. / (max_ldec * ri_x)
-            if (np.any(int_grid) and (grid_step < int_grid.size) 
+            if step == next_report:
+                monitor.update(X, X=X, rho_inv=ri_x)
+                next_report += monitor.stride
+            dX = min(1. / max(max_ldec * ri_x, self.max_lint), X_surf - X)
+            if (int_grid is not None and (grid_step < int_grid.size) 
                 and (X + dX >= int_grid[grid_step])):
                 dX = int_grid[grid_step] - X
                 grid_idcs.append(step)
@@ -980,13 +2741,10 @@ class MCEqRun():
             X = X + dX
             step += 1
 
-        # Integrate
-        self.progressBar.finish()
-
-        dX_vec = np.array(dX_vec, dtype=np.float32)
-        rho_inv_vec = np.array(rho_inv_vec, dtype=np.float32)
-        self.integration_path = dX_vec.size, dX_vec, \
-                                rho_inv_vec, grid_idcs
+        # double precision, such that the steps add up to the final depth
+        dX_vec = np.array(dX_vec, dtype=np.float64)
+        rho_inv_vec = np.array(rho_inv_vec, dtype=np.float64)
+        return dX_vec.size, dX_vec, rho_inv_vec, grid_idcs
 
 class EdepZFactors():
 
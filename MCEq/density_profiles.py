@@ -151,11 +151,11 @@ class CascadeAtmosphere():
         
         now = time()
         
-        # Calculate integral for each depth point 
-        # functionality could be more efficient :)
+        # Integrate between neighboring depth points and accumulate
         X_int = np.zeros_like(dl_vec, dtype='float64')
-        for i, dl in enumerate(dl_vec):
-            X_int[i] = quad(vec_rho_l, 0, dl, epsrel=0.01)[0]
+        for i in xrange(1, dl_vec.size):
+            X_int[i] = X_int[i - 1] + quad(vec_rho_l, dl_vec[i - 1],
+                                           dl_vec[i], epsrel=1e-8)[0]
 
         print '.. took {0:1.2f}s'.format(time() - now)
 
@@ -220,6 +220,59 @@ class CascadeAtmosphere():
             self.theta_deg = theta_deg
             self.calculate_density_spline()
 
+    def h2X(self, h_cm):
+        """Returns the slant depth :math:`X` at height ``h_cm`` along the 
+        path defined by the current zenith angle.
+
+        The path length from the top of the atmosphere is obtained from 
+        :func:`MCEq.geometry.delta_l` and the density is integrated along it.
+
+        Args:
+          h_cm (float): height in cm
+
+        Returns:
+          float: slant depth :math:`X` in g/cm**2
+
+        Raises:
+            Exception: if :func:`set_theta` was not called before.
+        """
+        from scipy.integrate import quad
+
+        if self.theta_deg == None:
+            raise Exception('{0}::h2X(): zenith angle not set'.format(
+                             self.__class__.__name__))
+
+        thrad = self.thrad
+        return quad(lambda delta_l: self.get_density(geom.h(delta_l, thrad)),
+                    0, geom.delta_l(h_cm, thrad), epsrel=1e-4)[0]
+
+    def height2depth(self, h_cm):
+        """Converts height to column/vertical depth by numerical integration
+        of :func:`get_density`.
+
+        Args:
+          h_cm (float): height in cm
+
+        Returns:
+          float: column depth :math:`X_v` in g/cm**2
+        """
+        from scipy.integrate import quad
+        return quad(self.get_density, h_cm, geom.h_atm, epsrel=1e-4)[0]
+
+    def depth2height(self, x_v):
+        """Converts column/vertical depth to height by numerical inversion
+        of :func:`height2depth`.
+
+        Args:
+          x_v (float): column depth :math:`X_v` in g/cm**2
+
+        Returns:
+          float: height in cm
+        """
+        from scipy.optimize import brentq
+        return brentq(lambda h_cm: self.height2depth(h_cm) - x_v,
+                      0., geom.h_atm, xtol=1.)
+
     def r_X2rho(self, X):
         """Returns the inverse density :math:`\\frac{1}{\\rho}(X)`. 
 
@@ -234,7 +287,86 @@ class CascadeAtmosphere():
 
         """
         return 1 / self.s_X2rho(X)
-    
+
+    def r_X2rho_derivatives(self, X, variations, n_steps=None):
+        """Returns the derivatives of :math:`\\frac{1}{\\rho}(X)` and of
+        the surface depth with respect to parameters of the density profile.
+
+        A variation :math:`\\delta\\rho(h)` of the density changes the
+        slant depth along the path by
+        :math:`\\delta X(l) = \\int_0^l \\delta\\rho\\,dl'`, such that the
+        density at fixed :math:`X` changes by
+        :math:`\\delta\\rho - \\frac{d\\rho}{dl}\\frac{\\delta X}{\\rho}`.
+        The integrals are tabulated on ``n_steps`` points of the path,
+        which is much faster than calculating a spline for each variant.
+
+        Args:
+          X (numpy.array): slant depths in g/cm**2
+          variations (list of functions): derivatives
+            :math:`\\partial\\rho/\\partial\\epsilon_j` in g/cm**3 as
+            functions of the height in cm, e.g. from
+            :func:`layer_variations`
+          n_steps (int, optional): number of points on the path, default
+            is ``atm_derivative_steps`` from :mod:`mceq_config`
+
+        Returns:
+          tuple: derivatives of :math:`1/\\rho` of shape
+          (len(X), len(variations)) in cm**3/g and of the surface depth of
+          shape (len(variations),) in g/cm**2
+
+        Raises:
+            Exception: if :func:`set_theta` was not called before.
+        """
+        if self.theta_deg == None:
+            raise Exception(('{0}::r_X2rho_derivatives(): zenith angle ' +
+                             'not set').format(self.__class__.__name__))
+
+        def cumulative(f, dl):
+            return np.r_[0., np.cumsum(0.5 * (f[1:] + f[:-1]) * np.diff(dl))]
+
+        n_steps = config['atm_derivative_steps'] if n_steps == None else n_steps
+        dl_vec = np.linspace(0, geom.l(self.thrad), n_steps)
+        h_vec = geom.h(dl_vec, self.thrad)
+        rho = np.vectorize(self.get_density)(h_vec)
+        X_l = cumulative(rho, dl_vec)
+
+        X = np.atleast_1d(X)
+        rho_X = np.interp(X, X_l, rho)
+        drho_dl_X = np.interp(X, X_l, np.gradient(rho, dl_vec))
+
+        dri = np.zeros((X.size, len(variations)))
+        dX_surf = np.zeros(len(variations))
+        for j, variation in enumerate(variations):
+            drho = np.vectorize(variation)(h_vec)
+            dX_l = cumulative(drho, dl_vec)
+            drho_X = (np.interp(X, X_l, drho) -
+                      drho_dl_X * np.interp(X, X_l, dX_l) / rho_X)
+            dri[:, j] = -drho_X / rho_X ** 2
+            dX_surf[j] = dX_l[-1]
+
+        return dri, dX_surf
+
+    def layer_variations(self, layers):
+        """Returns the derivatives of the density with respect to
+        relative scalings :math:`(1 + \\epsilon_j)` of the density in
+        height layers, for :func:`r_X2rho_derivatives`.
+
+        The scaled density jumps at the layer boundaries. The spline of
+        :func:`calculate_density_spline` smooths such jumps, hence finite
+        differences of solutions with scaled profiles deviate from the
+        derivatives by up to a few percent for the thin layers.
+
+        Args:
+          layers (list of tuples): (h_min, h_max) in cm
+
+        Returns:
+          list: functions of the height in cm
+        """
+        def variation(h_min, h_max):
+            return lambda h_cm: (self.get_density(h_cm)
+                                 if h_min <= h_cm < h_max else 0.)
+        return [variation(h_min, h_max) for h_min, h_max in layers]
+
     def X2rho(self, X):
         """Returns the density :math:`\\rho(X)`. 
 
@@ -486,6 +618,44 @@ class CorsikaAtmosphere(CascadeAtmosphere):
         """
         return planar_rho_inv_jit(X, cos_theta, self._atm_param)
 
+    def parameter_variations(self, params):
+        """Returns the derivatives of the density with respect to
+        relative changes :math:`(1 + \\epsilon_j)` of parameters in
+        :attr:`_atm_param`, for :func:`r_X2rho_derivatives`.
+
+        The derivatives are analytic: in layer :math:`l` the density
+        :math:`\\rho = b_l/c_l\\exp(-h/c_l)` changes by :math:`\\rho` for
+        a relative change of :math:`b_l` and by :math:`\\rho(h/c_l - 1)` for
+        a relative change of :math:`c_l` (:math:`-\\rho` in the top layer,
+        where the density is constant).
+
+        Args:
+          params (list of tuples): (name, layer), where name is 'b' or 'c'
+            (the parameters, on which the density depends) and layer is
+            the index of the layer (0-4)
+
+        Returns:
+          list: functions of the height in cm
+        """
+        _aatm, _batm, _catm, _thickl, _hlay = self._atm_param
+
+        def variation(name, layer):
+            def deriv(h_cm):
+                # same layer as in corsika_get_density_jit
+                if max(np.sum(h_cm > _hlay) - 1, 0) != layer:
+                    return 0.
+                rho = self.get_density(h_cm)
+                if name == 'b':
+                    return rho
+                return rho * (h_cm / _catm[layer] - 1.) if layer < 4 else -rho
+            return deriv
+
+        for name, layer in params:
+            if name not in ['b', 'c']:
+                raise Exception(("CorsikaAtmosphere::parameter_variations(): " +
+                                 "Unknown parameter '{0}'.").format(name))
+        return [variation(name, layer) for name, layer in params]
+
     def calc_thickl(self):
         """Calculates thickness layers for :func:`depth2height` 
         
@@ -0,0 +1,737 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.formats` --- storage formats of the system matrices
+==============================================================
+
+The state vector consists of one block of :attr:`MCEq.core.MCEqRun.d`
+energy bins per particle species. Consequently, the non-zero elements
+of the interaction and decay matrices come in :math:`d \\times d` blocks,
+one per (mother, daughter) pair. Besides plain dense and CSR storage,
+this module provides formats which exploit this structure:
+
+- ``'bsr'`` uses :class:`scipy.sparse.bsr_matrix` with the block size of
+  the energy grid. Only one column index is stored per block and the
+  multiplication runs dense inner loops over the blocks.
+- ``'hybrid'`` (:class:`HybridBlockMatrix`) stores blocks with a fill
+  ratio above ``hybrid_block_fill`` as dense blocks and the remaining,
+  sparsely filled blocks in CSR format.
+- ``'compact'`` (:class:`CompactCSR`) minimizes the bytes per element with
+  single precision values, 8 bit column offsets within the blocks and
+  without storage for empty rows.
+
+:class:`EnsembleCSR` stores several matrices with a common sparsity
+pattern, e.g. variations of the interaction matrix, for the ensemble
+kernel :func:`MCEq.kernels.kern_ensemble`.
+
+All converters share the signature ``convert(mat, block_size)``. The
+format is selected with the ``sparse_format`` key in :mod:`mceq_config`
+or by the auto-tuner (:mod:`MCEq.autotune`).
+"""
+
+import numpy as np
+from mceq_config import config, dbg
+
+
+class HybridBlockMatrix():
+    """Matrix composed of dense :math:`d \\times d` blocks and a CSR
+    remainder.
+
+    Args:
+      mat (numpy.array or scipy.sparse matrix): matrix to convert
+      block_size (int): size of the blocks, typically the number of
+        energy bins
+      min_fill (float,optional): blocks with a larger fraction of non-zero
+        elements are stored densely. Default is ``hybrid_block_fill``
+        from :mod:`mceq_config`.
+    """
+
+    def __init__(self, mat, block_size, min_fill=None):
+        from scipy.sparse import csr_matrix, bsr_matrix
+
+        min_fill = config['hybrid_block_fill'] if min_fill == None \
+            else min_fill
+        d = block_size
+        bsr = bsr_matrix(mat, blocksize=(d, d))
+        bsr.sort_indices()
+
+        block_nnz = np.array([np.count_nonzero(blk) for blk in bsr.data])
+        is_dense = block_nnz >= min_fill * d * d
+        block_rows = np.repeat(np.arange(bsr.shape[0] / d),
+                               np.diff(bsr.indptr))
+
+        #: (tuple) shape of the matrix
+        self.shape = bsr.shape
+        #: (int) block size
+        self.block_size = d
+        #: (numpy.array) dense blocks, shape (n_blocks, d, d)
+        self.blocks = np.ascontiguousarray(bsr.data[is_dense])
+        #: (numpy.array) block row of each dense block (sorted)
+        self.block_rows = block_rows[is_dense]
+        #: (numpy.array) block column of each dense block
+        self.block_cols = bsr.indices[is_dense]
+        # Segments of blocks with equal row for np.add.reduceat
+        self._row_start = np.flatnonzero(np.r_[True, np.diff(
+            self.block_rows) != 0]) if self.block_rows.size else \
+            np.zeros(0, dtype=int)
+        self._rows = self.block_rows[self._row_start]
+
+        sparse_part = bsr_matrix((bsr.data * (~is_dense)[:, None, None],
+                                  bsr.indices, bsr.indptr),
+                                 shape=bsr.shape)
+        #: (scipy.sparse.csr_matrix) remaining elements
+        self.csr = csr_matrix(sparse_part)
+        self.csr.eliminate_zeros()
+
+        #: (int) number of stored elements
+        self.nnz = self.blocks.size + self.csr.nnz
+
+        if dbg > 1:
+            print ("HybridBlockMatrix::__init__(): {0} dense blocks, " +
+                   "{1} elements in CSR.").format(self.blocks.shape[0],
+                                                 self.csr.nnz)
+
+    def dot(self, x):
+        """Matrix - vector or matrix - matrix product.
+
+        Args:
+          x (numpy.array): vector of shape (n,) or matrix of shape (n, k)
+        Returns:
+          (numpy.array): product with the same number of dimensions as ``x``
+        """
+        d = self.block_size
+        y = self.csr.dot(x)
+        if not self.blocks.size:
+            return y
+        xb = x.reshape((self.shape[1] / d, d) + x.shape[1:])
+        yb = y.reshape((self.shape[0] / d, d) + x.shape[1:])
+        if x.ndim == 1:
+            contrib = np.einsum('kij,kj->ki', self.blocks,
+                                xb[self.block_cols])
+        else:
+            contrib = np.einsum('kij,kjc->kic', self.blocks,
+                                xb[self.block_cols])
+        yb[self._rows] += np.add.reduceat(contrib, self._row_start, axis=0)
+        return y
+
+    def tocsr(self):
+        """Returns the matrix as :class:`scipy.sparse.csr_matrix`."""
+        from scipy.sparse import bsr_matrix
+        d = self.block_size
+        nbrows = self.shape[0] / d
+        indptr = np.r_[0, np.cumsum(np.bincount(self.block_rows,
+                                                minlength=nbrows))]
+        dense = bsr_matrix((self.blocks, self.block_cols, indptr),
+                           shape=self.shape)
+        return (dense.tocsr() + self.csr).tocsr()
+
+    def toarray(self):
+        """Returns the matrix as dense :class:`numpy.ndarray`."""
+        return self.tocsr().toarray()
+
+
+def to_dense(mat, block_size=None):
+    """Converts to :class:`numpy.ndarray`."""
+    return mat.toarray() if hasattr(mat, 'toarray') else np.asarray(mat)
+
+
+def to_csr(mat, block_size=None):
+    """Converts to :class:`scipy.sparse.csr_matrix`."""
+    from scipy.sparse import csr_matrix
+    return mat.tocsr() if hasattr(mat, 'tocsr') else csr_matrix(mat)
+
+
+def to_bsr(mat, block_size):
+    """Converts to :class:`scipy.sparse.bsr_matrix` with square blocks."""
+    from scipy.sparse import bsr_matrix
+    bsr = bsr_matrix(to_csr(mat), blocksize=(block_size, block_size))
+    bsr.sort_indices()
+    return bsr
+
+
+def to_hybrid(mat, block_size):
+    """Converts to :class:`HybridBlockMatrix`."""
+    return HybridBlockMatrix(to_csr(mat), block_size)
+
+
+def _compact_spmv_py(rows, row_seg_ptr, seg_block, seg_ptr, offsets, values,
+                     block_size, x, alpha, y):
+    """:math:`y = y + \\alpha A x` for a :class:`CompactCSR` matrix. The
+    sum over a row is accumulated in double precision."""
+    for i in range(rows.shape[0]):
+        acc = 0.
+        for s in range(row_seg_ptr[i], row_seg_ptr[i + 1]):
+            col0 = seg_block[s] * block_size
+            for k in range(seg_ptr[s], seg_ptr[s + 1]):
+                acc += values[k] * x[col0 + offsets[k]]
+        y[rows[i]] += alpha * acc
+
+try:
+    from numba import jit
+    compact_spmv = jit(nopython=True)(_compact_spmv_py)
+    has_numba = True
+except ImportError:
+    compact_spmv = None
+    has_numba = False
+
+
+class CompactCSR():
+    """Sparse matrix with reduced memory traffic per multiplication.
+
+    Compared to :class:`scipy.sparse.csr_matrix` with double precision
+    values and 32 bit indices (12 bytes per element), the format stores:
+
+    - the values optionally in single precision,
+    - the column of each element as an 8 (or 16) bit offset within its
+      energy block. The block column is stored once per *segment*, a run
+      of elements in the same row and block,
+    - only the non-empty rows (doubly compressed rows). Species, which are
+      not produced by the process of the matrix, e.g. neutrinos in the 
+      interaction matrix, do not contribute rows.
+
+    With float32 values an element takes 5 bytes. Products are accumulated
+    in double precision. The multiplication is compiled with :mod:`numba`
+    if available, otherwise :func:`dot` falls back to :mod:`numpy` on
+    expanded column indices, which does not save memory.
+
+    Args:
+      mat (numpy.array or scipy.sparse matrix): matrix to convert
+      block_size (int): size of the energy blocks (at most 65536)
+      dtype (str or numpy.dtype,optional): precision of the values, default
+        is ``compact_dtype`` from :mod:`mceq_config`
+    """
+
+    def __init__(self, mat, block_size, dtype=None):
+        dtype = config['compact_dtype'] if dtype == None else dtype
+        csr = to_csr(mat).copy()
+        csr.eliminate_zeros()
+        csr.sort_indices()
+        d = block_size
+
+        row_nnz = np.diff(csr.indptr)
+        el_rows = np.repeat(np.arange(csr.shape[0]), row_nnz)
+        el_blocks = csr.indices / d
+        # a segment starts at each change of row or block column
+        new_seg = np.r_[True, (np.diff(el_rows) != 0) | 
+                        (np.diff(el_blocks) != 0)] if csr.nnz else \
+            np.zeros(0, dtype=bool)
+        seg_first = np.flatnonzero(new_seg)
+
+        #: (tuple) shape of the matrix
+        self.shape = csr.shape
+        #: (int) block size
+        self.block_size = d
+        #: (int) number of stored elements
+        self.nnz = csr.nnz
+        #: (numpy.array) indices of the non-empty rows
+        self.rows = np.flatnonzero(row_nnz).astype(np.int32)
+        seg_rows = el_rows[seg_first]
+        #: (numpy.array) first segment of each non-empty row
+        self.row_seg_ptr = np.searchsorted(
+            seg_rows, np.r_[self.rows, csr.shape[0]]).astype(np.int32)
+        #: (numpy.array) block column of each segment
+        self.seg_block = el_blocks[seg_first].astype(
+            np.uint16 if csr.shape[1] / d < 2 ** 16 else np.int32)
+        #: (numpy.array) first element of each segment
+        self.seg_ptr = np.r_[seg_first, csr.nnz].astype(np.int32)
+        #: (numpy.array) column offsets within the blocks
+        self.offsets = (csr.indices % d).astype(
+            np.uint8 if d <= 2 ** 8 else np.uint16)
+        #: (numpy.array) values
+        self.values = csr.data.astype(dtype)
+
+        self._cols = None
+
+    @property
+    def nbytes(self):
+        """(int) bytes of the arrays read in a multiplication"""
+        return sum([a.nbytes for a in [self.rows, self.row_seg_ptr,
+                                       self.seg_block, self.seg_ptr,
+                                       self.offsets, self.values]])
+
+    def _columns(self):
+        if self._cols is None:
+            seg_len = np.diff(self.seg_ptr)
+            self._cols = (np.repeat(self.seg_block.astype(np.int64) * 
+                                    self.block_size, seg_len) + 
+                          self.offsets)
+        return self._cols
+
+    def spmv(self, x, alpha, y):
+        """In-place :math:`y = y + \\alpha A x` for vectors ``x`` and ``y``.
+        """
+        if has_numba:
+            compact_spmv(self.rows, self.row_seg_ptr, self.seg_block,
+                         self.seg_ptr, self.offsets, self.values,
+                         self.block_size, x, alpha, y)
+        elif self.nnz:
+            prod = self.values.astype(np.float64) * x[self._columns()]
+            row_start = self.seg_ptr[self.row_seg_ptr[:-1]]
+            y[self.rows] += alpha * np.add.reduceat(prod, row_start)
+
+    def dot(self, x):
+        """Matrix - vector or matrix - matrix product in double precision.
+        """
+        if x.ndim == 1:
+            y = np.zeros(self.shape[0])
+            self.spmv(x, 1., y)
+            return y
+        y = np.zeros((self.shape[0],) + x.shape[1:])
+        if self.nnz:
+            prod = (self.values.astype(np.float64)[:, None] * 
+                    x[self._columns()])
+            row_start = self.seg_ptr[self.row_seg_ptr[:-1]]
+            y[self.rows] = np.add.reduceat(prod, row_start, axis=0)
+        return y
+
+    def tocsr(self):
+        """Returns the matrix as :class:`scipy.sparse.csr_matrix` with
+        double precision values."""
+        from scipy.sparse import csr_matrix
+        row_nnz = np.zeros(self.shape[0], dtype=np.int64)
+        row_nnz[self.rows] = np.diff(self.seg_ptr[self.row_seg_ptr])
+        return csr_matrix((self.values.astype(np.float64), self._columns(),
+                           np.r_[0, np.cumsum(row_nnz)]), shape=self.shape)
+
+    def toarray(self):
+        """Returns the matrix as dense :class:`numpy.ndarray`."""
+        return self.tocsr().toarray()
+
+
+def to_compact(mat, block_size):
+    """Converts to :class:`CompactCSR`."""
+    return CompactCSR(mat, block_size)
+
+
+def _ensemble_spmm_py(rows, row_ptr, indices, values, x, alpha, y):
+    """:math:`y_k = y_k + \\alpha A_k x_k` for the members :math:`k` of an
+    :class:`EnsembleCSR` matrix. The column index of an element is read
+    once for all members."""
+    nmembers = values.shape[1]
+    for n in range(rows.shape[0]):
+        i = rows[n]
+        for j in range(row_ptr[n], row_ptr[n + 1]):
+            col = indices[j]
+            for k in range(nmembers):
+                y[i, k] += alpha * values[j, k] * x[col, k]
+
+ensemble_spmm = jit(nopython=True)(_ensemble_spmm_py) if has_numba else None
+
+
+class EnsembleCSR():
+    """Ensemble of matrices, which share one sparsity pattern.
+
+    The column indices of the non-empty rows are stored once, the values
+    of the :math:`K` members as an array of shape (nnz, K). Multiplied
+    with a matrix of :math:`K` state vectors as columns, each member acts
+    on its own column. Since the indices are read once for all members and
+    the values of an element are contiguous, the memory traffic per
+    member is much lower than for :math:`K` separate multiplications.
+    The multiplication is compiled with :mod:`numba` if available.
+
+    Args:
+      pattern (scipy.sparse.csr_matrix): matrix with the shared pattern
+      values (numpy.array): values of shape (pattern.nnz, K) in the
+        order of ``pattern.data``
+    """
+
+    def __init__(self, pattern, values):
+        row_nnz = np.diff(pattern.indptr)
+
+        #: (tuple) shape of the matrices
+        self.shape = pattern.shape
+        #: (int) number of stored elements per member
+        self.nnz = pattern.nnz
+        #: (numpy.array) indices of the non-empty rows
+        self.rows = np.flatnonzero(row_nnz).astype(np.int32)
+        #: (numpy.array) first element of each non-empty row
+        self.row_ptr = np.r_[pattern.indptr[self.rows],
+                             pattern.nnz].astype(np.int32)
+        #: (numpy.array) column indices
+        self.indices = pattern.indices.astype(np.int32)
+        #: (numpy.array) values of shape (nnz, K)
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+
+        if self.values.shape[0] != self.nnz:
+            raise Exception(("EnsembleCSR::__init__(): Expected {0} " +
+                             "values per member, got {1}.").format(
+                             self.nnz, self.values.shape[0]))
+
+    @property
+    def nmembers(self):
+        """(int) number of members :math:`K`"""
+        return self.values.shape[1]
+
+    def spmm(self, x, alpha, y):
+        """In-place :math:`y_k = y_k + \\alpha A_k x_k` for arrays ``x``
+        and ``y`` of shape (dim, K)."""
+        if has_numba:
+            ensemble_spmm(self.rows, self.row_ptr, self.indices,
+                          self.values, x, alpha, y)
+        elif self.nnz:
+            prod = self.values * x[self.indices]
+            y[self.rows] += alpha * np.add.reduceat(prod, self.row_ptr[:-1],
+                                                    axis=0)
+
+    def dot(self, x):
+        """Products of the members with the columns of ``x``."""
+        y = np.zeros((self.shape[0], self.nmembers))
+        self.spmm(x, 1., y)
+        return y
+
+    def member(self, k):
+        """Returns member ``k`` as :class:`scipy.sparse.csr_matrix`."""
+        from scipy.sparse import csr_matrix
+        row_nnz = np.zeros(self.shape[0], dtype=np.int64)
+        row_nnz[self.rows] = np.diff(self.row_ptr)
+        return csr_matrix((self.values[:, k], self.indices,
+                           np.r_[0, np.cumsum(row_nnz)]), shape=self.shape)
+
+
+def to_ensemble(mats):
+    """Combines matrices into an :class:`EnsembleCSR`. The shared pattern
+    is the union of the patterns of the members.
+
+    Args:
+      mats (list): matrices of equal shape in any format
+    Returns:
+      (:class:`EnsembleCSR`): ensemble with ``len(mats)`` members
+    """
+    from scipy.sparse import csr_matrix
+
+    csrs = [to_csr(m).tocoo() for m in mats]
+    shape = csrs[0].shape
+    keys = [m.row.astype(np.int64) * shape[1] + m.col for m in csrs]
+    union = np.unique(np.hstack(keys))
+
+    values = np.zeros((union.size, len(csrs)))
+    for k, (m, key) in enumerate(zip(csrs, keys)):
+        np.add.at(values[:, k], np.searchsorted(union, key), m.data)
+
+    pattern = csr_matrix((np.ones(union.size), (union / shape[1],
+                                                union % shape[1])),
+                         shape=shape)
+    return EnsembleCSR(pattern, values)
+
+
+def prune_matrix(mat, threshold, block_size, mode='column'):
+    """Removes elements, which are small compared to the other elements
+    of their column or block.
+
+    An element :math:`a_{ij}` is removed if
+    :math:`|a_{ij}| < \\mathrm{threshold} \\cdot \\max |a_{kl}|`, where the
+    maximum runs over the column :math:`j` (``mode='column'``) or over the
+    :math:`d \\times d` block containing the element (``mode='block'``).
+    Diagonal elements are always kept, since they describe the losses.
+
+    Args:
+      mat (numpy.array or scipy.sparse matrix): matrix
+      threshold (float): relative threshold
+      block_size (int): size of the energy blocks
+      mode (str,optional): 'column' or 'block'
+    Returns:
+      (scipy.sparse.csr_matrix): pruned matrix
+    Raises:
+      Exception: if mode is unknown
+    """
+    from scipy.sparse import csr_matrix
+
+    coo = to_csr(mat).tocoo()
+    absval = np.abs(coo.data)
+    if mode == 'column':
+        scale = np.zeros(coo.shape[1])
+        np.maximum.at(scale, coo.col, absval)
+        scale = scale[coo.col]
+    elif mode == 'block':
+        nbcols = coo.shape[1] / block_size
+        block = (coo.row / block_size) * nbcols + coo.col / block_size
+        scale = np.zeros((coo.shape[0] / block_size) * nbcols)
+        np.maximum.at(scale, block, absval)
+        scale = scale[block]
+    else:
+        raise Exception("formats::prune_matrix(): Unknown mode " +
+                        "'{0}'.".format(mode))
+
+    keep = (absval >= threshold * scale) | (coo.row == coo.col)
+    return csr_matrix((coo.data[keep], (coo.row[keep], coo.col[keep])),
+                      shape=coo.shape)
+
+
+def state_permutation(int_m, dec_m, block_size, ordering):
+    """Calculates a permutation of the state vector, which improves the
+    locality of the memory accesses in the matrix-vector products.
+
+    Supported orderings:
+
+    - ``'natural'``: no permutation, species by species,
+    - ``'rcm'``: reverse Cuthill-McKee ordering of the combined sparsity 
+      pattern of both matrices, which minimizes the bandwidth,
+    - ``'energy_major'``: the energy bins of all species are interleaved,
+      i.e. the state vector is ordered by energy first. Since particles
+      mostly couple to lower or equal energies, this keeps the elements 
+      of a row close to the diagonal.
+
+    Args:
+      int_m (numpy.array or scipy.sparse matrix): interaction matrix
+      dec_m (numpy.array or scipy.sparse matrix): decay matrix
+      block_size (int): number of energy bins
+      ordering (str): one of the orderings above
+    Returns:
+      (numpy.array): ``perm``, such that ``phi[perm]`` is the permuted
+      state vector, or ``None`` for ``'natural'``
+    Raises:
+      Exception: if ordering is unknown
+    """
+    dim = int_m.shape[0]
+    if ordering == 'natural':
+        return None
+    elif ordering == 'rcm':
+        from scipy.sparse.csgraph import reverse_cuthill_mckee
+        pattern = abs(to_csr(int_m)) + abs(to_csr(dec_m))
+        return reverse_cuthill_mckee((pattern + pattern.T).tocsr(),
+                                     symmetric_mode=True).astype(np.int64)
+    elif ordering == 'energy_major':
+        return np.arange(dim).reshape(dim / block_size, 
+                                      block_size).T.ravel()
+    else:
+        raise Exception("formats::state_permutation(): Unknown ordering " +
+                        "'{0}'.".format(ordering))
+
+
+def permute_matrix(mat, perm):
+    """Returns the matrix :math:`P A P^T` as
+    :class:`scipy.sparse.csr_matrix`, where :math:`P` reorders vectors as
+    ``x[perm]``."""
+    csr = to_csr(mat)
+    return csr[perm, :][:, perm].tocsr()
+
+
+def dependency_levels(int_m, dec_m):
+    """Sorts the elements of the state vector into levels, such that the
+    derivative of an element depends only on elements of the same or
+    of lower levels.
+
+    The strongly connected components of the combined sparsity pattern
+    (e.g. all hadrons within one energy bin) are contracted. Their graph
+    is acyclic, since particles do not gain energy, and the level of
+    a component is the length of the longest chain of components it 
+    depends on.
+
+    Args:
+      int_m (numpy.array or scipy.sparse matrix): interaction matrix
+      dec_m (numpy.array or scipy.sparse matrix): decay matrix
+    Returns:
+      (numpy.array): level of each element of the state vector
+    """
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    pattern = (abs(to_csr(int_m)) + abs(to_csr(dec_m))).tocoo()
+    ncomp, comp = connected_components(pattern, directed=True,
+                                       connection='strong')
+    row, col = comp[pattern.row], comp[pattern.col]
+    off = row != col
+    # deps[i, j] != 0 if component i depends on component j
+    deps = csr_matrix((np.ones(np.count_nonzero(off)), 
+                       (row[off], col[off])), shape=(ncomp, ncomp))
+    deps.sum_duplicates()
+    users = deps.tocsc()
+
+    level = np.zeros(ncomp, dtype=np.int64)
+    remaining = np.diff(deps.indptr)
+    frontier = np.flatnonzero(remaining == 0)
+    nlevel, nassigned = 0, 0
+    while len(frontier):
+        level[frontier] = nlevel
+        nassigned += len(frontier)
+        remaining[frontier] = -1
+        dependent = np.concatenate([users.indices[users.indptr[c]:
+                                                  users.indptr[c + 1]]
+                                    for c in frontier])
+        remaining -= np.bincount(dependent, minlength=ncomp)
+        frontier = np.flatnonzero(remaining == 0)
+        nlevel += 1
+    if nassigned != ncomp:
+        raise Exception("formats::dependency_levels(): Dependency " + 
+                        "graph is not acyclic.")
+
+    return level[comp]
+
+
+def reachable_elements(int_m, dec_m, sources):
+    """Returns the elements of the state vector, which can become non-zero
+    if only the elements ``sources`` are non-zero initially.
+
+    An element receives flux from the elements in the non-zero columns of
+    its row in either matrix. The elements reachable from the sources in
+    this dependency graph are found by a breadth-first search. Since 
+    particles do not gain energy, these are the bins of each species up 
+    to the highest energy, which is populated directly or by one of its
+    parents.
+
+    Args:
+      int_m (numpy.array or scipy.sparse matrix): interaction matrix
+      dec_m (numpy.array or scipy.sparse matrix): decay matrix
+      sources (numpy.array): indices of the non-zero initial elements
+    Returns:
+      (numpy.array): sorted indices of the reachable elements, which 
+      include the sources
+    """
+    from scipy.sparse import csr_matrix, bmat
+    from scipy.sparse.csgraph import breadth_first_order
+
+    sources = np.asarray(sources, dtype=np.int64)
+    if not len(sources):
+        return sources
+    # edge j -> i if element i depends on element j
+    pattern = (abs(to_csr(int_m)) + abs(to_csr(dec_m))).T.tocsr()
+    pattern.eliminate_zeros()
+    dim = pattern.shape[0]
+    # an additional node dim, which points to all sources
+    start = csr_matrix((np.ones(len(sources)), 
+                        (np.zeros(len(sources), dtype=np.int64), sources)),
+                       shape=(1, dim))
+    graph = bmat([[pattern, csr_matrix((dim, 1))],
+                  [start, csr_matrix((1, 1))]]).tocsr()
+    nodes = breadth_first_order(graph, dim, directed=True,
+                                return_predecessors=False)
+    return np.sort(nodes[nodes != dim])
+
+
+def sink_reduction(int_m, dec_m, block_size):
+    """Removes the pure sink species from the system of equations.
+
+    Species, whose columns are empty in both matrices (e.g. neutrinos),
+    neither interact nor decay. Their rows only collect the production
+    by the other species, :math:`\\Phi_S(X_n) = \\Phi_S(X_0) + 
+    \\boldsymbol{M}_{int,SR} u_n + \\boldsymbol{M}_{dec,SR} v_n`, with the 
+    sums :math:`u_n = \\sum_{i<n} \\Delta X_i \\Phi_R(X_i)` and 
+    :math:`v_n = \\sum_{i<n} \\Delta X_i \\frac{1}{\\rho(X_i)}\\Phi_R(X_i)`
+    over the remaining species :math:`R`.
+
+    The reduced system integrates the state vector 
+    :math:`(\\Phi_R, u, v)`, where :math:`u` and :math:`v` are kept only
+    for the species which feed the sinks. They are accumulated by unit rows
+    in the interaction or decay matrix, respectively. Thus, any kernel 
+    integrates the reduced system with the same forward-euler arithmetic,
+    but without the rows of the sinks in the matrix-vector products. The
+    constant :math:`\\Phi_S(X_0)` is not part of the reduced state, it
+    is carried over from the initial state when the full state is restored.
+    The reduced state is shorter than the full one only if fewer species
+    feed the sinks by interactions and decays than there are sinks. The
+    gain are the elements of the sink rows in the products.
+
+    Args:
+      int_m (numpy.array or scipy.sparse matrix): interaction matrix
+      dec_m (numpy.array or scipy.sparse matrix): decay matrix
+      block_size (int): number of energy bins
+    Returns:
+      (tuple): (reduced interaction matrix, reduced decay matrix,
+      ``embed``, ``restore``, ``carry``, ``integral``) as 
+      :class:`scipy.sparse.csr_matrix`. ``embed.dot(phi_0)`` is the reduced
+      state for an initial state ``phi_0`` and the full state is 
+      ``restore.dot(x) + carry.dot(phi_0)`` for a reduced state ``x``, 
+      i.e. ``carry`` selects the sinks. ``integral.dot(x)`` is :math:`u`
+      placed at the positions of the feeding species in the full state.
+      The maps are ``None`` if there are no sinks.
+    """
+    from scipy.sparse import identity, csr_matrix, vstack, hstack
+
+    int_csr, dec_csr = to_csr(int_m), to_csr(dec_m)
+    dim = int_csr.shape[0]
+    nblocks = dim / block_size
+
+    used = ((np.diff(int_csr.tocsc().indptr) + 
+             np.diff(dec_csr.tocsc().indptr)) > 0)
+    sink_blocks = ~np.any(used.reshape(nblocks, block_size), axis=1)
+    if not np.any(sink_blocks):
+        return int_csr, dec_csr, None, None, None, None
+
+    is_sink = np.repeat(sink_blocks, block_size)
+    R, S = np.flatnonzero(~is_sink), np.flatnonzero(is_sink)
+    nR, nS = len(R), len(S)
+
+    def feeding(mat):
+        # positions in R of the species blocks with production of sinks
+        fed = np.diff(mat[S][:, R].tocsc().indptr) > 0
+        fed = np.any(fed.reshape(-1, block_size), axis=1)
+        return np.flatnonzero(np.repeat(fed, block_size))
+
+    Ju, Jv = feeding(int_csr), feeding(dec_csr)
+    nu, nv = len(Ju), len(Jv)
+    naug = nR + nu + nv
+    I_R = identity(nR, format='csr')
+    zeros = lambda n, m: csr_matrix((n, m))
+
+    def reduced(mat, sel_row):
+        rows = [hstack([mat[R][:, R], zeros(nR, naug - nR)]),
+                zeros(nu, naug), zeros(nv, naug)]
+        rows[sel_row] = hstack([I_R[Ju if sel_row == 1 else Jv],
+                                zeros(len(Ju if sel_row == 1 else Jv), 
+                                      naug - nR)])
+        return vstack(rows).tocsr()
+
+    I = identity(dim, format='csr')
+    embed = vstack([I[R], zeros(nu + nv, dim)]).tocsr()
+    restore = vstack([hstack([I_R, zeros(nR, naug - nR)]),
+                      hstack([zeros(nS, nR), int_csr[S][:, R[Ju]],
+                              dec_csr[S][:, R[Jv]]])]).tocsr()
+    restore = restore[np.argsort(np.r_[R, S])]
+    carry = I[S].T.dot(I[S]).tocsr()
+    integral = hstack([zeros(dim, nR), I[:, R[Ju]], 
+                       zeros(dim, nv)]).tocsr()
+
+    if dbg > 0:
+        print ("formats::sink_reduction(): {0} of {1} elements are " + 
+               "sinks, reduced state has {2} elements.").format(nS, dim,
+                                                                naug)
+
+    return (reduced(int_csr, 1), reduced(dec_csr, 2), embed, restore, 
+            carry, integral)
+
+
+def species_relevance(int_m, dec_m, block_size, sources, targets):
+    """Estimates how strongly each species couples the sources to the
+    targets.
+
+    The species are the nodes of a graph with an edge from the mother 
+    to the daughter species for each non-zero :math:`d \\times d` block
+    of the matrices. The weight of an edge is the largest element of 
+    the block relative to the loss term (the diagonal) of the mother, 
+    i.e. the largest yield, limited to 1. The relevance of a species is 
+    the product of the weights along the strongest path from any source 
+    via the species to any target. It is 0 if the species can not be 
+    reached from the sources or has no path to the targets.
+
+    Args:
+      int_m (numpy.array or scipy.sparse matrix): interaction matrix
+      dec_m (numpy.array or scipy.sparse matrix): decay matrix
+      block_size (int): number of energy bins
+      sources (list): indices of the species with an initial flux
+      targets (list): indices of the observed species
+    Returns:
+      (numpy.array): relevance between 0 and 1 of each species
+    """
+    nspecies = int_m.shape[0] / block_size
+
+    def weights(mat):
+        csr = to_csr(mat)
+        coo = csr.tocoo()
+        loss = np.abs(csr.diagonal())[coo.col]
+        yields = np.abs(coo.data) / np.where(loss > 0., loss, 
+                                             np.abs(coo.data))
+        w = np.zeros((nspecies, nspecies))
+        np.maximum.at(w, (coo.col / block_size, coo.row / block_size),
+                      np.where(coo.data != 0., yields, 0.))
+        return w
+
+    # w[m, d] is the weight of the edge from mother m to daughter d
+    w = np.minimum(1., np.maximum(weights(int_m), weights(dec_m)))
+    with np.errstate(divide='ignore'):
+        dist = -np.log(w)
+    np.fill_diagonal(dist, 0.)
+    # strongest paths (Floyd-Warshall), the graph has only some 100 nodes
+    for k in xrange(nspecies):
+        dist = np.minimum(dist, dist[:, k, None] + dist[None, k, :])
+
+    return np.exp(-(np.min(dist[sources], axis=0) +
+                    np.min(dist[:, targets], axis=1)))
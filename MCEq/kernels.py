@@ -33,7 +33,22 @@ The functions use different libraries for sparse and dense linear algebra (BLAS)
   the calculation significantly.
 - The fastest version, :func:`kern_MKL_sparse`, directly interfaces to the sparse BLAS routines 
   from `Intel MKL <https://software.intel.com/en-us/intel-mkl>`_ via :mod:`ctypes`. If you have the
-  MKL runtime installed, this function is recommended for most purposes.
+  MKL runtime installed, this function is recommended for most purposes. The library and
+  the optimized matrix handles of the inspector-executor API are kept by :class:`MKLBackend`.
+- All sparse kernels except the GPU versions also accept the block formats
+  of :mod:`MCEq.formats`, which match the species :math:`\\times` energy layout of the matrices.
+- :func:`kern_compact` integrates matrices in the reduced-precision format
+  :class:`MCEq.formats.CompactCSR` using functions compiled with :mod:`numba`.
+- :func:`kern_active` multiplies only the part of the matrices, which
+  acts on non-zero elements of the state vector, e.g. for single primaries.
+- The functions :func:`kern_numpy_batch` and :func:`kern_MKL_sparse_batch` integrate several
+  state vectors at once, which are stored as columns of a matrix. Each column has its own
+  step sizes and densities, while the matrices are shared.
+- :func:`kern_numpy_tangent` integrates the state vector together with its
+  derivatives with respect to scalings of the interaction matrix or
+  parameters of the density profile.
+- :func:`kern_ensemble` integrates the state vectors of an ensemble of systems
+  with different interaction matrices (:class:`MCEq.formats.EnsembleCSR`).
 - The GPU accelerated versions :func:`kern_CUDA_dense` and :func:`kern_CUDA_sparse` are implemented
   using the cuBLAS or cuSPARSE libraries, respectively. They should be considered as experimental or
   implementation examples if you need extremely high performance. To keep Python as the main programming 
@@ -44,9 +59,12 @@ The functions use different libraries for sparse and dense linear algebra (BLAS)
 """
 import numpy as np
 from mceq_config import config
+from snapshots import ListSink
+import formats
 
 def kern_numpy(nsteps, dX, rho_inv, int_m, dec_m,
-               phi, grid_idcs, prog_bar=None):
+               phi, grid_idcs, monitor=None, grid_sol=None,
+               proj_m=None):
     """:mod;`numpy` implementation of forward-euler integration.
     
     Args:
@@ -56,29 +74,160 @@ def kern_numpy(nsteps, dX, rho_inv, int_m, dec_m,
       int_m (numpy.array): interaction matrix :eq:`int_matrix` in dense or sparse representation
       dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
       phi (numpy.array): initial state vector :math:`\\Phi(X_0)` 
-      prog_bar (object,optional): handle to :class:`ProgressBar` object
+      grid_idcs (list): indices at which longitudinal solutions have to be saved.
+      monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+      grid_sol (object,optional): sink for longitudinal solutions, see :mod:`MCEq.snapshots`
+      proj_m (scipy.sparse.csr_matrix,optional): projection matrix applied to the
+        longitudinal solutions before storing, see :func:`MCEq.core.MCEqRun._obs_projection`
     Returns:
-      numpy.array: state vector :math:`\\Phi(X_{nsteps})` after integration
+      numpy.array, object: state vector :math:`\\Phi(X_{nsteps})` after integration
+      and the sink containing the longitudinal solutions
     """
 
-    grid_sol = []
+    if grid_sol is None:
+        grid_sol = ListSink()
     grid_step = 0
     
+    next_report = 0 if monitor else -1
     for step in xrange(nsteps):
-        if prog_bar and (step % 200 == 0):
-            prog_bar.update(step)
+        if step == next_report:
+            monitor.update(step)
+            next_report += monitor.stride
         phi += (int_m.dot(phi) + dec_m.dot(rho_inv[step] * phi)) * dX[step]
         
         if (grid_idcs and grid_step < len(grid_idcs) 
             and grid_idcs[grid_step] == step):
-            grid_sol.append(np.copy(phi))
+            grid_sol.append(phi if proj_m is None else proj_m.dot(phi))
             grid_step += 1
 
     return phi, grid_sol
 
 
+def kern_numpy_batch(nsteps, dX, rho_inv, int_m, dec_m,
+                     phi, monitor=None):
+    """:mod;`numpy` implementation of forward-euler integration for a
+    batch of state vectors, which share the matrices but have individual
+    integration paths (e.g. different zenith angles).
+    
+    Args:
+      nsteps (int): number of integration steps
+      dX (numpy.array[nsteps, ncols]): step-sizes :math:`\\Delta X_i` in g/cm**2 per column
+      rho_inv (numpy.array[nsteps, ncols]): density values :math:`\\frac{1}{\\rho(X_i)}` per column
+      int_m (numpy.array): interaction matrix :eq:`int_matrix` in dense or sparse representation
+      dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
+      phi (numpy.array[dim_states, ncols]): initial state vectors :math:`\\Phi(X_0)` as columns
+      monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+    Returns:
+      numpy.array: state vectors :math:`\\Phi(X_{nsteps})` after integration
+    """
+
+    next_report = 0 if monitor else -1
+    for step in xrange(nsteps):
+        if step == next_report:
+            monitor.update(step)
+            next_report += monitor.stride
+        phi += (int_m.dot(phi) + dec_m.dot(phi) * rho_inv[step]) * dX[step]
+
+    return phi
+
+
+def kern_numpy_tangent(nsteps, dX, rho_inv, int_m, dec_m,
+                       phi, sens_m, monitor=None, drho_inv=None):
+    """:mod:`numpy` implementation of forward-euler integration of the 
+    state vector together with its derivatives with respect to parameters
+    of the interaction matrix or of the density profile (tangent-linear 
+    integration).
+
+    The derivative :math:`S_j = \\partial\\Phi / \\partial\\epsilon_j` 
+    follows the cascade equation with the additional source terms
+    :math:`\\partial\\boldsymbol{M}_{int}/\\partial\\epsilon_j \\cdot 
+    \\Phi` and :math:`\\partial\\rho^{-1}/\\partial\\epsilon_j 
+    \\boldsymbol{M}_{dec} \\cdot \\Phi`. The matrices are shared by all columns, such that each step
+    requires one pass over the matrices for the state and all derivatives.
+
+    Args:
+      nsteps (int): number of integration steps
+      dX (numpy.array[nsteps]): vector of step-sizes :math:`\\Delta X_i` in g/cm**2
+      rho_inv (numpy.array[nsteps]): vector of density values :math:`\\frac{1}{\\rho(X_i)}`
+      int_m (numpy.array): interaction matrix :eq:`int_matrix` in dense or sparse representation
+      dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
+      phi (numpy.array[dim_states, 1 + npar]): initial state vector in the 
+        first column, initial derivatives in the other columns
+      sens_m (scipy.sparse matrix): derivatives of the interaction matrix 
+        stacked vertically, shape (npar * dim_states, dim_states), or ``None``
+      monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+      drho_inv (numpy.array[nsteps, npar],optional): derivatives of the 
+        density values
+    Returns:
+      numpy.array: state vector and derivatives after integration
+    """
+
+    npar = phi.shape[1] - 1
+    next_report = 0 if monitor else -1
+    for step in xrange(nsteps):
+        if step == next_report:
+            monitor.update(step)
+            next_report += monitor.stride
+        dec_phi = dec_m.dot(phi)
+        delta = int_m.dot(phi) + dec_phi * rho_inv[step]
+        if sens_m is not None:
+            delta[:, 1:] += sens_m.dot(phi[:, 0]).reshape(npar, -1).T
+        if drho_inv is not None:
+            delta[:, 1:] += dec_phi[:, :1] * drho_inv[step]
+        phi += delta * dX[step]
+
+    return phi
+
+
+def kern_ensemble(nsteps, dX, rho_inv, int_m, dec_m, phi, monitor=None):
+    """Forward-euler integration of an ensemble of systems, which differ
+    only in the values of the matrices.
+
+    Member :math:`k` integrates column :math:`k` of ``phi`` with its own
+    interaction matrix. The members are stored as 
+    :class:`MCEq.formats.EnsembleCSR`, such that the index structure is 
+    read once per step for all members.
+
+    Args:
+      nsteps (int): number of integration steps
+      dX (numpy.array[nsteps]): vector of step-sizes :math:`\\Delta X_i` in g/cm**2
+      rho_inv (numpy.array[nsteps]): vector of density values :math:`\\frac{1}{\\rho(X_i)}`
+      int_m (MCEq.formats.EnsembleCSR): interaction matrices :eq:`int_matrix` 
+      dec_m (MCEq.formats.EnsembleCSR or matrix): decay matrices 
+        :eq:`dec_matrix` or one decay matrix shared by all members
+      phi (numpy.array[dim_states, K]): initial state vectors as columns
+      monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+    Returns:
+      numpy.array: state vectors after integration
+    """
+
+    phi = np.array(phi, dtype=np.float64, order='C')
+    delta_phi = np.zeros_like(phi)
+    dX = dX.astype(np.float64)
+    rho_inv = rho_inv.astype(np.float64)
+    shared_dec = not isinstance(dec_m, formats.EnsembleCSR)
+
+    next_report = 0 if monitor else -1
+    for step in xrange(nsteps):
+        if step == next_report:
+            monitor.update(step)
+            next_report += monitor.stride
+
+        delta_phi[:] = 0.
+        int_m.spmm(phi, 1., delta_phi)
+        if shared_dec:
+            delta_phi += dec_m.dot(phi) * rho_inv[step]
+        else:
+            dec_m.spmm(phi, rho_inv[step], delta_phi)
+        delta_phi *= dX[step]
+        phi += delta_phi
+
+    return phi
+
+
 def kern_CUDA_dense(nsteps, dX, rho_inv, int_m, dec_m,
-                    phi, grid_idcs, prog_bar=None):
+                    phi, grid_idcs, monitor=None, grid_sol=None,
+                    proj_m=None):
     """`NVIDIA CUDA cuBLAS <https://developer.nvidia.com/cublas>`_ implementation 
     of forward-euler integration.
     
@@ -92,9 +241,14 @@ def kern_CUDA_dense(nsteps, dX, rho_inv, int_m, dec_m,
       int_m (numpy.array): interaction matrix :eq:`int_matrix` in dense or sparse representation
       dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
       phi (numpy.array): initial state vector :math:`\\Phi(X_0)` 
-      prog_bar (object,optional): handle to :class:`ProgressBar` object
+      grid_idcs (list): indices at which longitudinal solutions have to be saved.
+      monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+      grid_sol (object,optional): sink for longitudinal solutions, see :mod:`MCEq.snapshots`
+      proj_m (scipy.sparse.csr_matrix,optional): projection matrix applied to the
+        longitudinal solutions before storing, see :func:`MCEq.core.MCEqRun._obs_projection`
     Returns:
-      numpy.array: state vector :math:`\\Phi(X_{nsteps})` after integration
+      numpy.array, object: state vector :math:`\\Phi(X_{nsteps})` after integration
+      and the sink containing the longitudinal solutions
     """
     
     calc_precision = None
@@ -121,19 +275,32 @@ def kern_CUDA_dense(nsteps, dX, rho_inv, int_m, dec_m,
     cu_dec_m = cuda.to_device(dec_m.astype(calc_precision), stream)
     cu_curr_phi = cuda.to_device(phi.astype(calc_precision), stream)
     cu_delta_phi = cuda.device_array(phi.shape, dtype=calc_precision)
+    if grid_sol is None:
+        grid_sol = ListSink()
+    grid_step = 0
+    next_report = 0 if monitor else -1
     for step in xrange(nsteps):
-        if prog_bar:
-            prog_bar.update(step)
+        if step == next_report:
+            monitor.update(step)
+            next_report += monitor.stride
         cubl.gemv(trans='T', m=m, n=n, alpha=float32(1.0), A=cu_int_m,
             x=cu_curr_phi, beta=float32(0.0), y=cu_delta_phi)
         cubl.gemv(trans='T', m=m, n=n, alpha=float32(rho_inv[step]),
             A=cu_dec_m, x=cu_curr_phi, beta=float32(1.0), y=cu_delta_phi)
         cubl.axpy(alpha=float32(dX[step]), x=cu_delta_phi, y=cu_curr_phi)
 
-    return cu_curr_phi.copy_to_host()
+        if (grid_idcs and grid_step < len(grid_idcs) 
+            and grid_idcs[grid_step] == step):
+            host_phi = cu_curr_phi.copy_to_host()
+            grid_sol.append(host_phi if proj_m is None
+                            else proj_m.dot(host_phi))
+            grid_step += 1
+
+    return cu_curr_phi.copy_to_host(), grid_sol
 
 def kern_CUDA_sparse(nsteps, dX, rho_inv, int_m, dec_m,
-                    phi, grid_idcs, prog_bar=None):
+                    phi, grid_idcs, monitor=None, grid_sol=None,
+                    proj_m=None):
     """`NVIDIA CUDA cuSPARSE <https://developer.nvidia.com/cusparse>`_ implementation 
     of forward-euler integration.
     
@@ -150,9 +317,14 @@ def kern_CUDA_sparse(nsteps, dX, rho_inv, int_m, dec_m,
       int_m (numpy.array): interaction matrix :eq:`int_matrix` in dense or sparse representation
       dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
       phi (numpy.array): initial state vector :math:`\\Phi(X_0)` 
-      prog_bar (object,optional): handle to :class:`ProgressBar` object
+      grid_idcs (list): indices at which longitudinal solutions have to be saved.
+      monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+      grid_sol (object,optional): sink for longitudinal solutions, see :mod:`MCEq.snapshots`
+      proj_m (scipy.sparse.csr_matrix,optional): projection matrix applied to the
+        longitudinal solutions before storing, see :func:`MCEq.core.MCEqRun._obs_projection`
     Returns:
-      numpy.array: state vector :math:`\\Phi(X_{nsteps})` after integration
+      numpy.array, object: state vector :math:`\\Phi(X_{nsteps})` after integration
+      and the sink containing the longitudinal solutions
     """
     calc_precision = None
     if config['CUDA_precision'] == 32:
@@ -192,9 +364,14 @@ def kern_CUDA_sparse(nsteps, dX, rho_inv, int_m, dec_m,
     descr = cusp.matdescr()
     descr.indexbase = cusparse.CUSPARSE_INDEX_BASE_ZERO
     
+    if grid_sol is None:
+        grid_sol = ListSink()
+    grid_step = 0
+    next_report = 0 if monitor else -1
     for step in xrange(nsteps):
-        if prog_bar and (step % 5 == 0):
-            prog_bar.update(step)
+        if step == next_report:
+            monitor.update(step)
+            next_report += monitor.stride
         cusp.csrmv(trans='T', m=m, n=n, nnz=int_m_nnz,
                    descr=descr,
                    alpha=float32(1.0),
@@ -211,15 +388,221 @@ def kern_CUDA_sparse(nsteps, dX, rho_inv, int_m, dec_m,
                    x=cu_curr_phi, beta=float32(1.0), y=cu_delta_phi)
         cubl.axpy(alpha=float32(dX[step]), x=cu_delta_phi, y=cu_curr_phi)
 
-    return cu_curr_phi.copy_to_host()
+        if (grid_idcs and grid_step < len(grid_idcs) 
+            and grid_idcs[grid_step] == step):
+            host_phi = cu_curr_phi.copy_to_host()
+            grid_sol.append(host_phi if proj_m is None
+                            else proj_m.dot(host_phi))
+            grid_step += 1
+
+    return cu_curr_phi.copy_to_host(), grid_sol
+
+class MKLBackend():
+    """Persistent interface to the sparse BLAS of the MKL runtime.
+
+    The library is loaded once and the matrices are registered with the
+    inspector-executor API (``mkl_sparse_d_create_csr``). For each matrix
+    the expected number of multiplications is passed via
+    ``mkl_sparse_set_mv_hint`` before ``mkl_sparse_optimize`` analyzes the
+    sparsity pattern. The optimized handles are cached and reused in 
+    subsequent solver calls, as long as the matrix object and its 
+    data buffers do not change.
+
+    Use :func:`get_MKL_backend` to obtain the shared instance.
+
+    Args:
+      mkl_path (str): path to ``libmkl_rt.[so/dylib]``
+    Raises:
+      Exception: if the library can not be loaded
+    """
+    # Constants from mkl_spblas.h
+    SPARSE_OPERATION_NON_TRANSPOSE = 10
+    SPARSE_MATRIX_TYPE_GENERAL = 20
+    SPARSE_INDEX_BASE_ZERO = 0
+    SPARSE_FILL_MODE_FULL = 42
+    SPARSE_DIAG_NON_UNIT = 50
+    SPARSE_LAYOUT_ROW_MAJOR = 101
+
+    def __init__(self, mkl_path):
+        from ctypes import (cdll, c_int, c_double, c_void_p, POINTER,
+                            Structure)
+
+        try:
+            self.lib = cdll.LoadLibrary(mkl_path)
+        except OSError:
+            raise Exception("MKLBackend::__init__(): MKL runtime library " + 
+                            "not found. Please check path.")
+        self.mkl_path = mkl_path
+
+        class MatrixDescr(Structure):
+            _fields_ = [('type', c_int), ('mode', c_int), ('diag', c_int)]
+
+        self._descr = MatrixDescr(self.SPARSE_MATRIX_TYPE_GENERAL,
+                                  self.SPARSE_FILL_MODE_FULL,
+                                  self.SPARSE_DIAG_NON_UNIT)
+        pd, pi = POINTER(c_double), POINTER(c_int)
+
+        lib = self.lib
+        lib.mkl_sparse_d_create_csr.argtypes = [POINTER(c_void_p), c_int,
+            c_int, c_int, pi, pi, pi, pd]
+        lib.mkl_sparse_d_create_bsr.argtypes = [POINTER(c_void_p), c_int,
+            c_int, c_int, c_int, c_int, pi, pi, pi, pd]
+        lib.mkl_sparse_set_mv_hint.argtypes = [c_void_p, c_int, MatrixDescr,
+                                               c_int]
+        lib.mkl_sparse_set_mm_hint.argtypes = [c_void_p, c_int, MatrixDescr,
+                                               c_int, c_int, c_int]
+        lib.mkl_sparse_optimize.argtypes = [c_void_p]
+        lib.mkl_sparse_destroy.argtypes = [c_void_p]
+        lib.mkl_sparse_d_mv.argtypes = [c_int, c_double, c_void_p,
+                                        MatrixDescr, pd, c_double, pd]
+        lib.mkl_sparse_d_mm.argtypes = [c_int, c_double, c_void_p,
+                                        MatrixDescr, c_int, pd, c_int, c_int,
+                                        c_double, pd, c_int]
+        lib.cblas_daxpy.argtypes = [c_int, c_double, pd, c_int, pd, c_int]
+        lib.cblas_daxpy.restype = None
+        # C interface of the service functions (the lower case symbols
+        # follow the Fortran convention and expect pointers)
+        lib.MKL_Get_Max_Threads.restype = c_int
+        lib.MKL_Set_Num_Threads.argtypes = [c_int]
+        lib.MKL_Set_Num_Threads.restype = None
+
+        # Cache of optimized handles. Key is (id of the matrix, ncols), value
+        # is (buffer key, matrix, handle, index and value arrays used by MKL)
+        self._handles = {}
+        self._saved_threads = []
+
+    def _check(self, status, func):
+        if status != 0:
+            raise Exception(("MKLBackend::{0}(): MKL sparse BLAS returned " + 
+                             "status {1}.").format(func, status))
+
+    def _key(self, mat):
+        return (mat.shape, mat.nnz, mat.data.ctypes.data,
+                mat.indices.ctypes.data, mat.indptr.ctypes.data)
+
+    def handle(self, mat, expected_calls, ncols=None):
+        """Returns an optimized MKL handle of a CSR or BSR matrix.
+
+        Args:
+          mat (scipy.sparse.csr_matrix or bsr_matrix): matrix
+          expected_calls (int): expected number of multiplications, passed
+            to the inspector as a hint
+          ncols (int,optional): number of columns of the dense operand, 
+            if the handle is used for sparse matrix - dense matrix products
+        Returns:
+          (ctypes.c_void_p): handle
+        """
+        from ctypes import c_void_p, c_int, c_double, POINTER, byref
+
+        cached = self._handles.get((id(mat), ncols))
+        if cached is not None and cached[0] == self._key(mat):
+            return cached[2]
+        elif cached is not None:
+            self.lib.mkl_sparse_destroy(
+                self._handles.pop((id(mat), ncols))[2])
+
+        indptr = np.ascontiguousarray(mat.indptr, dtype=np.int32)
+        indices = np.ascontiguousarray(mat.indices, dtype=np.int32)
+        data = np.ascontiguousarray(mat.data, dtype=np.float64)
+        pi, pd = POINTER(c_int), POINTER(c_double)
+
+        h = c_void_p()
+        if mat.format == 'bsr':
+            # square blocks, values of each block in row-major order
+            bs = mat.blocksize[0]
+            self._check(self.lib.mkl_sparse_d_create_bsr(byref(h),
+                self.SPARSE_INDEX_BASE_ZERO, self.SPARSE_LAYOUT_ROW_MAJOR,
+                mat.shape[0] / bs, mat.shape[1] / bs, bs,
+                indptr[:-1].ctypes.data_as(pi), indptr[1:].ctypes.data_as(pi),
+                indices.ctypes.data_as(pi), data.ctypes.data_as(pd)),
+                'handle')
+        else:
+            self._check(self.lib.mkl_sparse_d_create_csr(byref(h),
+                self.SPARSE_INDEX_BASE_ZERO, mat.shape[0], mat.shape[1],
+                indptr[:-1].ctypes.data_as(pi), indptr[1:].ctypes.data_as(pi),
+                indices.ctypes.data_as(pi), data.ctypes.data_as(pd)),
+                'handle')
+        if ncols is None:
+            self._check(self.lib.mkl_sparse_set_mv_hint(h,
+                self.SPARSE_OPERATION_NON_TRANSPOSE, self._descr,
+                int(expected_calls)), 'handle')
+        else:
+            self._check(self.lib.mkl_sparse_set_mm_hint(h,
+                self.SPARSE_OPERATION_NON_TRANSPOSE, self._descr,
+                self.SPARSE_LAYOUT_ROW_MAJOR, int(ncols),
+                int(expected_calls)), 'handle')
+        self._check(self.lib.mkl_sparse_optimize(h), 'handle')
+
+        self._handles[(id(mat), ncols)] = (self._key(mat), mat, h,
+                                           (indptr, indices, data))
+        return h
+
+    def release(self, mat=None):
+        """Destroys the cached handle of ``mat``, or of all matrices if 
+        ``mat`` is ``None``. Has to be called if the values of a matrix 
+        are modified in place."""
+        for key in self._handles.keys():
+            if mat is None or key[0] == id(mat):
+                self.lib.mkl_sparse_destroy(self._handles.pop(key)[2])
+
+    def mv(self, h, alpha, x, beta, y):
+        """:math:`y = \\alpha A x + \\beta y` for the matrix with handle ``h``
+        and ctypes pointers ``x`` and ``y``."""
+        self.lib.mkl_sparse_d_mv(self.SPARSE_OPERATION_NON_TRANSPOSE,
+            alpha, h, self._descr, x, beta, y)
+
+    def mm(self, h, alpha, x, ncols, beta, y):
+        """Same as :func:`mv` for row-major dense matrices with ``ncols``
+        columns."""
+        self.lib.mkl_sparse_d_mm(self.SPARSE_OPERATION_NON_TRANSPOSE,
+            alpha, h, self._descr, self.SPARSE_LAYOUT_ROW_MAJOR, x, ncols,
+            ncols, beta, y, ncols)
+
+    def set_threads(self, nthreads):
+        """Sets the number of MKL threads. The previous setting is restored
+        by :func:`restore_threads`."""
+        self._saved_threads.append(self.lib.MKL_Get_Max_Threads())
+        self.lib.MKL_Set_Num_Threads(int(nthreads))
+
+    def restore_threads(self):
+        """Restores the number of threads before :func:`set_threads`."""
+        if self._saved_threads:
+            self.lib.MKL_Set_Num_Threads(self._saved_threads.pop())
+
+    def __del__(self):
+        try:
+            self.release()
+        except Exception:
+            pass
+
+
+_MKL_backend = None
+
+def get_MKL_backend():
+    """Returns the shared :class:`MKLBackend` instance for the library
+    defined by ``MKL_path`` in the config file. The library is loaded
+    on the first call."""
+    global _MKL_backend
+    if _MKL_backend is None or _MKL_backend.mkl_path != config['MKL_path']:
+        _MKL_backend = MKLBackend(config['MKL_path'])
+    return _MKL_backend
+
+def release_MKL_handles():
+    """Destroys all cached MKL matrix handles, e.g. after the matrices 
+    have been rebuilt. Does nothing if MKL has not been used."""
+    if _MKL_backend is not None:
+        _MKL_backend.release()
+
 
 def kern_MKL_sparse(nsteps, dX, rho_inv, int_m, dec_m,
-                    phi, grid_idcs, prog_bar=None):
+                    phi, grid_idcs, monitor=None, grid_sol=None,
+                    proj_m=None, threads=None):
     """`Intel MKL sparse BLAS <https://software.intel.com/en-us/articles/intel-mkl-sparse-blas-overview?language=en>`_ 
     implementation of forward-euler integration.
     
     Function requires that the path to the MKL runtime library ``libmkl_rt.[so/dylib]``
-    defined in the config file.
+    defined in the config file. The matrix handles are created and optimized by 
+    :class:`MKLBackend` on the first call and reused afterwards.
     
     Args:
       nsteps (int): number of integration steps
@@ -229,79 +612,376 @@ def kern_MKL_sparse(nsteps, dX, rho_inv, int_m, dec_m,
       dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
       phi (numpy.array): initial state vector :math:`\\Phi(X_0)` 
       grid_idcs (list): indices at which longitudinal solutions have to be saved.
-      prog_bar (object,optional): handle to :class:`ProgressBar` object
+      monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+      grid_sol (object,optional): sink for longitudinal solutions, see :mod:`MCEq.snapshots`
+      proj_m (scipy.sparse.csr_matrix,optional): projection matrix applied to the
+        longitudinal solutions before storing, see :func:`MCEq.core.MCEqRun._obs_projection`
+      threads (int,optional): number of MKL threads, default is ``MKL_threads``
+        from :mod:`mceq_config`
     Returns:
-      numpy.array: state vector :math:`\\Phi(X_{nsteps})` after integration
+      numpy.array, object: state vector :math:`\\Phi(X_{nsteps})` after integration
+      and the sink containing the longitudinal solutions
     """
     
-    from ctypes import cdll, c_int, c_double, c_char, POINTER, byref
-    try:
-        mkl = cdll.LoadLibrary(config['MKL_path'])
-    except OSError:
-        raise Exception("kern_MKL_sparse(): MKL runtime library not " + 
-                        "found. Please check path.")
+    from ctypes import c_double, POINTER
 
-    # sparse CSR-matrix x dense vector 
-    gemv = mkl.mkl_dcsrmv
-    # dense vector + dense vector
-    axpy = mkl.cblas_daxpy
+    mkl = get_MKL_backend()
+    int_h = mkl.handle(int_m, nsteps)
+    dec_h = mkl.handle(dec_m, nsteps)
+    axpy = mkl.lib.cblas_daxpy
+
+    npphi = np.copy(phi)
+    phi = npphi.ctypes.data_as(POINTER(c_double))
+    npdelta_phi = np.zeros_like(npphi, dtype='double')
+    delta_phi = npdelta_phi.ctypes.data_as(POINTER(c_double))
+    m = int_m.shape[0]
 
     # Set number of threads to sufficiently small number, since 
     # matrix-vector multiplication is memory bandwidth limited
-    mkl.mkl_set_num_threads(byref(c_int(config['MKL_threads'])))
+    mkl.set_threads(threads or config['MKL_threads'])
+    
+    if grid_sol is None:
+        grid_sol = ListSink()
+    grid_step = 0
+    next_report = 0 if monitor else -1
+    try:
+        for step in xrange(nsteps):
+            if step == next_report:
+                monitor.update(step)
+                next_report += monitor.stride
+                
+            # delta_phi = int_m.dot(phi)
+            mkl.mv(int_h, 1., phi, 0., delta_phi)
+            # delta_phi = rho_inv * dec_m.dot(phi) + delta_phi
+            mkl.mv(dec_h, rho_inv[step], phi, 1., delta_phi)
+            # phi = delta_phi * dX + phi
+            axpy(m, dX[step], delta_phi, 1, phi, 1)
+            
+            if (grid_idcs and grid_step < len(grid_idcs) 
+                and grid_idcs[grid_step] == step):
+                grid_sol.append(npphi if proj_m is None 
+                                else proj_m.dot(npphi))
+                grid_step += 1
+    finally:
+        mkl.restore_threads()
 
-    # Prepare CTYPES pointers for MKL sparse CSR BLAS
-    int_m_data = int_m.data.ctypes.data_as(POINTER(c_double))
-    int_m_ci = int_m.indices.ctypes.data_as(POINTER(c_int))
-    int_m_pb = int_m.indptr[:-1].ctypes.data_as(POINTER(c_int))
-    int_m_pe = int_m.indptr[1:].ctypes.data_as(POINTER(c_int))
+    return npphi, grid_sol
 
-    dec_m_data = dec_m.data.ctypes.data_as(POINTER(c_double))
-    dec_m_ci = dec_m.indices.ctypes.data_as(POINTER(c_int))
-    dec_m_pb = dec_m.indptr[:-1].ctypes.data_as(POINTER(c_int))
-    dec_m_pe = dec_m.indptr[1:].ctypes.data_as(POINTER(c_int))
 
-    npphi = np.copy(phi)
-    phi = npphi.ctypes.data_as(POINTER(c_double))
-    npdelta_phi = np.zeros_like(npphi, dtype='double')
+def kern_MKL_sparse_batch(nsteps, dX, rho_inv, int_m, dec_m,
+                          phi, monitor=None, threads=None):
+    """`Intel MKL sparse BLAS <https://software.intel.com/en-us/articles/intel-mkl-sparse-blas-overview?language=en>`_ 
+    implementation of forward-euler integration for a batch of state vectors.
+    
+    The sparse matrix - dense matrix products are calculated with
+    ``mkl_sparse_d_mm`` of the inspector-executor API, such that each step 
+    requires a single pass over the matrices for all columns. The matrix
+    handles are created by :class:`MKLBackend` with the number of steps 
+    and columns as hints and reused by subsequent calls. See 
+    :func:`kern_numpy_batch` for details.
+    
+    Args:
+      nsteps (int): number of integration steps
+      dX (numpy.array[nsteps, ncols]): step-sizes :math:`\\Delta X_i` in g/cm**2 per column
+      rho_inv (numpy.array[nsteps, ncols]): density values :math:`\\frac{1}{\\rho(X_i)}` per column
+      int_m (numpy.array): interaction matrix :eq:`int_matrix` in sparse representation
+      dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in sparse representation
+      phi (numpy.array[dim_states, ncols]): initial state vectors :math:`\\Phi(X_0)` as columns
+      monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+      threads (int,optional): number of MKL threads, default is ``MKL_threads``
+        from :mod:`mceq_config`
+    Returns:
+      numpy.array: state vectors :math:`\\Phi(X_{nsteps})` after integration
+    """
+    
+    from ctypes import c_double, POINTER
+
+    mkl = get_MKL_backend()
+    npphi = np.ascontiguousarray(phi, dtype='double')
+    ncols = npphi.shape[1]
+    int_h = mkl.handle(int_m, nsteps, ncols)
+    dec_h = mkl.handle(dec_m, nsteps, ncols)
+
+    c_phi = npphi.ctypes.data_as(POINTER(c_double))
+    npphi_r = np.zeros_like(npphi)
+    c_phi_r = npphi_r.ctypes.data_as(POINTER(c_double))
+    npdelta_phi = np.zeros_like(npphi)
     delta_phi = npdelta_phi.ctypes.data_as(POINTER(c_double))
 
-    trans = c_char('n')
-    npmatd = np.chararray(6)
-    npmatd[0] = 'G'
-    npmatd[3] = 'C'
-    matdsc = npmatd.ctypes.data_as(POINTER(c_char))
-    m = c_int(int_m.shape[0])
-    cdzero = c_double(0.)
-    cdone = c_double(1.)
-    cione = c_int(1)
+    mkl.set_threads(threads or config['MKL_threads'])
+
+    next_report = 0 if monitor else -1
+    try:
+        for step in xrange(nsteps):
+            if step == next_report:
+                monitor.update(step)
+                next_report += monitor.stride
+
+            # delta_phi = int_m.dot(phi)
+            mkl.mm(int_h, 1., c_phi, ncols, 0., delta_phi)
+            # delta_phi = dec_m.dot(phi * rho_inv) + delta_phi
+            np.multiply(npphi, rho_inv[step], npphi_r)
+            mkl.mm(dec_h, 1., c_phi_r, ncols, 1., delta_phi)
+            # phi = delta_phi * dX + phi
+            npdelta_phi *= dX[step]
+            npphi += npdelta_phi
+    finally:
+        mkl.restore_threads()
+
+    return npphi
+
+
+def kern_compact(nsteps, dX, rho_inv, int_m, dec_m,
+                 phi, grid_idcs, monitor=None, grid_sol=None,
+                 proj_m=None):
+    """Forward-euler integration for matrices in the 
+    :class:`MCEq.formats.CompactCSR` format.
+
+    The matrix-vector products are compiled with :mod:`numba` and accumulate
+    in double precision, independent of the precision of the stored values.
+    The state vector is kept in double precision.
     
+    Args:
+      nsteps (int): number of integration steps
+      dX (numpy.array[nsteps]): vector of step-sizes :math:`\\Delta X_i` in g/cm**2
+      rho_inv (numpy.array[nsteps]): vector of density values :math:`\\frac{1}{\\rho(X_i)}`
+      int_m (MCEq.formats.CompactCSR): interaction matrix :eq:`int_matrix`
+      dec_m (MCEq.formats.CompactCSR): decay  matrix :eq:`dec_matrix`
+      phi (numpy.array): initial state vector :math:`\\Phi(X_0)` 
+      grid_idcs (list): indices at which longitudinal solutions have to be saved.
+      monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+      grid_sol (object,optional): sink for longitudinal solutions, see :mod:`MCEq.snapshots`
+      proj_m (scipy.sparse.csr_matrix,optional): projection matrix applied to the
+        longitudinal solutions before storing, see :func:`MCEq.core.MCEqRun._obs_projection`
+    Returns:
+      numpy.array, object: state vector :math:`\\Phi(X_{nsteps})` after integration
+      and the sink containing the longitudinal solutions
+    """
+
+    phi = np.array(phi, dtype=np.float64)
+    delta_phi = np.zeros_like(phi)
+    dX = dX.astype(np.float64)
+    rho_inv = rho_inv.astype(np.float64)
+
+    if grid_sol is None:
+        grid_sol = ListSink()
     grid_step = 0
-    grid_sol = []
+
+    next_report = 0 if monitor else -1
     for step in xrange(nsteps):
-        if prog_bar:
-            prog_bar.update(step)
-            
-        # delta_phi = int_m.dot(phi)
-        gemv(byref(trans), byref(m), byref(m),
-             byref(cdone), matdsc,
-             int_m_data, int_m_ci, int_m_pb, int_m_pe,
-             phi, byref(cdzero), delta_phi)
-        # delta_phi = rho_inv * dec_m.dot(phi) + delta_phi
-        gemv(byref(trans), byref(m), byref(m),
-             byref(c_double(rho_inv[step])), matdsc,
-             dec_m_data, dec_m_ci, dec_m_pb, dec_m_pe,
-             phi, byref(cdone), delta_phi)
-        # phi = delta_phi * dX + phi
-        axpy(m, c_double(dX[step]),
-             delta_phi, cione, phi, cione)
-        
+        if step == next_report:
+            monitor.update(step)
+            next_report += monitor.stride
+
+        delta_phi[:] = 0.
+        int_m.spmv(phi, 1., delta_phi)
+        dec_m.spmv(phi, rho_inv[step], delta_phi)
+        delta_phi *= dX[step]
+        phi += delta_phi
+
         if (grid_idcs and grid_step < len(grid_idcs) 
             and grid_idcs[grid_step] == step):
-            grid_sol.append(np.copy(npphi))
+            grid_sol.append(phi if proj_m is None else proj_m.dot(phi))
             grid_step += 1
-            
 
-    # Reset number of threads for MKL
-    mkl.mkl_set_num_threads(byref(c_int(4)))
-    return npphi, grid_sol
+    return phi, grid_sol
+
+
+def release_kernel_caches():
+    """Releases the MKL handles kept by the kernels. Call it after the 
+    matrices have been modified or rebuilt."""
+    release_MKL_handles()
+
+def kern_active(nsteps, dX, rho_inv, int_m, dec_m,
+                phi, grid_idcs, monitor=None, grid_sol=None,
+                proj_m=None):
+    """Forward-euler integration restricted to the active part of the 
+    state vector.
+
+    If only a few elements of the initial state are non-zero, e.g. after
+    :func:`MCEq.core.MCEqRun.set_single_primary_particle`, most of the
+    matrix multiplies zeros during the whole integration. Particles move 
+    only to equal or lower energies, i.e. the bins above the highest 
+    energy populated in each species, directly or by one of its parents,
+    remain zero. These elements are found as the complement of 
+    :func:`MCEq.formats.reachable_elements`, which works for permuted or 
+    reduced state vectors, too. The rows and columns of the remaining 
+    elements are sliced from the matrices once per call. If they cover 
+    more than the fraction ``active_full_fraction`` of the state vector,
+    the full matrices are used by :func:`kern_numpy`.
+    
+    Args:
+      nsteps (int): number of integration steps
+      dX (numpy.array[nsteps]): vector of step-sizes :math:`\\Delta X_i` in g/cm**2
+      rho_inv (numpy.array[nsteps]): vector of density values :math:`\\frac{1}{\\rho(X_i)}`
+      int_m (numpy.array): interaction matrix :eq:`int_matrix` in dense or sparse representation
+      dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
+      phi (numpy.array): initial state vector :math:`\\Phi(X_0)` 
+      grid_idcs (list): indices at which longitudinal solutions have to be saved.
+      monitor (object,optional): progress monitor, see :mod:`MCEq.monitor`
+      grid_sol (object,optional): sink for longitudinal solutions, see :mod:`MCEq.snapshots`
+      proj_m (scipy.sparse.csr_matrix,optional): projection matrix applied to the
+        longitudinal solutions before storing, see :func:`MCEq.core.MCEqRun._obs_projection`
+    Returns:
+      numpy.array, object: state vector :math:`\\Phi(X_{nsteps})` after integration
+      and the sink containing the longitudinal solutions
+    """
+
+    max_active = config['active_full_fraction'] * len(phi)
+    rows = np.flatnonzero(phi)
+    if len(rows) <= max_active:
+        rows = formats.reachable_elements(int_m, dec_m, rows)
+    if len(rows) > max_active:
+        return kern_numpy(nsteps, dX, rho_inv, int_m, dec_m, phi, 
+                          grid_idcs, monitor, grid_sol, proj_m)
+
+    int_sub = formats.to_csr(int_m)[rows, :][:, rows]
+    dec_sub = formats.to_csr(dec_m)[rows, :][:, rows]
+    phi_a = phi[rows]
+
+    if grid_sol is None:
+        grid_sol = ListSink()
+    grid_step = 0
+
+    next_report = 0 if monitor else -1
+    for step in xrange(nsteps):
+        if step == next_report:
+            monitor.update(step)
+            next_report += monitor.stride
+
+        phi_a += (int_sub.dot(phi_a) + 
+                  dec_sub.dot(phi_a) * rho_inv[step]) * dX[step]
+
+        if (grid_idcs and grid_step < len(grid_idcs) 
+            and grid_idcs[grid_step] == step):
+            phi[rows] = phi_a
+            grid_sol.append(phi if proj_m is None else proj_m.dot(phi))
+            grid_step += 1
+
+    phi[rows] = phi_a
+    return phi, grid_sol
+
+
+#=========================================================================
+# Kernel registry
+#=========================================================================
+
+def _MKL_available():
+    try:
+        get_MKL_backend()
+        return True
+    except Exception:
+        return False
+
+def _CUDA_available():
+    try:
+        import numbapro  # @UnresolvedImport @UnusedImport
+        return True
+    except ImportError:
+        return False
+
+#: (dict) registered kernels, key is (backend, matrix format, batch)
+kernel_registry = {}
+
+#: (set) keys of :data:`kernel_registry`, which are not considered by
+#: :func:`MCEq.autotune.tune_kernel`, see :func:`register_kernel`
+experimental_kernels = set()
+
+#: (dict) functions testing if the library of a backend can be used
+backend_available = {'numpy': lambda: True,
+                     'MKL': _MKL_available,
+                     'CUDA': _CUDA_available,
+                     'numba': lambda: formats.has_numba,
+                     'active': lambda: True}
+
+#: (dict) functions converting the matrices into the format of a kernel,
+#: see :mod:`MCEq.formats`
+matrix_formats = {'dense': formats.to_dense,
+                  'csr': formats.to_csr,
+                  'bsr': formats.to_bsr,
+                  'hybrid': formats.to_hybrid,
+                  'compact': formats.to_compact}
+
+#: (set) matrix formats, which store the values with reduced precision. 
+#: They are timed by :func:`MCEq.autotune.tune_kernel` only if 
+#: ``autotune_lossy`` is set.
+lossy_formats = set(['compact'])
+
+def register_kernel(backend, matrix_format, kernel, batch=False,
+                    available=None, experimental=False):
+    """Adds a kernel to :data:`kernel_registry`.
+
+    Args:
+      backend (str): name of the backend, e.g. 'numpy' or 'MKL'
+      matrix_format (str): key in :data:`matrix_formats`
+      kernel (function): kernel with the signature of :func:`kern_numpy`
+        or, if ``batch`` is set, of :func:`kern_numpy_batch`
+      batch (bool,optional): kernel integrates a matrix of state vectors
+      available (function,optional): returns True if the libraries of the
+        backend are installed. Required for backends which are not yet
+        in :data:`backend_available`.
+      experimental (bool,optional): kernel can only be selected explicitly
+        with ``kernel_config`` and is not timed by the auto-tuner
+    """
+    if available is not None:
+        backend_available[backend] = available
+    elif backend not in backend_available:
+        raise Exception("kernels::register_kernel(): No availability " +
+                        "test for backend '{0}'.".format(backend))
+    if matrix_format not in matrix_formats:
+        raise Exception("kernels::register_kernel(): Unknown matrix " +
+                        "format '{0}'.".format(matrix_format))
+    kernel_registry[(backend, matrix_format, batch)] = kernel
+    if experimental:
+        experimental_kernels.add((backend, matrix_format, batch))
+    else:
+        experimental_kernels.discard((backend, matrix_format, batch))
+
+def get_kernel(backend, matrix_format, batch=False):
+    """Returns a registered kernel.
+
+    Raises:
+      Exception: if no kernel is registered for the combination
+    """
+    try:
+        return kernel_registry[(backend, matrix_format, batch)]
+    except KeyError:
+        raise Exception(("kernels::get_kernel(): Unsupported " + 
+                         "{0}integrator settings '{1}/{2}'.").format(
+                        'batch ' if batch else '', matrix_format, backend))
+
+def available_kernels(batch=False, experimental=True):
+    """Returns a list of (backend, matrix format) for which a kernel is
+    registered and the libraries are installed. Experimental kernels
+    are skipped if ``experimental`` is False."""
+    status = {}
+    avail = []
+    for (backend, fmt, bt) in sorted(kernel_registry.keys()):
+        if bt != batch:
+            continue
+        if not experimental and (backend, fmt, bt) in experimental_kernels:
+            continue
+        if backend not in status:
+            status[backend] = backend_available[backend]()
+        if status[backend]:
+            avail.append((backend, fmt))
+    return avail
+
+register_kernel('numpy', 'dense', kern_numpy)
+register_kernel('numpy', 'csr', kern_numpy)
+register_kernel('CUDA', 'dense', kern_CUDA_dense)
+register_kernel('CUDA', 'csr', kern_CUDA_sparse)
+register_kernel('MKL', 'csr', kern_MKL_sparse)
+register_kernel('MKL', 'bsr', kern_MKL_sparse)
+register_kernel('numpy', 'bsr', kern_numpy)
+register_kernel('numpy', 'hybrid', kern_numpy)
+register_kernel('numpy', 'compact', kern_numpy)
+register_kernel('numba', 'compact', kern_compact)
+register_kernel('active', 'csr', kern_active)
+register_kernel('numpy', 'dense', kern_numpy_batch, batch=True)
+register_kernel('numpy', 'csr', kern_numpy_batch, batch=True)
+register_kernel('numpy', 'bsr', kern_numpy_batch, batch=True)
+register_kernel('numpy', 'hybrid', kern_numpy_batch, batch=True)
+register_kernel('numpy', 'compact', kern_numpy_batch, batch=True)
+register_kernel('MKL', 'csr', kern_MKL_sparse_batch, batch=True)
+register_kernel('MKL', 'bsr', kern_MKL_sparse_batch, batch=True)
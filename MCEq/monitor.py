@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.monitor` --- progress reports of long calculations
+=============================================================
+
+The integration kernels in :mod:`MCEq.kernels`, the calculation of the
+integration path and the :mod:`scipy` ODE solver report their progress
+to a *monitor* object. The monitor is called only every ``stride`` steps,
+such that the overhead in the inner loops is a single integer comparison.
+
+Available monitors:
+
+- :class:`BarMonitor` draws a progress bar using the `progressbar`
+  package, if it is installed,
+- :class:`PrintMonitor` prints one line per report, e.g. for log files,
+- :class:`CallbackMonitor` passes the reports to a user function,
+- :class:`NoMonitor` does nothing. Kernels skip all monitoring code,
+  since it evaluates to ``False``.
+
+Each report contains the step index (or the depth, if the number of
+steps is not known in advance), the slant depth :math:`X`, the inverse
+density :math:`\\frac{1}{\\rho(X)}`, the elapsed time and the throughput.
+The monitor is selected with the ``progress_monitor`` and ``progress_stride``
+keys in :mod:`mceq_config` or with :func:`MCEq.core.MCEqRun.set_monitor`.
+"""
+
+import numpy as np
+from time import time
+from abc import ABCMeta, abstractmethod
+from mceq_config import config
+
+
+class ProgressMonitor():
+    """Abstract class for progress monitors.
+
+    Args:
+      stride (int): number of steps between two reports
+
+    Note:
+      Do not instantiate this class directly.
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, stride=None):
+        self.stride = max(1, int(config['progress_stride']
+                                 if stride == None else stride))
+        self.maximum = None
+        self._X = None
+        self._rho_inv = None
+        self._start_time = None
+
+    def start(self, maximum, dX=None, rho_inv=None):
+        """Starts the timer for a new calculation.
+
+        If the step sizes and densities of the integration path are known,
+        :func:`update` looks up :math:`X` and :math:`\\frac{1}{\\rho(X)}`
+        by the step index, so that the kernels do not have to pass them.
+
+        Args:
+          maximum (float): value at which the calculation is finished
+          dX (numpy.array,optional): step sizes of the integration path
+          rho_inv (numpy.array,optional): inverse densities of the
+            integration path
+        """
+        self.maximum = maximum
+        self._X = None if dX is None else np.cumsum(dX, axis=0) - dX
+        self._rho_inv = rho_inv
+        self._start_time = time()
+
+    def update(self, step, X=None, rho_inv=None):
+        """Creates a report for the current position of the calculation.
+
+        Args:
+          step (float): step index or progress variable, in the same
+            units as ``maximum`` in :func:`start`
+          X (float,optional): slant depth in g/cm**2
+          rho_inv (float,optional): inverse density in cm**3/g
+        """
+        if X is None and self._X is not None and step < len(self._X):
+            X = self._X[step]
+        if (rho_inv is None and self._rho_inv is not None
+            and step < len(self._rho_inv)):
+            rho_inv = self._rho_inv[step]
+        elapsed = time() - self._start_time
+        self._report({'step': step,
+                      'maximum': self.maximum,
+                      'X': X,
+                      'rho_inv': rho_inv,
+                      'elapsed': elapsed,
+                      'throughput': step / elapsed if elapsed > 0. else 0.})
+
+    def finish(self):
+        """Called after the calculation has finished."""
+        pass
+
+    @abstractmethod
+    def _report(self, info):
+        """Processes a report.
+
+        Args:
+          info (dict): with keys 'step', 'maximum', 'X', 'rho_inv',
+            'elapsed' (in seconds) and 'throughput' (steps per second)
+        """
+        raise NotImplementedError("ProgressMonitor::_report(): " +
+                                  "Base class called.")
+
+
+class NoMonitor(ProgressMonitor):
+    """Monitor which discards all reports. Use it for batch runs."""
+
+    def __nonzero__(self):
+        return False
+
+    def start(self, maximum, dX=None, rho_inv=None):
+        pass
+
+    def update(self, step, X=None, rho_inv=None):
+        pass
+
+    def _report(self, info):
+        pass
+
+
+class PrintMonitor(ProgressMonitor):
+    """Prints a line for each report."""
+
+    def _format(self, value):
+        if np.ndim(value) == 0:
+            return "{0:10.4g}".format(float(value))
+        return np.array_str(np.asarray(value), precision=4)
+
+    def _report(self, info):
+        line = "  {0:8.6g}/{1:<8.6g}".format(info['step'], info['maximum'])
+        if info['X'] is not None:
+            line += " X=" + self._format(info['X']) + " g/cm2"
+        if info['rho_inv'] is not None:
+            line += " 1/rho=" + self._format(info['rho_inv']) + " cm3/g"
+        print line + " t={0:6.2f} s, {1:8.1f}/s".format(
+            info['elapsed'], info['throughput'])
+
+    def finish(self):
+        if self._start_time is not None:
+            print "  finished after {0:6.2f} s".format(
+                time() - self._start_time)
+
+
+class BarMonitor(ProgressMonitor):
+    """Shows a progress bar and the remaining time.
+
+    The progress bar is a small python package. It should you cost no time
+    to install it from your favorite repositories such as pip, easy_install,
+    anaconda, etc. If it is not available, the reports are printed
+    as in :class:`PrintMonitor` and a warning is printed for the first
+    instance.
+    """
+
+    #: (bool) set after the missing package has been reported
+    _warned = False
+
+    def __init__(self, stride=None):
+        ProgressMonitor.__init__(self, stride)
+        self._bar = None
+        self._fallback = None
+        try:
+            import progressbar
+            self._progressbar = progressbar
+        except ImportError:
+            if not BarMonitor._warned:
+                print ("BarMonitor::__init__(): Failed to import " + 
+                       "'progressbar' progress indicator, printing the " +
+                       "progress instead.")
+                BarMonitor._warned = True
+            self._fallback = PrintMonitor(stride)
+
+    def start(self, maximum, dX=None, rho_inv=None):
+        if self._fallback is not None:
+            return self._fallback.start(maximum, dX, rho_inv)
+        ProgressMonitor.start(self, maximum, dX, rho_inv)
+        pb = self._progressbar
+        self._bar = pb.ProgressBar(maxval=maximum,
+                                   widgets=[pb.Percentage(), ' ',
+                                            pb.Bar(), ' ', pb.ETA()])
+        self._bar.start()
+
+    def update(self, step, X=None, rho_inv=None):
+        if self._fallback is not None:
+            return self._fallback.update(step, X, rho_inv)
+        self._bar.update(min(step, self.maximum))
+
+    def finish(self):
+        if self._fallback is not None:
+            return self._fallback.finish()
+        if self._bar is not None:
+            self._bar.finish()
+
+    def _report(self, info):
+        pass
+
+
+class CallbackMonitor(ProgressMonitor):
+    """Passes each report to a user function.
+
+    Args:
+      callback (callable): function, which receives the report dictionary
+        described in :func:`ProgressMonitor._report`
+      stride (int): number of steps between two reports
+    """
+
+    def __init__(self, callback, stride=None):
+        ProgressMonitor.__init__(self, stride)
+        self.callback = callback
+
+    def _report(self, info):
+        self.callback(info)
+
+
+def make_monitor(kind=None, stride=None):
+    """Creates a monitor according to the ``progress_monitor`` and
+    ``progress_stride`` settings in :mod:`mceq_config`.
+
+    Args:
+      kind (str or callable,optional): 'bar', 'print', 'none' or a function
+        for :class:`CallbackMonitor`. Overrides the config.
+      stride (int,optional): number of steps between two reports. Overrides
+        the config.
+    Returns:
+      (:class:`ProgressMonitor`): monitor object
+    Raises:
+      Exception: if monitor type unknown
+    """
+    kind = config['progress_monitor'] if kind == None else kind
+    if callable(kind):
+        return CallbackMonitor(kind, stride)
+    elif kind == 'bar':
+        return BarMonitor(stride)
+    elif kind == 'print':
+        return PrintMonitor(stride)
+    elif kind == 'none':
+        return NoMonitor(stride)
+    else:
+        raise Exception("monitor::make_monitor(): Unknown monitor " +
+                        "type '{0}'.".format(kind))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.response` --- precomputed response to the primary flux
+==================================================================
+
+The cascade equations are linear in the state vector. For a fixed zenith
+angle, atmosphere and interaction model the fluxes at the surface are
+therefore a linear function of the initial state :math:`\\Phi_0`,
+
+.. math::
+
+   \\Phi_{surf} = G \\cdot \\Phi_0.
+
+The primary models in :mod:`CRFluxModels` only populate the proton and
+neutron blocks of :math:`\\Phi_0`, such that the observables are fully
+described by the columns of :math:`G`, which belong to nucleons, and the
+rows of the requested observables. :func:`MCEq.core.MCEqRun.compute_response`
+calculates this part of :math:`G` with one batched integration over unit
+nucleon spectra and returns a :class:`ResponseTable`.
+
+Evaluating a new primary model is then a single matrix-vector product,
+instead of an integration of the cascade equations. This is useful for
+fits of the primary flux, where the model parameters change thousands of
+times while the atmosphere and the hadronic model stay fixed.
+
+Tables can be written to ``.npz`` files with :func:`ResponseTable.save`
+and read back with :func:`load_response`.
+"""
+
+import numpy as np
+from mceq_config import dbg
+
+
+class ResponseTable():
+    """Linear map from the nucleon part of the initial state to the
+    fluxes of observables at the surface.
+
+    The columns ``0`` to ``d`` of :attr:`G` belong to the proton energy
+    bins, the columns ``d`` to ``2 * d`` to the neutron energy bins. The
+    rows ``i * d`` to ``(i + 1) * d`` contain the flux of ``observables[i]``.
+
+    Args:
+      G (numpy.array): response matrix of shape
+        (len(observables) * d, 2 * d)
+      observables (list of str): names of the observables
+      e_grid (numpy.array): centers of the energy bins in GeV
+      info (dict,optional): description of the calculation, e.g.
+        zenith angle, atmosphere and interaction model
+    """
+
+    def __init__(self, G, observables, e_grid, info=None):
+        self.G = np.asarray(G)
+        self.observables = list(observables)
+        self.e_grid = np.asarray(e_grid)
+        self.d = self.e_grid.size
+        self.info = dict(info or {})
+
+        if self.G.shape != (len(self.observables) * self.d, 2 * self.d):
+            raise Exception(
+                ("ResponseTable::__init__(): Shape {0} of G does not " +
+                 "match {1} observables and {2} energy bins.").format(
+                    self.G.shape, len(self.observables), self.d))
+
+    def evaluate(self, p_flux, n_flux, mag=0.):
+        """Computes the fluxes of the observables for a nucleon spectrum.
+
+        Args:
+          p_flux (numpy.array): proton block of the initial state, i.e.
+            the values which :func:`MCEq.core.MCEqRun.set_primary_model`
+            writes into :attr:`MCEq.core.MCEqRun.phi0`
+          n_flux (numpy.array): neutron block of the initial state
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+        Returns:
+          (numpy.array): fluxes of shape (len(observables), d)
+        """
+        res = self.G.dot(np.concatenate([p_flux, n_flux]))
+        return (res.reshape(len(self.observables), self.d) *
+                self.e_grid ** mag)
+
+    def evaluate_model(self, pmodel, mag=0.):
+        """Computes the fluxes of the observables for a primary model.
+
+        Args:
+          pmodel (:class:`CRFluxModels.PrimaryFlux`): instance of a
+            primary model
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+        Returns:
+          (numpy.array): fluxes of shape (len(observables), d)
+        """
+        p_top, n_top = np.vectorize(pmodel.p_and_n_flux)(self.e_grid)[1:]
+        return self.evaluate(1e-4 * p_top, 1e-4 * n_top, mag)
+
+    def get_solution(self, particle_name, p_flux, n_flux, mag=0.):
+        """Returns the flux of one observable for a nucleon spectrum.
+
+        Args:
+          particle_name (str): one of :attr:`observables`
+          p_flux (numpy.array): proton block of the initial state
+          n_flux (numpy.array): neutron block of the initial state
+          mag (float, optional): 'magnification factor' :math:`E^{mag}`
+        Returns:
+          (numpy.array): flux on the energy grid
+        """
+        if particle_name not in self.observables:
+            raise Exception(
+                ("ResponseTable::get_solution(): {0} is not part of " +
+                 "the table.").format(particle_name))
+        i = self.observables.index(particle_name)
+        rows = self.G[i * self.d:(i + 1) * self.d]
+        return (rows.dot(np.concatenate([p_flux, n_flux])) *
+                self.e_grid ** mag)
+
+    def save(self, fname):
+        """Writes the table to a ``.npz`` file.
+
+        Args:
+          fname (str): file name
+        """
+        info_keys = sorted(self.info.keys())
+        np.savez(fname, G=self.G, e_grid=self.e_grid,
+                 observables=np.array(self.observables, dtype=str),
+                 info_keys=np.array(info_keys, dtype=str),
+                 info_values=np.array([repr(self.info[key])
+                                       for key in info_keys], dtype=str))
+        if dbg > 0:
+            print ("ResponseTable::save(): {0} observables written " +
+                   "to {1}.").format(len(self.observables), fname)
+
+
+def load_response(fname):
+    """Reads a table written by :func:`ResponseTable.save`.
+
+    Args:
+      fname (str): file name
+    Returns:
+      (:class:`ResponseTable`): response table
+    """
+    from ast import literal_eval
+
+    data = np.load(fname)
+    info = dict((str(key), literal_eval(str(value))) for key, value in
+                zip(data['info_keys'], data['info_values']))
+    return ResponseTable(data['G'], [str(obs) for obs in data['observables']],
+                         data['e_grid'], info)
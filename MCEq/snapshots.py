@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.snapshots` --- storage of intermediate solutions
+===========================================================
+
+The integration kernels in :mod:`MCEq.kernels` save the state vector
+at the depths requested via the ``int_grid`` argument of
+:func:`MCEq.core.MCEqRun.solve`. Instead of collecting the copies in
+a python list, the kernels pass them to a *sink* object, which decides
+where the data is stored:
+
+- :class:`ListSink` keeps copies in memory (previous default behavior),
+- :class:`ArraySink` writes into a preallocated :class:`numpy.ndarray`,
+- :class:`MemmapSink` writes into a ``.npy`` file via :func:`numpy.memmap`,
+  such that the snapshots do not have to fit into memory.
+
+The latter two support down-conversion to single precision. All sinks
+can be indexed like a list, i.e. ``sink[grid_idx]`` returns the state
+vector at grid point ``grid_idx``. For :class:`MemmapSink` the data
+is read from disk only on access.
+
+The type of the sink is selected in :mod:`mceq_config` using the
+``grid_sol_storage`` key and created with :func:`make_sink`.
+
+:class:`OffsetSink` adds a constant vector before passing the snapshots
+to another sink. It restores the species, which are not part of the 
+solver state, see :func:`MCEq.core.MCEqRun.decouple_sinks`.
+
+For checkpoints (see :func:`MCEq.core.MCEqRun.resume`) the sinks write
+only the snapshots added since the previous checkpoint, see
+:func:`SnapshotSink.save`. :class:`MemmapSink` is flushed instead.
+"""
+
+import numpy as np
+from abc import ABCMeta, abstractmethod
+from mceq_config import config, dbg
+
+
+class SnapshotSink():
+    """Abstract class for the storage of intermediate solutions.
+
+    Note:
+      Do not instantiate this class directly.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def append(self, phi):
+        """Stores a copy of the state vector ``phi``.
+
+        Args:
+          phi (numpy.array): state vector
+        """
+        raise NotImplementedError("SnapshotSink::append(): " +
+                                  "Base class called.")
+
+    @abstractmethod
+    def __getitem__(self, idx):
+        raise NotImplementedError("SnapshotSink::__getitem__(): " +
+                                  "Base class called.")
+
+    @abstractmethod
+    def __len__(self):
+        raise NotImplementedError("SnapshotSink::__len__(): " +
+                                  "Base class called.")
+
+    def finish(self):
+        """Called by the solver after the integration has finished."""
+        pass
+
+    def save(self, fname):
+        """Makes the stored snapshots persistent for a checkpoint.
+
+        The snapshots are appended as raw values to the file ``fname``.
+        Only the snapshots added since the previous call are written,
+        the first call truncates the file.
+
+        Args:
+          fname (str): file name
+        """
+        n_saved = getattr(self, '_n_saved', 0)
+        with open(fname, 'ab' if n_saved else 'wb') as f:
+            for idx in xrange(n_saved, len(self)):
+                np.asarray(self[idx], dtype=self.dtype).tofile(f)
+        self._n_saved = len(self)
+
+    def load(self, fname, n_snapshots):
+        """Restores the first ``n_snapshots`` snapshots written by
+        :func:`save`. Snapshots written after the last complete checkpoint
+        are removed from the file.
+
+        Args:
+          fname (str): file name
+          n_snapshots (int): number of snapshots in the checkpoint
+        """
+        if n_snapshots > 0:
+            with open(fname, 'r+b') as f:
+                f.truncate(n_snapshots * self.dim * self.dtype.itemsize)
+            data = np.fromfile(fname, dtype=self.dtype)
+            for phi in data.reshape(n_snapshots, self.dim):
+                self.append(phi)
+        self._n_saved = n_snapshots
+
+
+class ListSink(SnapshotSink):
+    """Keeps copies of the state vectors in a python list.
+
+    Args:
+      dim (int, optional): size of the state vector, required by
+        :func:`load`
+    """
+
+    def __init__(self, dim=None):
+        self.dim, self.dtype = dim, np.dtype('float64')
+        self._data = []
+
+    def append(self, phi):
+        self._data.append(np.copy(phi))
+
+    def __getitem__(self, idx):
+        return self._data[idx]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class OffsetSink(SnapshotSink):
+    """Adds a constant vector to the state vectors and stores the result
+    in another sink.
+
+    Args:
+      sink (object): sink receiving the snapshots
+      offset (numpy.array): vector added to each state vector
+    """
+
+    def __init__(self, sink, offset):
+        self.sink, self.offset = sink, offset
+
+    def append(self, phi):
+        self.sink.append(phi + self.offset)
+
+    def __getitem__(self, idx):
+        return self.sink[idx]
+
+    def __len__(self):
+        return len(self.sink)
+
+
+class ArraySink(SnapshotSink):
+    """Writes the state vectors into rows of a preallocated array.
+
+    Args:
+      n_snapshots (int): number of snapshots
+      dim (int): size of the state vector
+      dtype (str or numpy.dtype, optional): storage precision
+    """
+
+    def __init__(self, n_snapshots, dim, dtype='float64'):
+        self.dim, self.dtype = dim, np.dtype(dtype)
+        self._data = self._allocate(n_snapshots, dim, dtype)
+        self._n_stored = 0
+
+    def _allocate(self, n_snapshots, dim, dtype):
+        return np.zeros((n_snapshots, dim), dtype=dtype)
+
+    def append(self, phi):
+        self._data[self._n_stored] = phi
+        self._n_stored += 1
+
+    def __getitem__(self, idx):
+        return self._data[:self._n_stored][idx]
+
+    def __len__(self):
+        return self._n_stored
+
+    @property
+    def data(self):
+        """(numpy.array) view on the stored snapshots"""
+        return self._data[:self._n_stored]
+
+
+class MemmapSink(ArraySink):
+    """Writes the state vectors into a memory mapped ``.npy`` file.
+
+    The file can be opened later using ``numpy.load(fname, mmap_mode='r')``.
+
+    Args:
+      n_snapshots (int): number of snapshots
+      dim (int): size of the state vector
+      fname (str): file name
+      dtype (str or numpy.dtype, optional): storage precision
+      mode (str, optional): 'w+' creates the file, 'r+' opens an existing
+        file of a checkpoint without changing its contents
+    """
+
+    def __init__(self, n_snapshots, dim, fname, dtype='float64', mode='w+'):
+        self.fname, self.mode = fname, mode
+        ArraySink.__init__(self, n_snapshots, dim, dtype)
+
+    def _allocate(self, n_snapshots, dim, dtype):
+        if dbg > 0:
+            print ("MemmapSink::_allocate(): mapping {0} snapshots " +
+                   "to file {1}.").format(n_snapshots, self.fname)
+        if self.mode == 'w+':
+            return np.lib.format.open_memmap(self.fname, mode='w+',
+                                             dtype=dtype,
+                                             shape=(n_snapshots, dim))
+        data = np.load(self.fname, mmap_mode=self.mode)
+        if data.shape != (n_snapshots, dim) or data.dtype != dtype:
+            raise Exception(("MemmapSink::_allocate(): {0} contains {1} " +
+                             "values of type {2}, expected {3} of type " +
+                             "{4}.").format(self.fname, data.shape,
+                                            data.dtype, (n_snapshots, dim),
+                                            np.dtype(dtype)))
+        return data
+
+    def finish(self):
+        self._data.flush()
+
+    def save(self, fname):
+        """Flushes the file, ``fname`` is not used."""
+        self._data.flush()
+
+    def load(self, fname, n_snapshots):
+        """Continues after the first ``n_snapshots`` snapshots of the
+        file, ``fname`` is not used."""
+        self._n_stored = n_snapshots
+
+
+def make_sink(n_snapshots, dim, resume=False):
+    """Creates a sink according to the ``grid_sol_storage``,
+    ``grid_sol_dtype`` and ``grid_sol_file`` settings in :mod:`mceq_config`.
+
+    Args:
+      n_snapshots (int): number of snapshots
+      dim (int): size of the state vector
+      resume (bool, optional): if ``True``, an existing ``grid_sol_file``
+        is opened for a resumed integration instead of being replaced
+    Returns:
+      (:class:`SnapshotSink`): sink object
+    Raises:
+      Exception: if storage type unknown
+    """
+    storage = config['grid_sol_storage']
+    if storage == 'list':
+        return ListSink(dim)
+    elif storage == 'array':
+        return ArraySink(n_snapshots, dim, config['grid_sol_dtype'])
+    elif storage == 'memmap':
+        return MemmapSink(n_snapshots, dim, config['grid_sol_file'],
+                          config['grid_sol_dtype'], 'r+' if resume else 'w+')
+    else:
+        raise Exception("snapshots::make_sink(): Unknown storage " +
+                        "type '{0}'.".format(storage))
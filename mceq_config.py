@@ -74,9 +74,33 @@ config = {
 # Selection of integrator (euler/odepack)
 "integrator": "euler",
 
-# euler kernel implementation (numpy/MKL/CUDA)
+# euler kernel implementation (numpy/MKL/CUDA/numba/active/auto). With 
+# 'auto' the fastest available kernel and matrix format are selected at 
+# runtime
 "kernel_config": "MKL",
 
+# The 'active' kernel integrates only the energy bins of each species up to
+# the highest one reachable from the initial flux. It uses the full 
+# matrices, if these bins cover more than this fraction of the state vector
+"active_full_fraction": 0.8,
+
+# Number of steps timed per candidate kernel for kernel_config='auto'
+"autotune_steps": 50,
+
+# MKL thread counts tried for kernel_config='auto'
+"autotune_threads": [1, 2, 4],
+
+# Dense matrices are not tried above this dimension (memory)
+"autotune_max_dense": 5000,
+
+# Include formats with reduced precision ('compact', float32 values by
+# default) in the selection of kernel_config='auto'
+"autotune_lossy": False,
+
+# File in data_dir where the selected kernels are stored per machine and
+# matrix structure
+"autotune_cache_file": 'kernel_tuning.ppd',
+
 #parameters for the odepack integrator. More details at 
 #http://docs.scipy.org/doc/scipy/reference/generated/scipy.integrate.ode.html#scipy.integrate.ode
 "ode_params": {'name':'vode',
@@ -84,9 +108,74 @@ config = {
                'nsteps':10000,
                'max_step':10.0},
 
+# Progress monitor for the solvers: 'bar' (requires the progressbar 
+# package), 'print' (one line per report) or 'none' (for batch runs)
+"progress_monitor": 'bar',
+
+# Number of integration steps between two progress reports
+"progress_stride": 200,
+
+# Write a checkpoint of the forward-euler integration every N steps
+# (0 = disabled). An interrupted run can be continued with MCEqRun.resume()
+"checkpoint_interval": 0,
+
+# File name for checkpoints. Longitudinal solutions, which are not stored
+# in a 'memmap' file (see grid_sol_storage), are appended to the file
+# checkpoint_file + '.grid_sol'
+"checkpoint_file": 'mceq_checkpoint.npz',
+
 # Use sparse linear algebra (recommended!)
 "use_sparse": True,
 
+# Sparse matrix format: 'csr', 'bsr' (blocks of size d x d), 'hybrid'
+# (well filled blocks dense, the rest as CSR) or 'compact' (reduced
+# precision and index width, requires numba), see MCEq.formats
+"sparse_format": 'csr',
+
+# Minimal fraction of non-zero elements for blocks stored densely in
+# the 'hybrid' format
+"hybrid_block_fill": 0.3,
+
+# Remove matrix elements smaller than prune_threshold times the largest
+# element of their column ('column') or energy block ('block'). Diagonal
+# elements are kept. 0 disables pruning. MCEqRun.prune_threshold_scan()
+# helps to find a safe value
+"prune_threshold": 0.,
+"prune_mode": 'column',
+
+# Order of the state vector inside the solver: 'natural' (species by 
+# species), 'rcm' (reverse Cuthill-McKee) or 'energy_major' (energy bins
+# of all species interleaved). Results are always returned in natural order
+"state_ordering": 'natural',
+
+# Restrict the solver to the energy bins with centers in (E_min, E_max) 
+# in GeV, e.g. (100., None). None solves the full energy grid
+"energy_window": None,
+
+# With an energy window, the step size is limited to this fraction of the
+# shortest interaction length, since the decays do not limit it anymore
+"window_step_fraction": 0.01,
+
+# Number of points on the path, on which the derivatives of the density 
+# are tabulated for MCEqRun.solve_atmosphere_sensitivity()
+"atm_derivative_steps": 10000,
+
+# Number of unit nucleon spectra integrated together by
+# MCEqRun.compute_response()
+"response_batch_size": 64,
+
+# Default minimal relevance of species kept by MCEqRun.select_species().
+# With 0 only species which can not contribute are removed
+"species_tolerance": 0.,
+
+# Remove species, which neither interact nor decay (e.g. neutrinos), from
+# the matrix-vector products. Their fluxes are accumulated separately
+"decouple_sinks": False,
+
+# Precision of the matrix elements in the 'compact' format. The products
+# are always accumulated in double precision
+"compact_dtype": 'float32',
+
 #Number of MKL threads (for sparse matrix multiplication the performance
 #advantage from using more than 1 thread is only a few precent due to
 #memory bandwidth limitations)
@@ -95,6 +184,18 @@ config = {
 # CUDA float precision
 "CUDA_precision": 32,
 
+# Storage of longitudinal solutions (intermediate solutions on int_grid):
+# 'list' keeps copies in memory, 'array' writes into a preallocated array,
+# 'memmap' writes into a memory mapped .npy file (see MCEq.snapshots)
+"grid_sol_storage": 'list',
+
+# Precision of stored longitudinal solutions ('array' and 'memmap' only),
+# 'float32' halves the memory/disk footprint
+"grid_sol_dtype": 'float64',
+
+# File name for 'memmap' storage of longitudinal solutions
+"grid_sol_file": 'grid_sol.npy',
+
 #=========================================================================
 # Advanced settings
 #=========================================================================
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic cascade matrices for the tests
+========================================
+
+The matrices have the species x energy layout of :class:`MCEq.core.MCEqRun`,
+but are small and random. Hadrons interact and produce hadrons and mesons,
+mesons decay into leptons and leptons neither interact nor decay (sinks).
+All blocks are upper triangular, i.e. particles move only to lower or
+equal energy bins.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from mceq_config import config
+from MCEq.core import MCEqRun
+
+#: names of the species of the synthetic cascade, see :func:`cascade_matrices`
+hadrons = ['p', 'n', 'pi+', 'K+']
+mesons = ['pi_mu+', 'k_mu+']
+sinks = ['mu+', 'numu']
+species = hadrons + mesons + sinks
+#: PDG IDs of the species, the mesons use the alias IDs of the muon sources
+pdg_ids = [2212, 2112, 211, 321, -7113, -7213, -13, 14]
+
+
+def inverse_lengths(d=8):
+    """Returns the inverse interaction and decay lengths of the synthetic 
+    cascade in the order of the state vector.
+
+    Args:
+      d (int): number of energy bins
+    Returns:
+      (tuple): (Lambda_int, Lambda_dec)
+    """
+    lint, ldec = np.zeros(len(species) * d), np.zeros(len(species) * d)
+    for proj in hadrons:
+        i = species.index(proj)
+        lint[i * d:(i + 1) * d] = 0.02
+    for proj in ['pi+', 'K+'] + mesons:
+        i = species.index(proj)
+        ldec[i * d:(i + 1) * d] = 2e-4 / np.logspace(0, 2, d)
+    return lint, ldec
+
+
+def cascade_yields(d=8, seed=1):
+    """Returns the yield matrices :math:`\\boldsymbol{C}` and 
+    :math:`\\boldsymbol{D}` of the synthetic cascade.
+
+    Args:
+      d (int): number of energy bins
+      seed (int): seed of the random values
+    Returns:
+      (tuple): (C, D) as dense arrays
+    """
+    rs = np.random.RandomState(seed)
+    dim = len(species) * d
+    C, D = np.zeros((dim, dim)), np.zeros((dim, dim))
+
+    def block(M, proj, sec):
+        i, j = species.index(sec), species.index(proj)
+        M[i * d:(i + 1) * d, j * d:(j + 1) * d] += np.triu(rs.rand(d, d)) * 0.1
+
+    for proj in hadrons:
+        for sec in hadrons + mesons:
+            block(C, proj, sec)
+    for proj, sec in [('pi+', 'pi_mu+'), ('K+', 'k_mu+'),
+                      ('pi_mu+', 'mu+'), ('pi_mu+', 'numu'),
+                      ('k_mu+', 'mu+'), ('k_mu+', 'numu')]:
+        block(D, proj, sec)
+    return C, D
+
+
+def cascade_matrices(d=8, seed=1):
+    """Returns the interaction and decay matrices of the synthetic cascade.
+
+    Args:
+      d (int): number of energy bins
+      seed (int): seed of the random values
+    Returns:
+      (tuple): (int_m, dec_m) as :class:`scipy.sparse.csr_matrix`
+    """
+    C, D = cascade_yields(d, seed)
+    lint, ldec = inverse_lengths(d)
+    I = np.eye(len(species) * d)
+    return csr_matrix((-I + C) * lint), csr_matrix((-I + D) * ldec)
+
+
+def integration_path(nsteps=60, seed=2):
+    """Returns step sizes and inverse densities of a synthetic path.
+
+    Returns:
+      (tuple): (nsteps, dX, rho_inv)
+    """
+    rs = np.random.RandomState(seed)
+    return (nsteps, 0.5 + rs.rand(nsteps),
+            (np.sort(rs.rand(nsteps))[::-1] + 0.1) * 1e3)
+
+
+_atmospheres = {}
+
+
+def atmosphere(theta_deg=0., location='BK_USStd'):
+    """Returns a CORSIKA density profile with the zenith angle set.
+
+    The calculation of the density spline takes a few seconds, therefore
+    the profiles are kept and a copy is returned. The atmosphere cache of
+    :mod:`MCEq.density_profiles` is not used.
+    """
+    from copy import copy
+    from MCEq.density_profiles import CorsikaAtmosphere
+
+    key = (theta_deg, location)
+    if key not in _atmospheres:
+        use_atm_cache = config['use_atm_cache']
+        config['use_atm_cache'] = False
+        try:
+            atm = CorsikaAtmosphere(location)
+            atm.set_theta(theta_deg)
+        finally:
+            config['use_atm_cache'] = use_atm_cache
+        _atmospheres[key] = atm
+    return copy(_atmospheres[key])
+
+
+def initial_state(d=8, seed=3):
+    """Returns a state vector with a falling spectrum of nucleons."""
+    rs = np.random.RandomState(seed)
+    phi = np.zeros(len(species) * d)
+    phi[:2 * d] = np.tile(np.logspace(0, 2, d) ** -2.7, 2) * (1. + rs.rand(2 * d))
+    return phi
+
+
+def reference_euler(nsteps, dX, rho_inv, int_m, dec_m, phi):
+    """Plain forward-euler integration with dense matrices."""
+    A, B = int_m.toarray(), dec_m.toarray()
+    phi = np.array(phi, dtype='double')
+    for step in xrange(nsteps):
+        phi = phi + (A.dot(phi) + B.dot(phi) * rho_inv[step]) * dX[step]
+    return phi
+
+
+class CascadeTestCase(unittest.TestCase):
+    """Provides the synthetic matrices, path and initial state and the
+    solution of :func:`MCEq.kernels.kern_numpy` as reference. Changes of
+    :mod:`mceq_config` are undone after each test."""
+
+    def setUp(self):
+        from MCEq import kernels
+
+        self._config = dict(config)
+        self.d = 8
+        self.int_m, self.dec_m = cascade_matrices(self.d)
+        self.nsteps, self.dX, self.rho_inv = integration_path()
+        self.phi0 = initial_state(self.d)
+        self.ref, _ = kernels.kern_numpy(self.nsteps, self.dX, self.rho_inv,
+                                         self.int_m, self.dec_m,
+                                         np.copy(self.phi0), [])
+
+    def tearDown(self):
+        config.clear()
+        config.update(self._config)
+
+    def assertClose(self, res, ref, rtol=1e-12):
+        """Compares relative to the largest absolute value of ``ref``."""
+        self.assertLessEqual(np.max(np.abs(res - ref)),
+                             rtol * np.max(np.abs(ref)))
+
+
+class _Particle():
+    """Minimal particle reference with the index methods used by the solver."""
+
+    def __init__(self, name, nceidx, d):
+        self.name, self.nceidx, self.d = name, nceidx, d
+        self.pdgid = pdg_ids[nceidx]
+
+    def lidx(self):
+        return self.nceidx * self.d
+
+    def uidx(self):
+        return (self.nceidx + 1) * self.d
+
+
+class SyntheticRun(MCEqRun):
+    """:class:`MCEq.core.MCEqRun` with the synthetic matrices.
+
+    The object is set up without data files and atmosphere, the integration
+    path of :func:`integration_path` is assigned directly. The matrices
+    can be rebuilt by :func:`MCEq.core.MCEqRun._init_default_matrices`
+    from :func:`cascade_yields`. Methods, which
+    drop the path (e.g. :func:`MCEq.core.MCEqRun.scale_cross_section`),
+    have to be followed by :func:`set_path`, unless a density profile has
+    been assigned with :func:`set_atmosphere`.
+    """
+
+    def __init__(self, d=8, seed=1):
+        self.cname = 'MCEqRun'
+        self.d, self.seed = d, seed
+        self.e_grid = np.logspace(0, 2, d)
+        self.cascade_particles = [_Particle(name, i, d)
+                                  for i, name in enumerate(species)]
+        self.particle_species = self.cascade_particles
+        self.pname2pref = dict((p.name, p) for p in self.cascade_particles)
+        self.pdg2pref = dict((p.pdgid, p) for p in self.cascade_particles)
+        self.pdg2nceidx = dict((p.pdgid, p.nceidx) 
+                               for p in self.cascade_particles)
+        self.yields_params = {'interaction_model': 'synthetic'}
+        self.n_tot_species = len(species)
+        self.dim_states = d * len(species)
+
+        self.int_m, self.dec_m = cascade_matrices(d, seed)
+        self.Lambda_int, self.Lambda_dec = inverse_lengths(d)
+        self.max_ldec = np.max(self.Lambda_dec)
+        self.I = np.eye(self.dim_states)
+        self._yield_scales = {}
+        self.phi0 = initial_state(d)
+
+        self._monitor = None
+        self._kernel_choice = None
+        self._ordering, self._decouple_sinks = 'natural', False
+        self._species_mask, self._dropped_species = None, []
+        self._bin_mask, self._natural_m = None, None
+        self._perm, self._perm_inv, self._solver_maps = None, None, None
+        self._sink_maps = None
+        self._solver_d, self.max_lint = d, 0.
+        self.atm_config, self.atm_model = None, None
+        set_path(self)
+        self.set_monitor('none')
+
+    def _fill_matrices(self):
+        self.C, self.D = cascade_yields(self.d, self.seed)
+
+
+def set_path(run, nsteps=60):
+    """Assigns the synthetic integration path to ``run``."""
+    nsteps, dX, rho_inv = integration_path(nsteps)
+    run.integration_path = (nsteps, dX, rho_inv, [])
+    run.int_grid, run.grid_var = None, 'X'
+
+
+def set_atmosphere(run, theta_deg=0., location='BK_USStd'):
+    """Assigns a density profile from :func:`atmosphere` to ``run``. The
+    integration path is calculated by the solver."""
+    run.atm_config = ('CORSIKA', location, None)
+    run.atm_model = atmosphere(theta_deg, location)
+    run.theta_deg = theta_deg
+    run.integration_path, run.int_grid = None, None
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Selection of the kernels by :mod:`MCEq.autotune` and by the solver on
+the synthetic cascade matrices."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import synthetic
+
+from scipy.sparse import isspmatrix_csr
+from mceq_config import config
+from MCEq import autotune, formats, kernels
+
+
+class TuneTestCase(synthetic.CascadeTestCase):
+    """Writes the cache of the selection to a temporary data directory."""
+
+    def setUp(self):
+        synthetic.CascadeTestCase.setUp(self)
+        self.tmp = tempfile.mkdtemp()
+        config['data_dir'] = self.tmp
+        config['autotune_steps'] = 5
+        config['autotune_threads'] = [1]
+        self.fname = os.path.join(self.tmp, config['autotune_cache_file'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        synthetic.CascadeTestCase.tearDown(self)
+
+    def tune(self, use_cache=False):
+        return autotune.tune_kernel(self.int_m, self.dec_m, self.phi0,
+                                    self.d, use_cache)
+
+
+class TestSelection(TuneTestCase):
+
+    def test_lossless(self):
+        choice = self.tune()
+        self.assertNotIn(choice['format'], kernels.lossy_formats)
+        timed = set([(b, f) for b, f, _, _ in choice['timings']])
+        self.assertFalse([f for _, f in timed if f in kernels.lossy_formats])
+        self.assertIn(('numpy', 'csr'), timed)
+        for b, f in timed:
+            self.assertNotIn((b, f, False), kernels.experimental_kernels)
+
+    @unittest.skipUnless(formats.has_numba, 'numba not available')
+    def test_lossy(self):
+        config['autotune_lossy'] = True
+        timed = [(b, f) for b, f, _, _ in self.tune()['timings']]
+        self.assertIn(('numba', 'compact'), timed)
+
+    def test_experimental(self):
+        kernels.register_kernel('numpy', 'dense', kernels.kern_numpy,
+                                experimental=True)
+        try:
+            self.assertIn(('numpy', 'dense'), kernels.available_kernels())
+            self.assertNotIn(('numpy', 'dense'), 
+                             kernels.available_kernels(experimental=False))
+            timed = [(b, f) for b, f, _, _ in self.tune()['timings']]
+        finally:
+            kernels.register_kernel('numpy', 'dense', kernels.kern_numpy)
+        self.assertNotIn(('numpy', 'dense'), timed)
+        self.assertIn(('numpy', 'dense'),
+                      kernels.available_kernels(experimental=False))
+
+    def test_unavailable(self):
+        available = kernels.backend_available['MKL']
+        kernels.backend_available['MKL'] = lambda: False
+        try:
+            timed = [b for b, _, _, _ in self.tune()['timings']]
+        finally:
+            kernels.backend_available['MKL'] = available
+        self.assertNotIn('MKL', timed)
+
+    def test_fastest(self):
+        choice = self.tune()
+        best = min(choice['timings'], key=lambda tm: tm[3])
+        self.assertEqual((choice['backend'], choice['format'],
+                          choice['threads']), best[:3])
+
+
+class TestCache(TuneTestCase):
+
+    def test_cached(self):
+        choice = self.tune(use_cache=True)
+        self.assertTrue(os.path.isfile(self.fname))
+        # the stored selection is returned without timing
+        cache = autotune._load_cache(self.fname)
+        self.assertEqual(len(cache), 1)
+        key = cache.keys()[0]
+        cache[key] = dict(choice, backend='numpy', format='bsr',
+                          threads=None, timings=[])
+        autotune._save_cache(self.fname, cache)
+        cached = self.tune(use_cache=True)
+        self.assertEqual((cached['format'], cached['timings']), ('bsr', []))
+        # other matrices are timed
+        self.int_m = self.int_m[:-self.d, :-self.d]
+        self.dec_m = self.dec_m[:-self.d, :-self.d]
+        self.phi0 = self.phi0[:-self.d]
+        self.assertNotEqual(self.tune(use_cache=True)['timings'], [])
+        self.assertEqual(len(autotune._load_cache(self.fname)), 2)
+
+    def test_unusable(self):
+        self.tune(use_cache=True)
+        cache = autotune._load_cache(self.fname)
+        for sel in [('numba', 'compact'), ('CUDA', 'dense')]:
+            cache[cache.keys()[0]] = {'backend': sel[0], 'format': sel[1],
+                                      'threads': None, 'timings': []}
+            autotune._save_cache(self.fname, cache)
+            choice = self.tune(use_cache=True)
+            self.assertNotEqual(choice['timings'], [])
+            self.assertNotIn(choice['format'], kernels.lossy_formats)
+
+    def test_no_cache(self):
+        self.tune(use_cache=False)
+        self.assertFalse(os.path.exists(self.fname))
+
+
+class TestSolver(unittest.TestCase):
+
+    def setUp(self):
+        self._config = dict(config)
+        self.tmp = tempfile.mkdtemp()
+        config['data_dir'] = self.tmp
+        config['checkpoint_interval'] = 0
+        config['kernel_config'] = 'numpy'
+        config['autotune_steps'] = 5
+        config['autotune_threads'] = [1]
+        self.run = synthetic.SyntheticRun()
+        self.int_m, self.dec_m = self.run.int_m.copy(), self.run.dec_m.copy()
+        self.run.solve()
+        self.ref = np.copy(self.run.solution)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        config.clear()
+        config.update(self._config)
+
+    def test_auto(self):
+        config['kernel_config'] = 'auto'
+        for lossy in [False, True]:
+            config['autotune_lossy'] = lossy
+            self.run._kernel_choice = None
+            self.run.solve()
+            self.assertLessEqual(np.max(np.abs(self.run.solution - self.ref)),
+                                 (1e-5 if lossy else 1e-12) *
+                                 np.max(self.ref))
+            # the solver keeps the double precision matrices
+            self.assertTrue(isspmatrix_csr(self.run.int_m))
+            self.assertEqual(self.run.int_m.dtype, np.float64)
+            int_m, dec_m = self.run._natural_matrices()
+            self.assertEqual((int_m - self.int_m).nnz, 0)
+            self.assertEqual((dec_m - self.dec_m).nnz, 0)
+
+    def test_fallback(self):
+        for backend in ['CUDA', 'MKL']:
+            if kernels.backend_available[backend]():
+                continue
+            config['kernel_config'] = backend
+            self.assertIs(self.run._get_kernel(),
+                          kernels.get_kernel('numpy', 'csr'))
+            self.run.solve()
+            self.assertLessEqual(np.max(np.abs(self.run.solution - self.ref)),
+                                 1e-12 * np.max(self.ref))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Derivatives of the density profiles in :mod:`MCEq.density_profiles`."""
+
+import unittest
+
+import numpy as np
+import synthetic
+
+from MCEq.density_profiles import corsika_get_density_jit
+
+
+class TestDerivatives(unittest.TestCase):
+
+    def setUp(self):
+        self.atm = synthetic.atmosphere(0.)
+
+    def test_parameter_variations(self):
+        h_vec = np.linspace(0., 1.1e7, 500)
+        rho = np.array([self.atm.get_density(h) for h in h_vec])
+        params = [(name, layer) for name in ['b', 'c'] for layer in xrange(5)]
+        eps = 1e-5
+        for (name, layer), variation in zip(
+                params, self.atm.parameter_variations(params)):
+            up = np.copy(self.atm._atm_param)
+            down = np.copy(self.atm._atm_param)
+            row = {'b': 1, 'c': 2}[name]
+            up[row, layer] *= 1. + eps
+            down[row, layer] *= 1. - eps
+            fd = np.array([corsika_get_density_jit(h, up) -
+                           corsika_get_density_jit(h, down)
+                           for h in h_vec]) / (2 * eps)
+            res = np.array([variation(h) for h in h_vec])
+            self.assertTrue(np.all(np.abs(res - fd) <= 1e-7 * rho))
+            self.assertTrue(np.any(res != 0.))
+        self.assertRaises(Exception, self.atm.parameter_variations,
+                          [('a', 0)])
+
+    def test_steps(self):
+        # a uniform scaling changes the density at fixed X only by
+        # the difference of two terms of similar size
+        variations = [self.atm.get_density,
+                      lambda h: self.atm.get_density(h) * np.exp(-h / 2e5)]
+        X = np.linspace(0., self.atm.X_surf, 50)
+        ri = self.atm.r_X2rho(X)
+        dri, dX_surf = self.atm.r_X2rho_derivatives(X, variations)
+        ref, ref_surf = self.atm.r_X2rho_derivatives(X, variations, 200000)
+        self.assertLessEqual(np.max(np.abs(dri - ref) / ri[:, np.newaxis]),
+                             1e-3)
+        self.assertLessEqual(np.max(np.abs(dX_surf - ref_surf)),
+                             1e-6 * self.atm.X_surf)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Conversions and transformations of :mod:`MCEq.formats` on the synthetic
+cascade matrices."""
+
+import unittest
+
+import numpy as np
+import synthetic
+
+from MCEq import formats, kernels
+
+
+class TestBlockFormats(synthetic.CascadeTestCase):
+
+    def test_bsr(self):
+        for mat in [self.int_m, self.dec_m]:
+            bsr = formats.to_bsr(mat, self.d)
+            self.assertEqual(bsr.blocksize, (self.d, self.d))
+            self.assertClose(bsr.toarray(), mat.toarray(), 0.)
+        res, _ = kernels.kern_numpy(self.nsteps, self.dX, self.rho_inv,
+                                    formats.to_bsr(self.int_m, self.d),
+                                    formats.to_bsr(self.dec_m, self.d),
+                                    np.copy(self.phi0), [])
+        self.assertClose(res, self.ref)
+
+    def test_hybrid(self):
+        for min_fill in [0., 0.5, 1.1]:
+            hyb = formats.HybridBlockMatrix(self.int_m, self.d, min_fill)
+            self.assertClose(hyb.toarray(), self.int_m.toarray(), 0.)
+            self.assertClose(hyb.dot(self.phi0), self.int_m.dot(self.phi0))
+        res, _ = kernels.kern_numpy(self.nsteps, self.dX, self.rho_inv,
+                                    formats.to_hybrid(self.int_m, self.d),
+                                    formats.to_hybrid(self.dec_m, self.d),
+                                    np.copy(self.phi0), [])
+        self.assertClose(res, self.ref)
+
+
+class TestCompact(synthetic.CascadeTestCase):
+
+    def test_double(self):
+        for mat in [self.int_m, self.dec_m]:
+            comp = formats.CompactCSR(mat, self.d, 'float64')
+            self.assertClose(comp.toarray(), mat.toarray(), 0.)
+            self.assertClose(comp.dot(self.phi0), mat.dot(self.phi0))
+
+    def test_single(self):
+        mats = [formats.CompactCSR(m, self.d, 'float32')
+                for m in [self.int_m, self.dec_m]]
+        self.assertClose(mats[0].toarray(), self.int_m.toarray(), 1e-7)
+        kernel = (kernels.kern_compact if formats.has_numba
+                  else kernels.kern_numpy)
+        res, _ = kernel(self.nsteps, self.dX, self.rho_inv, mats[0], mats[1],
+                        np.copy(self.phi0), [])
+        self.assertClose(res, self.ref, 1e-5)
+
+
+class TestEnsemble(synthetic.CascadeTestCase):
+
+    def test_members(self):
+        # the second member lacks the pion yields, the pattern differs
+        sparse = self.int_m.tolil()
+        sparse[2 * self.d:3 * self.d, :2 * self.d] = 0.
+        mats = [self.int_m, 0.5 * sparse.tocsr(), self.dec_m]
+        ens = formats.to_ensemble(mats)
+        self.assertEqual(ens.nmembers, len(mats))
+        phi = np.random.RandomState(4).rand(self.int_m.shape[0], len(mats))
+        res = ens.dot(phi)
+        for k, mat in enumerate(mats):
+            self.assertClose(ens.member(k).toarray(), mat.toarray(), 0.)
+            self.assertClose(res[:, k], mat.dot(phi[:, k]))
+
+
+class TestPrune(synthetic.CascadeTestCase):
+
+    def test_identity(self):
+        for mode in ['column', 'block']:
+            for mat in [self.int_m, self.dec_m]:
+                pruned = formats.prune_matrix(mat, 0., self.d, mode)
+                self.assertEqual(pruned.nnz, mat.nnz)
+                self.assertEqual((pruned - mat).nnz, 0)
+
+    def test_diagonal(self):
+        for mode in ['column', 'block']:
+            for mat in [self.int_m, self.dec_m]:
+                # only the loss terms survive a threshold above 1
+                pruned = formats.prune_matrix(mat, 10., self.d, mode)
+                self.assertClose(pruned.toarray(), 
+                                 np.diag(mat.diagonal()), 0.)
+
+    def test_threshold(self):
+        threshold = 0.3
+        mat = self.int_m.toarray()
+        pruned = formats.prune_matrix(self.int_m, threshold, self.d,
+                                      'column').toarray()
+        scale = threshold * np.max(np.abs(mat), axis=0)
+        off = ~np.eye(mat.shape[0], dtype=bool)
+        removed = (mat != 0.) & (pruned == 0.)
+        self.assertTrue(np.any(removed))
+        self.assertFalse(np.any(removed & ~off))
+        self.assertTrue(np.all((np.abs(mat) < scale)[removed]))
+        self.assertTrue(np.all((np.abs(mat) >= scale)[(pruned != 0.) & off]))
+        self.assertClose(pruned[pruned != 0.], mat[pruned != 0.], 0.)
+        self.assertRaises(Exception, formats.prune_matrix, self.int_m,
+                          threshold, self.d, 'row')
+
+
+class TestPermutation(synthetic.CascadeTestCase):
+
+    def test_round_trip(self):
+        self.assertIsNone(formats.state_permutation(
+            self.int_m, self.dec_m, self.d, 'natural'))
+        for ordering in ['rcm', 'energy_major']:
+            perm = formats.state_permutation(self.int_m, self.dec_m, self.d,
+                                             ordering)
+            self.assertEqual(sorted(perm), range(self.int_m.shape[0]))
+            inv = np.argsort(perm)
+            mats = [formats.permute_matrix(m, perm) 
+                    for m in [self.int_m, self.dec_m]]
+            for mat, orig in zip(mats, [self.int_m, self.dec_m]):
+                self.assertClose(formats.permute_matrix(mat, inv).toarray(),
+                                 orig.toarray(), 0.)
+            res, _ = kernels.kern_numpy(self.nsteps, self.dX, self.rho_inv,
+                                        mats[0], mats[1], self.phi0[perm], [])
+            self.assertClose(res[inv], self.ref)
+
+    def test_unknown(self):
+        self.assertRaises(Exception, formats.state_permutation,
+                          self.int_m, self.dec_m, self.d, 'random')
+
+
+class TestSinkReduction(synthetic.CascadeTestCase):
+
+    def test_restore(self):
+        d = self.d
+        # sinks produced by interactions, e.g. prompt leptons
+        i, j = synthetic.species.index('numu'), synthetic.species.index('K+')
+        prompt = self.int_m.tolil()
+        prompt[i * d:(i + 1) * d, j * d:(j + 1) * d] = np.triu(
+            np.ones((d, d))) * 1e-3
+        for int_m in [self.int_m, prompt.tocsr()]:
+            int_r, dec_r, embed, restore, carry, integral = \
+                formats.sink_reduction(int_m, self.dec_m, d)
+            # only the rows of the sinks are removed from the products
+            self.assertLess(int_r.nnz + dec_r.nnz, int_m.nnz + self.dec_m.nnz)
+            # the sinks are replaced by the integrals of their sources
+            self.assertEqual(carry.nnz, len(synthetic.sinks) * d)
+            self.assertEqual(embed.dot(carry).nnz, 0)
+            self.assertClose(restore.dot(embed.dot(self.phi0)) + 
+                             carry.dot(self.phi0), self.phi0, 0.)
+            ref, u = np.copy(self.phi0), np.zeros_like(self.phi0)
+            for step in xrange(self.nsteps):
+                u += self.dX[step] * ref
+                ref += (int_m.dot(ref) + self.dec_m.dot(ref) * 
+                        self.rho_inv[step]) * self.dX[step]
+            res, _ = kernels.kern_numpy(self.nsteps, self.dX, self.rho_inv,
+                                        int_r, dec_r, embed.dot(self.phi0), [])
+            self.assertClose(restore.dot(res) + carry.dot(self.phi0), ref)
+            # integrals of the species feeding the sinks by interactions
+            feeds = integral.dot(np.ones(int_r.shape[0])) > 0.
+            self.assertEqual(np.count_nonzero(feeds), 
+                             0 if int_m is self.int_m else d)
+            # pi_mu+ and k_mu+ feed the sinks by decays
+            self.assertEqual(int_r.shape[0], int_m.shape[0] - carry.nnz + 
+                             np.count_nonzero(feeds) + 2 * d)
+            if np.any(feeds):
+                self.assertClose(integral.dot(res)[feeds], u[feeds])
+
+    def test_no_sinks(self):
+        d = self.d
+        keep = np.r_[0:len(synthetic.species) * d - len(synthetic.sinks) * d]
+        int_m = self.int_m[keep][:, keep]
+        dec_m = self.dec_m[keep][:, keep]
+        maps = formats.sink_reduction(int_m, dec_m, d)[2:]
+        self.assertEqual(maps, (None,) * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Equivalence of the forward-euler kernels with :func:`MCEq.kernels.kern_numpy`
+on the synthetic cascade matrices."""
+
+import unittest
+
+import numpy as np
+import synthetic
+
+from scipy.sparse import vstack
+from mceq_config import config
+from MCEq import formats, kernels
+
+
+class TestReference(synthetic.CascadeTestCase):
+
+    def test_numpy(self):
+        self.assertClose(self.ref, synthetic.reference_euler(
+            self.nsteps, self.dX, self.rho_inv, self.int_m, self.dec_m,
+            self.phi0))
+
+
+class TestBatch(synthetic.CascadeTestCase):
+
+    def test_numpy_batch(self):
+        # columns with own step sizes and densities
+        ncols = 3
+        dX = np.outer(self.dX, [1., 0.5, 0.8])
+        rho_inv = np.outer(self.rho_inv, [1., 2., 0.3])
+        phi = np.repeat(self.phi0[:, np.newaxis], ncols, axis=1)
+        res = kernels.kern_numpy_batch(self.nsteps, dX, rho_inv,
+                                       self.int_m, self.dec_m, phi)
+        for i in xrange(ncols):
+            ref, _ = kernels.kern_numpy(self.nsteps, dX[:, i], rho_inv[:, i],
+                                        self.int_m, self.dec_m,
+                                        np.copy(self.phi0), [])
+            self.assertClose(res[:, i], ref)
+
+    @unittest.skipUnless(kernels.backend_available['MKL'](),
+                         'MKL not available')
+    def test_MKL_batch(self):
+        dX = np.outer(self.dX, [1., 0.5])
+        rho_inv = np.outer(self.rho_inv, [1., 2.])
+        phi = np.repeat(self.phi0[:, np.newaxis], 2, axis=1)
+        ref = kernels.kern_numpy_batch(self.nsteps, dX, rho_inv, self.int_m,
+                                       self.dec_m, np.copy(phi))
+        res = kernels.kern_MKL_sparse_batch(self.nsteps, dX, rho_inv,
+                                            self.int_m, self.dec_m, phi,
+                                            threads=1)
+        self.assertClose(res, ref)
+
+
+class TestTangent(synthetic.CascadeTestCase):
+
+    def test_finite_difference(self):
+        rs = np.random.RandomState(4)
+        dim = self.int_m.shape[0]
+        d_int = self.int_m.multiply(rs.rand(dim, dim)).tocsr()
+        d_rho = np.outer(self.rho_inv, [0., 0.3]) * rs.rand(self.nsteps, 2)
+        sens_m = vstack([d_int, 0. * d_int]).tocsr()
+        phi = np.zeros((dim, 3))
+        phi[:, 0] = self.phi0
+        res = kernels.kern_numpy_tangent(self.nsteps, self.dX, self.rho_inv,
+                                         self.int_m, self.dec_m, phi, sens_m,
+                                         None, d_rho)
+        self.assertClose(res[:, 0], self.ref)
+
+        eps = 1e-4
+        for j in xrange(2):
+            flux = []
+            for sign in [1., -1.]:
+                flux.append(kernels.kern_numpy(
+                    self.nsteps, self.dX, self.rho_inv + sign * eps *
+                    d_rho[:, j], self.int_m + sign * eps * sens_m[
+                        j * dim:(j + 1) * dim], self.dec_m,
+                    np.copy(self.phi0), [])[0])
+            self.assertClose(res[:, 1 + j], (flux[0] - flux[1]) / (2 * eps),
+                             1e-6)
+
+
+class TestEnsemble(synthetic.CascadeTestCase):
+
+    def test_members(self):
+        factors = [1., 0.7, 1.3]
+        int_ms = [self.int_m * f for f in factors]
+        dec_ms = [self.dec_m * f for f in factors[::-1]]
+        phi = np.repeat(self.phi0[:, np.newaxis], len(factors), axis=1)
+        for dec_m in [self.dec_m, formats.to_ensemble(dec_ms)]:
+            res = kernels.kern_ensemble(self.nsteps, self.dX, self.rho_inv,
+                                        formats.to_ensemble(int_ms), dec_m,
+                                        phi)
+            for k, int_m in enumerate(int_ms):
+                ref, _ = kernels.kern_numpy(
+                    self.nsteps, self.dX, self.rho_inv, int_m,
+                    dec_m if dec_m is self.dec_m else dec_ms[k],
+                    np.copy(self.phi0), [])
+                self.assertClose(res[:, k], ref)
+
+
+class TestActive(synthetic.CascadeTestCase):
+
+    def setUp(self):
+        synthetic.CascadeTestCase.setUp(self)
+        self.grid_idcs = [9, 30, 31, 59]
+
+    def test_active(self):
+        single = np.zeros_like(self.phi0)
+        single[self.d / 2] = 1.
+        perm = formats.state_permutation(self.int_m, self.dec_m, self.d,
+                                         'rcm')
+        inv = np.argsort(perm)
+        int_p = formats.permute_matrix(self.int_m, perm)
+        dec_p = formats.permute_matrix(self.dec_m, perm)
+        for phi0 in [self.phi0, single, np.zeros_like(self.phi0)]:
+            ref, ref_grid = kernels.kern_numpy(
+                self.nsteps, self.dX, self.rho_inv, self.int_m, self.dec_m,
+                np.copy(phi0), self.grid_idcs)
+            for fraction in [0., 0.5, 1.1]:
+                config['active_full_fraction'] = fraction
+                for int_m, dec_m, p, p_inv in [
+                        (self.int_m, self.dec_m, slice(None), slice(None)),
+                        (int_p, dec_p, perm, inv)]:
+                    phi, grid_sol = kernels.kern_active(
+                        self.nsteps, self.dX, self.rho_inv, int_m, dec_m,
+                        np.copy(phi0[p]), self.grid_idcs)
+                    self.assertClose(phi[p_inv], ref)
+                    for sol, ref_sol in zip(grid_sol, ref_grid):
+                        self.assertClose(sol[p_inv], ref_sol)
+
+    def test_reachable(self):
+        # a proton in the middle bin populates the lower bins of all species
+        rows = formats.reachable_elements(self.int_m, self.dec_m, 
+                                          [self.d / 2])
+        self.assertEqual(list(rows), [i for i in range(len(self.phi0))
+                                      if i % self.d <= self.d / 2])
+        self.assertEqual(len(formats.reachable_elements(
+            self.int_m, self.dec_m, [])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
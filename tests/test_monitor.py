@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Progress reports of :mod:`MCEq.monitor` from the kernels and the
+solver on the synthetic cascade."""
+
+import sys
+import unittest
+
+from StringIO import StringIO
+
+import numpy as np
+import synthetic
+
+from mceq_config import config
+from MCEq import kernels, monitor
+
+
+class TestMonitor(synthetic.CascadeTestCase):
+
+    def setUp(self):
+        synthetic.CascadeTestCase.setUp(self)
+        self.reports = []
+
+    def integrate(self, mon):
+        mon.start(self.nsteps, self.dX, self.rho_inv)
+        phi, _ = kernels.kern_numpy(self.nsteps, self.dX, self.rho_inv,
+                                    self.int_m, self.dec_m,
+                                    np.copy(self.phi0), [], mon)
+        mon.finish()
+        self.assertClose(phi, self.ref)
+
+    def test_stride(self):
+        for stride, steps in [(7, range(0, self.nsteps, 7)), (0, [0, 1]),
+                              (self.nsteps, [0])]:
+            del self.reports[:]
+            self.integrate(monitor.CallbackMonitor(self.reports.append,
+                                                   stride))
+            self.assertEqual([info['step'] for info in self.reports][:2],
+                             steps[:2])
+            self.assertEqual(len(self.reports),
+                             len(range(0, self.nsteps, max(1, stride))))
+        config['progress_stride'] = 20
+        self.assertEqual(monitor.make_monitor('print').stride, 20)
+        self.assertEqual(monitor.make_monitor('print', 5).stride, 5)
+
+    def test_callback(self):
+        self.integrate(monitor.make_monitor(self.reports.append, 9))
+        X = np.cumsum(self.dX) - self.dX
+        for info in self.reports:
+            step = info['step']
+            self.assertEqual(sorted(info.keys()),
+                             ['X', 'elapsed', 'maximum', 'rho_inv', 'step',
+                              'throughput'])
+            self.assertEqual(info['maximum'], self.nsteps)
+            self.assertAlmostEqual(info['X'], X[step], 12)
+            self.assertEqual(info['rho_inv'], self.rho_inv[step])
+            self.assertGreaterEqual(info['elapsed'], 0.)
+        # explicit values are passed on, e.g. by the path generation
+        mon = monitor.CallbackMonitor(self.reports.append)
+        mon.start(1000.)
+        mon.update(10., X=10., rho_inv=2.)
+        self.assertEqual((self.reports[-1]['X'],
+                          self.reports[-1]['rho_inv']), (10., 2.))
+
+    def test_no_monitor(self):
+        mon = monitor.make_monitor('none')
+        self.assertIsInstance(mon, monitor.NoMonitor)
+        self.assertFalse(mon)
+        self.integrate(mon)
+        for kind in ['print', 'bar', self.reports.append]:
+            self.assertTrue(monitor.make_monitor(kind))
+        self.assertRaises(Exception, monitor.make_monitor, 'plot')
+
+    def test_solver(self):
+        run = synthetic.SyntheticRun()
+        run.set_monitor(self.reports.append, 10)
+        run.solve()
+        self.assertEqual([info['step'] for info in self.reports],
+                         range(0, run.integration_path[0], 10))
+        run.set_monitor('none')
+        del self.reports[:]
+        run.solve()
+        self.assertEqual(self.reports, [])
+
+    def test_bar_fallback(self):
+        progressbar = sys.modules.get('progressbar')
+        stdout = sys.stdout
+        # a None entry makes the import fail
+        sys.modules['progressbar'] = None
+        monitor.BarMonitor._warned = False
+        sys.stdout = StringIO()
+        try:
+            monitors = [monitor.BarMonitor(25) for _ in xrange(3)]
+            self.integrate(monitors[0])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            if progressbar is None:
+                del sys.modules['progressbar']
+            else:
+                sys.modules['progressbar'] = progressbar
+        self.assertEqual(output.count("Failed to import 'progressbar'"), 1)
+        # the reports are printed instead
+        self.assertEqual(output.count('/s\n'), 3)
+        self.assertIn('finished', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
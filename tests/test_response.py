@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Response tables of :mod:`MCEq.response` computed for the synthetic
+cascade along a CORSIKA density profile."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import synthetic
+
+from mceq_config import config
+from MCEq.response import ResponseTable, load_response
+
+
+class PowerLaw():
+    """Primary model with the interface of :mod:`CRFluxModels`."""
+
+    def __init__(self, tag):
+        self.gamma, self.n_frac = tag
+
+    def p_and_n_flux(self, E):
+        flux = 1e4 * E ** -self.gamma
+        return flux, (1. - self.n_frac) * flux, self.n_frac * flux
+
+
+class TestResponse(synthetic.CascadeTestCase):
+
+    def setUp(self):
+        synthetic.CascadeTestCase.setUp(self)
+        config['kernel_config'] = 'numpy'
+        config['checkpoint_interval'] = 0
+        config['use_atm_cache'] = False
+        config['response_batch_size'] = 5
+        self.tmp = tempfile.mkdtemp()
+        self.run = synthetic.SyntheticRun()
+        synthetic.set_atmosphere(self.run, 30.)
+        self.obs = ['numu', 'mu+', 'pi+']
+        rs = np.random.RandomState(3)
+        self.p_flux = self.run.e_grid ** -2.7 * (1. + rs.rand(self.d))
+        self.n_flux = self.run.e_grid ** -2.7 * rs.rand(self.d)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        synthetic.CascadeTestCase.tearDown(self)
+
+    def solve(self, p_flux, n_flux):
+        """Returns the observables of :func:`solve` for a nucleon
+        spectrum."""
+        run = self.run
+        run.phi0 = np.zeros(run.dim_states)
+        run.phi0[run.pname2pref['p'].lidx():
+                 run.pname2pref['p'].uidx()] = p_flux
+        run.phi0[run.pname2pref['n'].lidx():
+                 run.pname2pref['n'].uidx()] = n_flux
+        run.solve()
+        return np.array([run.get_solution(obs) for obs in self.obs])
+
+    def test_evaluate(self):
+        table = self.run.compute_response(self.obs)
+        self.assertEqual(table.info['theta_deg'], 30.)
+        ref = self.solve(self.p_flux, self.n_flux)
+        self.assertClose(table.evaluate(self.p_flux, self.n_flux), ref)
+        self.assertClose(table.evaluate(self.p_flux, self.n_flux, mag=3.),
+                         ref * self.run.e_grid ** 3.)
+        for i, obs in enumerate(self.obs):
+            self.assertClose(table.get_solution(obs, self.p_flux,
+                                                self.n_flux), ref[i])
+        self.assertRaises(Exception, table.get_solution, 'p',
+                          self.p_flux, self.n_flux)
+
+    def test_model(self):
+        table = self.run.compute_response(self.obs)
+        _, p_top, n_top = PowerLaw((2.7, 0.3)).p_and_n_flux(self.run.e_grid)
+        self.assertClose(
+            self.run.evaluate_response(table, PowerLaw, (2.7, 0.3), 2.),
+            self.solve(1e-4 * p_top, 1e-4 * n_top) * self.run.e_grid ** 2.)
+        table.e_grid = table.e_grid * 2.
+        self.assertRaises(Exception, self.run.evaluate_response, table,
+                          PowerLaw, (2.7, 0.3))
+
+    def test_save(self):
+        fname = os.path.join(self.tmp, 'response.npz')
+        table = self.run.compute_response(self.obs, fname)
+        loaded = load_response(fname)
+        self.assertEqual(loaded.observables, self.obs)
+        self.assertEqual(loaded.info, table.info)
+        self.assertEqual(loaded.info['atm_config'],
+                         ('CORSIKA', 'BK_USStd', None))
+        self.assertClose(loaded.G, table.G, 0.)
+        self.assertClose(loaded.e_grid, table.e_grid, 0.)
+        self.assertRaises(Exception, ResponseTable, table.G[:, 1:],
+                          self.obs, table.e_grid)
+
+    def test_energy_window(self):
+        lo, hi = 2, self.d - 2
+        self.run.set_energy_window((self.run.e_grid[lo],
+                                    self.run.e_grid[hi]))
+        table = self.run.compute_response(self.obs)
+        # the columns of nucleons outside of the window vanish
+        for first in [0, self.d]:
+            self.assertEqual(np.count_nonzero(table.G[:, first:first + lo]),
+                             0)
+            self.assertEqual(np.count_nonzero(
+                table.G[:, first + hi + 1:first + self.d]), 0)
+        self.assertClose(table.evaluate(self.p_flux, self.n_flux),
+                         self.solve(self.p_flux, self.n_flux))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Storage of the longitudinal solutions by the sinks of
+:mod:`MCEq.snapshots`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import synthetic
+
+from mceq_config import config
+from MCEq import kernels, snapshots
+
+
+class SinkTestCase(synthetic.CascadeTestCase):
+    """Writes the files of the sinks to a temporary directory."""
+
+    def setUp(self):
+        synthetic.CascadeTestCase.setUp(self)
+        self.tmp = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp, 'grid_sol.npy')
+        config['grid_sol_file'] = self.fname
+        self.grid_idcs = [9, 30, 31, 59]
+        rs = np.random.RandomState(4)
+        # values spanning many orders of magnitude like the fluxes
+        self.phis = 10. ** rs.uniform(-30., 5., (len(self.grid_idcs),
+                                                 self.phi0.size))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        synthetic.CascadeTestCase.tearDown(self)
+
+    def assertSingle(self, res, ref):
+        """Compares element-wise within the precision of float32."""
+        self.assertEqual(np.asarray(res).dtype, np.float32)
+        self.assertLessEqual(np.max(np.abs(res - ref) / np.abs(ref)),
+                             np.finfo(np.float32).eps)
+
+
+class TestPrecision(SinkTestCase):
+
+    def test_round_trip(self):
+        for storage in ['array', 'memmap']:
+            config['grid_sol_storage'] = storage
+            config['grid_sol_dtype'] = 'float32'
+            sink = snapshots.make_sink(len(self.phis), self.phi0.size)
+            for phi in self.phis:
+                sink.append(phi)
+            sink.finish()
+            self.assertEqual(len(sink), len(self.phis))
+            for idx, phi in enumerate(self.phis):
+                self.assertSingle(sink[idx], phi)
+        self.assertSingle(np.load(self.fname), self.phis)
+
+    def test_kernel(self):
+        ref, ref_grid = kernels.kern_numpy(
+            self.nsteps, self.dX, self.rho_inv, self.int_m, self.dec_m,
+            np.copy(self.phi0), self.grid_idcs)
+        config['grid_sol_storage'] = 'memmap'
+        config['grid_sol_dtype'] = 'float32'
+        sink = snapshots.make_sink(len(self.grid_idcs), self.phi0.size)
+        phi, grid_sol = kernels.kern_numpy(
+            self.nsteps, self.dX, self.rho_inv, self.int_m, self.dec_m,
+            np.copy(self.phi0), self.grid_idcs, grid_sol=sink)
+        self.assertIs(grid_sol, sink)
+        self.assertClose(phi, ref)
+        nonzero = ref_grid[0] != 0.
+        for sol, ref_sol in zip(grid_sol, ref_grid):
+            self.assertSingle(sol[nonzero], ref_sol[nonzero])
+
+
+class TestIncremental(SinkTestCase):
+
+    def test_memmap(self):
+        dim = self.phi0.size
+        sink = snapshots.MemmapSink(len(self.phis), dim, self.fname,
+                                    'float32')
+        # the file is allocated once for all snapshots
+        size = os.path.getsize(self.fname)
+        self.assertGreaterEqual(size, len(self.phis) * dim * 4)
+        for n, phi in enumerate(self.phis):
+            sink.append(phi)
+            # a second mapping of the file sees each snapshot after append
+            data = np.load(self.fname, mmap_mode='r')
+            self.assertSingle(data[:n + 1], self.phis[:n + 1])
+            self.assertEqual(np.count_nonzero(data[n + 1:]), 0)
+            del data
+            self.assertEqual(os.path.getsize(self.fname), size)
+
+    def test_save(self):
+        fname = os.path.join(self.tmp, 'checkpoint.grid_sol')
+        sink = snapshots.ArraySink(len(self.phis), self.phi0.size, 'float32')
+        for n, phi in enumerate(self.phis):
+            sink.append(phi)
+            sink.save(fname)
+            # only the new snapshot is appended to the file
+            self.assertEqual(os.path.getsize(fname),
+                             (n + 1) * self.phi0.size * 4)
+        restored = snapshots.ArraySink(len(self.phis), self.phi0.size,
+                                       'float32')
+        restored.load(fname, 2)
+        self.assertEqual(len(restored), 2)
+        self.assertSingle(restored.data, self.phis[:2])
+        # snapshots after the checkpoint are removed from the file
+        self.assertEqual(os.path.getsize(fname), 2 * self.phi0.size * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
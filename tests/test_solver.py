@@ -0,0 +1,682 @@
+# -*- coding: utf-8 -*-
+"""Transformations of the solver state and solvers of :class:`MCEq.core.MCEqRun`
+on the synthetic cascade, which does not require data files."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from copy import copy
+
+import numpy as np
+import synthetic
+
+from mceq_config import config
+from MCEq import geometry as geom, kernels
+from MCEq.density_profiles import CorsikaAtmosphere
+
+
+class SolverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._config = dict(config)
+        config['kernel_config'] = 'numpy'
+        config['checkpoint_interval'] = 0
+        config['use_atm_cache'] = False
+        self.run = synthetic.SyntheticRun()
+        self.int_m, self.dec_m = self.run.int_m.copy(), self.run.dec_m.copy()
+        self.run.solve()
+        self.ref = np.copy(self.run.solution)
+
+    def tearDown(self):
+        config.clear()
+        config.update(self._config)
+
+    def assertClose(self, res, ref, rtol=1e-12):
+        self.assertLessEqual(np.max(np.abs(res - ref)),
+                             rtol * np.max(np.abs(ref)))
+
+    def assertNatural(self):
+        """Checks that the solver matrices map back to the original ones."""
+        int_m, dec_m = self.run._natural_matrices()
+        self.assertClose(int_m.toarray(), self.int_m.toarray(), 0.)
+        self.assertClose(dec_m.toarray(), self.dec_m.toarray(), 0.)
+
+
+class AtmosphereTestCase(SolverTestCase):
+    """Integrates along the path of a CORSIKA density profile. Files are
+    written to a temporary directory."""
+
+    def setUp(self):
+        SolverTestCase.setUp(self)
+        self.tmp = tempfile.mkdtemp()
+        config['checkpoint_file'] = os.path.join(self.tmp, 'checkpoint.npz')
+        config['grid_sol_file'] = os.path.join(self.tmp, 'grid_sol.npy')
+        synthetic.set_atmosphere(self.run)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        SolverTestCase.tearDown(self)
+
+
+class TestTransformations(SolverTestCase):
+
+    def test_ordering(self):
+        for ordering in ['rcm', 'energy_major', 'natural']:
+            self.run.set_state_ordering(ordering)
+            self.assertNatural()
+            self.run.solve()
+            self.assertClose(self.run.solution, self.ref)
+
+    def test_decouple_sinks(self):
+        for ordering in ['natural', 'rcm']:
+            self.run.set_state_ordering(ordering)
+            self.run.decouple_sinks(True)
+            self.assertNatural()
+            self.run.solve()
+            self.assertClose(self.run.solution, self.ref)
+            self.run.decouple_sinks(False)
+            self.assertNatural()
+
+
+class TestSpecies(SolverTestCase):
+    """Species, which do not contribute to the observables, are removed
+    by select_species()."""
+
+    def test_observables(self):
+        for ordering, decouple in [('natural', False), ('rcm', True)]:
+            self.run.set_state_ordering(ordering)
+            self.run.decouple_sinks(decouple)
+            for obs, dropped in [(['numu'], ['mu+']), (['mu+'], ['numu']),
+                                 (['pi+'], ['pi_mu+', 'k_mu+', 'mu+', 
+                                            'numu'])]:
+                self.run.select_species(obs)
+                self.assertEqual(sorted(self.run._dropped_species), 
+                                 sorted(dropped))
+                self.run.solve()
+                for o in obs:
+                    self.assertClose(self.run.get_solution(o),
+                                     self.run._observables(self.ref, [o])[0])
+            self.run.select_species(None)
+            self.assertEqual(self.run._dropped_species, [])
+            self.assertNatural()
+            self.run.solve()
+            self.assertClose(self.run.solution, self.ref)
+
+    def test_dropped(self):
+        self.run.select_species(['numu'])
+        self.run.solve()
+        self.assertRaises(Exception, self.run.get_solution, 'mu+')
+        self.run.get_solution('numu')
+
+    def test_phi0(self):
+        self.run.select_species(['numu'])
+        mu = self.run.pname2pref['mu+']
+        self.run.phi0[mu.lidx():mu.uidx()] = 1e-3
+        self.assertRaises(Exception, self.run.solve)
+        # species with flux in phi0 are kept, if they reach the observables
+        self.run.select_species(['mu+'])
+        self.assertNotIn('mu+', self.run._dropped_species)
+        self.run.solve()
+
+
+class TestPruning(SolverTestCase):
+
+    def setUp(self):
+        SolverTestCase.setUp(self)
+        self.obs = ['numu', 'mu+', 'pi+']
+
+    def rel_dev(self, rel_cut=1e-10):
+        ref = self.run._observables(self.ref, self.obs)
+        res = self.run._observables(self.run.solution, self.obs)
+        sel = np.abs(ref) > rel_cut * np.max(np.abs(ref), axis=1)[:, None]
+        return np.max(np.abs(res[sel] / ref[sel] - 1.))
+
+    def test_identity(self):
+        self.run.prune_matrices(0.)
+        self.assertNatural()
+        self.run.solve()
+        self.assertClose(self.run.solution, self.ref, 0.)
+
+    def test_scan(self):
+        tolerance = 1e-3
+        res = self.run.prune_threshold_scan(
+            self.obs, np.logspace(-6, 0, 7), tolerance=tolerance)
+        self.assertEqual(list(np.diff(res['nnz']) <= 0), [True] * 6)
+        self.assertGreater(res['max_rel_dev'][-1], tolerance)
+        suggested = res['suggested']
+        self.assertIsNotNone(suggested)
+        self.assertTrue(np.all(np.array(res['max_rel_dev'])[
+            np.array(res['thresholds']) <= suggested] <= tolerance))
+        # the solver reproduces the deviation of the scan
+        self.run.prune_matrices(suggested)
+        self.run.solve()
+        dev = self.rel_dev()
+        self.assertLessEqual(dev, tolerance)
+        self.assertAlmostEqual(dev, res['max_rel_dev'][
+            res['thresholds'].index(suggested)], 12)
+        # the loss terms are kept
+        int_m, dec_m = self.run._natural_matrices()
+        self.assertClose(int_m.diagonal(), self.int_m.diagonal(), 0.)
+        self.assertClose(dec_m.diagonal(), self.dec_m.diagonal(), 0.)
+
+
+class TestScaling(SolverTestCase):
+
+    def test_rebuild(self):
+        # the synthetic yields give the same matrices
+        self.run._init_default_matrices()
+        self.assertNatural()
+        for ordering in ['natural', 'rcm']:
+            config['state_ordering'] = ordering
+            run = synthetic.SyntheticRun()
+            run._init_default_matrices()
+            run.scale_yield('p', 'pi+', 1.2)
+            run.scale_yield('p', 'pi+', np.linspace(0.5, 1.5, run.d))
+            run.scale_yield('p', 'p', 0.9)
+            run.scale_yield('K+', 'k_mu+', 1.1)
+            run.scale_cross_section('K+', 1.3)
+            synthetic.set_path(run)
+            run.solve()
+            ref = np.copy(run.solution)
+            int_m, dec_m = run._natural_matrices()
+            # the factors are applied to the yields of the rebuilt matrices
+            run._init_default_matrices()
+            int_r, dec_r = run._natural_matrices()
+            self.assertClose(int_r.toarray(), int_m.toarray())
+            self.assertClose(dec_r.toarray(), dec_m.toarray(), 0.)
+            run.solve()
+            self.assertClose(run.solution, ref)
+
+
+class TestAdjoint(SolverTestCase):
+
+    def test_duality(self):
+        weights = np.random.RandomState(4).rand(self.run.d)
+        phi0 = synthetic.initial_state(self.run.d, seed=5)
+        for ordering, decouple in [('natural', False), ('rcm', True)]:
+            self.run.set_state_ordering(ordering)
+            self.run.decouple_sinks(decouple)
+            for obs in ['numu', 'pi+']:
+                psi = self.run.solve_adjoint(obs, weights)
+                self.assertEqual(psi.shape, (self.run.dim_states,))
+                for phi in [self.run.phi0, phi0]:
+                    self.run.phi0 = np.copy(phi)
+                    self.run.solve()
+                    flux = weights.dot(self.run.get_solution(obs))
+                    self.assertAlmostEqual(psi.dot(phi) / flux, 1., 12)
+                self.run.phi0 = synthetic.initial_state(self.run.d)
+
+    def test_weights(self):
+        self.assertRaises(Exception, self.run.solve_adjoint, 'numu',
+                          np.ones(self.run.d + 1))
+
+
+class TestSensitivity(SolverTestCase):
+
+    def finite_difference(self, param, obs, eps=1e-4):
+        """Central difference of the fluxes with :func:`scale_yield`."""
+        flux = []
+        for factor in [1. + eps, 1. - eps]:
+            run = synthetic.SyntheticRun()
+            run.scale_yield(param[0], param[1], factor)
+            run.solve()
+            flux.append(np.array([run.get_solution(o) for o in obs]))
+        return (flux[0] - flux[1]) / (2 * eps)
+
+    def test_tangent(self):
+        params = [('p', 'pi+'), ('pi+', 'pi+'), ('K+', 'p')]
+        obs = ['numu', 'mu+', 'pi+']
+        fd = [self.finite_difference(par, obs) for par in params]
+        for ordering, decouple in [('natural', False), ('rcm', True)]:
+            self.run.set_state_ordering(ordering)
+            self.run.decouple_sinks(decouple)
+            flux, deriv = self.run.solve_sensitivity(params, obs)
+            self.assertEqual(deriv.shape, (len(params), len(obs), self.run.d))
+            self.assertClose(self.run.solution, self.ref)
+            self.assertClose(flux, [self.ref[self.run.pname2pref[o].lidx():
+                                             self.run.pname2pref[o].uidx()]
+                                    for o in obs])
+            for res, ref in zip(deriv, fd):
+                self.assertClose(res, ref, 1e-6)
+
+    def test_x_range(self):
+        full, = self.run.solve_sensitivity([('p', 'pi+')], ['numu'])[1]
+        parts = self.run.solve_sensitivity([('p', 'pi+', (None, 0.3)),
+                                            ('p', 'pi+', (0.3, None))],
+                                           ['numu'])[1]
+        # no ratio of two energy bins equals the boundary
+        self.assertClose(parts[0] + parts[1], full)
+        self.assertRaises(Exception, self.run.solve_sensitivity,
+                          [('p', 'pi+', (2., None))], ['numu'])
+
+
+class TestEnsemble(SolverTestCase):
+
+    def test_variations(self):
+        obs = ['numu', 'mu+']
+        variations = [lambda run: None,
+                      lambda run: run.scale_yield('p', 'pi+', 1.2),
+                      lambda run: run.scale_cross_section('pi+', 0.7),
+                      lambda run: run.scale_cross_section('K+', 1.3)]
+        lint = np.copy(self.run.Lambda_int)
+        path = self.run.integration_path
+        for ordering, decouple in [('natural', False), ('rcm', True)]:
+            self.run.set_state_ordering(ordering)
+            self.run.decouple_sinks(decouple)
+            res = self.run.solve_ensemble(variations, obs)
+            self.assertEqual(res.shape, (len(variations), len(obs),
+                                         self.run.d))
+            # the object is left unchanged
+            self.assertClose(self.run.Lambda_int, lint, 0.)
+            self.assertNatural()
+            self.assertIs(self.run.integration_path, path)
+            for variation, flux in zip(variations, res):
+                run = synthetic.SyntheticRun()
+                variation(run)
+                synthetic.set_path(run)
+                run.solve()
+                self.assertClose(flux, [run.get_solution(o) for o in obs])
+
+
+class Interrupt(Exception):
+    pass
+
+
+def interrupt(info):
+    """Progress monitor, which stops the integration after step 2000."""
+    if info['step'] > 2000:
+        raise Interrupt()
+
+
+class TestCheckpoint(AtmosphereTestCase):
+
+    def test_resume(self):
+        int_grid = np.linspace(20., 1000., 12)
+        for storage in ['list', 'memmap']:
+            config['grid_sol_storage'] = storage
+            config['checkpoint_interval'] = 0
+            self.run.set_monitor('none')
+            self.run.solve(int_grid=int_grid)
+            ref = np.copy(self.run.solution)
+            ref_grid = [np.copy(sol) for sol in self.run.grid_sol]
+
+            config['checkpoint_interval'] = 500
+            self.run.set_monitor(interrupt)
+            self.assertRaises(Interrupt, self.run.solve, int_grid=int_grid)
+            ckpt = np.load(config['checkpoint_file'])
+            self.assertEqual(int(ckpt['step']), 2000)
+            self.assertNotIn('grid_sol', ckpt.files)
+            self.assertTrue(0 < int(ckpt['n_snapshots']) < len(int_grid))
+
+            run = synthetic.SyntheticRun()
+            synthetic.set_atmosphere(run)
+            run.resume()
+            self.assertClose(run.solution, ref)
+            self.assertEqual(len(run.grid_sol), len(int_grid))
+            for sol, ref_sol in zip(run.grid_sol, ref_grid):
+                self.assertClose(sol, ref_sol)
+
+    def test_extend_to(self):
+        X = [500., 800.]
+        self.run.solve(int_grid=X)
+        self.run.solution = np.copy(self.run.grid_sol[0])
+        self.run.solution_X = X[0]
+        self.run.extend_to(X[1])
+        self.assertEqual(self.run.solution_X, X[1])
+        self.assertClose(self.run.solution, self.run.grid_sol[1], 1e-10)
+        self.assertRaises(Exception, self.run.extend_to, X[0])
+        self.assertRaises(Exception, self.run.extend_to,
+                          self.run.atm_model.X_surf + 1.)
+
+
+class TestGrid(AtmosphereTestCase):
+
+    def test_variables(self):
+        # slant and vertical depth agree for vertical trajectories
+        X = np.array([100., 500., 900.])
+        atm = self.run.atm_model
+        self.run.solve(int_grid=X)
+        ref = [np.copy(sol) for sol in self.run.grid_sol]
+        for grid, grid_var in [(X, 'Xv'), 
+                               ([atm.depth2height(x) for x in X], 'h')]:
+            self.run.solve(int_grid=grid, grid_var=grid_var)
+            self.assertEqual(len(self.run.grid_sol), len(X))
+            for sol, ref_sol in zip(self.run.grid_sol, ref):
+                self.assertClose(sol, ref_sol, 1e-4)
+
+    def test_top(self):
+        self.run.solve()
+        ref = np.copy(self.run.solution)
+        for grid, grid_var in [([0.], 'X'), ([0.], 'Xv'), 
+                               ([geom.h_atm], 'h')]:
+            self.run.solve(int_grid=grid, grid_var=grid_var)
+            self.assertEqual(len(self.run.grid_sol), 1)
+            self.assertClose(self.run.grid_sol[0], self.run.phi0, 0.)
+            self.assertClose(self.run.solution, ref)
+
+    def test_invalid(self):
+        X_surf = self.run.atm_model.X_surf
+        for grid in [[500., 100.], [X_surf * 1.1]]:
+            self.assertRaises(Exception, self.run.solve, int_grid=grid)
+        self.assertRaises(NotImplementedError, self.run.solve, 
+                          int_grid=[100.], grid_var='E')
+
+
+class TestEnergyWindow(AtmosphereTestCase):
+
+    def setUp(self):
+        AtmosphereTestCase.setUp(self)
+        self.obs = ['numu', 'mu+', 'pi+', 'p']
+
+    def full_solve(self, path, phi0):
+        """Solves without window along the integration path ``path``."""
+        run = synthetic.SyntheticRun()
+        synthetic.set_atmosphere(run)
+        run.integration_path, run.grid_var = path, 'X'
+        run.phi0 = phi0
+        run.solve()
+        return np.array([run.get_solution(o) for o in self.obs])
+
+    def test_min(self):
+        lo = 4
+        self.run.set_energy_window((self.run.e_grid[lo], None))
+        self.run.solve()
+        res = np.array([self.run.get_solution(o) for o in self.obs])
+        self.assertEqual(np.count_nonzero(res[:, :lo]), 0)
+        ref = self.full_solve(self.run.integration_path, self.run.phi0)
+        for sol, ref_sol in zip(res, ref):
+            self.assertClose(sol[lo:], ref_sol[lo:])
+        # the steps resolve the interactions
+        dX = self.run.integration_path[1]
+        self.assertLessEqual(np.max(dX) * np.max(self.run.Lambda_int),
+                             config['window_step_fraction'] * (1. + 1e-12))
+
+    def test_max(self):
+        hi = self.run.d - 3
+        self.run.set_energy_window((None, self.run.e_grid[hi]))
+        self.run.solve()
+        res = np.array([self.run.get_solution(o) for o in self.obs])
+        self.assertEqual(np.count_nonzero(res[:, hi + 1:]), 0)
+        # the primary flux is cut off above the window
+        phi0 = np.copy(self.run.phi0).reshape(-1, self.run.d)
+        phi0[:, hi + 1:] = 0.
+        ref = self.full_solve(self.run.integration_path, phi0.ravel())
+        for sol, ref_sol in zip(res, ref):
+            self.assertClose(sol, ref_sol)
+        self.run.set_energy_window(None)
+        self.assertNatural()
+
+
+class TestProjection(AtmosphereTestCase):
+    """Longitudinal solutions saved only for the observables."""
+
+    def test_get_solution(self):
+        int_grid = np.linspace(20., 1000., 6)
+        obs = ['numu', 'conv_mu+', 'pi+']
+        self.run.solve(int_grid=int_grid)
+        ref = [[self.run.get_solution(o, 2., idx) for o in obs]
+               for idx in xrange(len(int_grid))]
+        for storage in ['list', 'memmap']:
+            config['grid_sol_storage'] = storage
+            for ordering, decouple in [('natural', False), ('rcm', False),
+                                       ('natural', True), ('rcm', True)]:
+                self.run.set_state_ordering(ordering)
+                self.run.decouple_sinks(decouple)
+                self.run.solve(int_grid=int_grid, observables=obs)
+                self.assertEqual(self.run.grid_obs, obs)
+                self.assertEqual(np.shape(self.run.grid_sol[0]), 
+                                 (len(obs) * self.run.d,))
+                for idx in xrange(len(int_grid)):
+                    for o, ref_sol in zip(obs, ref[idx]):
+                        self.assertClose(
+                            self.run.get_solution(o, 2., idx), ref_sol)
+
+    def test_not_saved(self):
+        self.run.solve(int_grid=[500.], observables=['numu'])
+        self.assertRaises(Exception, self.run.get_solution, 'mu+', 
+                          grid_idx=0)
+        # the solution at the surface contains all species
+        self.run.get_solution('mu+')
+        self.run.solve(int_grid=[500.])
+        self.assertIs(self.run.grid_obs, None)
+        self.run.get_solution('mu+', grid_idx=0)
+
+
+class TestZenithScan(AtmosphereTestCase):
+
+    def setUp(self):
+        AtmosphereTestCase.setUp(self)
+        self.obs = ['numu', 'mu+', 'p']
+
+    def test_single(self):
+        for theta in [0., 30.4]:
+            res = self.run.solve_zenith_scan([theta], self.obs)
+            run = synthetic.SyntheticRun()
+            synthetic.set_atmosphere(run, theta)
+            run.solve()
+            self.assertClose(res[0], [run.get_solution(o) for o in self.obs])
+
+    def test_close_angles(self):
+        # the atmosphere cache returns the spline of 30 degrees for 30.4
+        config['data_dir'] = self.tmp
+        config['use_atm_cache'] = True
+        thetas = [30., 30.4]
+        res = self.run.solve_zenith_scan(thetas, self.obs)
+        # columns of the common path with the exact profiles
+        nsteps, dX, rho_inv = self.run._gen_batch_integration_path(
+            [synthetic.atmosphere(theta) for theta in thetas])
+        for i in xrange(len(thetas)):
+            phi, _ = kernels.kern_numpy(nsteps, dX[:, i], rho_inv[:, i],
+                                        self.run.int_m, self.run.dec_m,
+                                        np.copy(self.run.phi0), [])
+            self.assertClose(res[i], self.run._observables(phi, self.obs, 0.))
+        # the angles are not merged
+        self.assertGreater(np.max(np.abs(res[1] - res[0])), 
+                           1e-10 * np.max(np.abs(res[0])))
+
+
+class PerturbedAtmosphere(CorsikaAtmosphere):
+    """CORSIKA profile with the density :math:`\\rho + \\epsilon\\delta\\rho`."""
+
+    def __init__(self, variation, eps):
+        CorsikaAtmosphere.__init__(self, 'BK_USStd')
+        self.variation, self.eps = variation, eps
+
+    def get_density(self, h_cm):
+        return (CorsikaAtmosphere.get_density(self, h_cm) +
+                self.eps * self.variation(h_cm))
+
+
+class TestAtmosphereSensitivity(AtmosphereTestCase):
+
+    def setUp(self):
+        AtmosphereTestCase.setUp(self)
+        # finer steps, the finite differences include the change of the
+        # step sizes with the density
+        self.run.max_ldec *= 4
+
+    def finite_difference(self, variation, obs, eps=1e-2):
+        """Central difference of the fluxes with perturbed profiles."""
+        flux = []
+        for sign in [1., -1.]:
+            run = synthetic.SyntheticRun()
+            run.max_ldec = self.run.max_ldec
+            synthetic.set_atmosphere(run)
+            run.atm_model = PerturbedAtmosphere(variation, sign * eps)
+            run.atm_model.set_theta(0.)
+            run.solve()
+            flux.append(np.array([run.get_solution(o) for o in obs]))
+        return (flux[0] - flux[1]) / (2 * eps)
+
+    def test_tangent(self):
+        rho = self.run.atm_model.get_density
+        # smooth variations, which reach and do not reach the surface
+        variations = [lambda h: rho(h) * np.exp(-h / 2e5),
+                      lambda h: rho(h) * np.exp(-((h - 1e6) / 3e5) ** 2)]
+        obs = ['numu', 'mu+', 'pi+']
+        flux, deriv = self.run.solve_atmosphere_sensitivity(variations, obs)
+        self.assertAlmostEqual(self.run.solution_X, self.run.atm_model.X_surf,
+                               9)
+        self.assertEqual(deriv.shape, (len(variations), len(obs),
+                                       self.run.d))
+        ref = np.copy(self.run.solution)
+        self.run.solve()
+        self.assertClose(ref, self.run.solution)
+        self.assertClose(flux, [self.run.get_solution(o) for o in obs])
+        for res, variation in zip(deriv, variations):
+            self.assertClose(res, self.finite_difference(variation, obs),
+                             1e-2)
+
+
+def prompt_run():
+    """Returns a run, in which the sinks have an initial flux and numu is
+    also produced by interactions of K+, as for prompt leptons."""
+    run = synthetic.SyntheticRun()
+    d = run.d
+    i, j = [synthetic.species.index(name) for name in ['numu', 'K+']]
+    int_m = run.int_m.tolil()
+    int_m[i * d:(i + 1) * d, j * d:(j + 1) * d] = np.triu(
+        np.ones((d, d))) * 2e-4
+    run.int_m = int_m.tocsr()
+    for name in synthetic.sinks:
+        run.phi0[run.pname2pref[name].lidx():run.pname2pref[name].uidx()] = \
+            1e-3 * np.logspace(0, 2, d) ** -2.
+    synthetic.set_atmosphere(run)
+    return run
+
+
+class TestDecoupledSinks(AtmosphereTestCase):
+    """The initial flux and the production by interactions of the sinks
+    are restored outside of the solver state."""
+
+    def setUp(self):
+        AtmosphereTestCase.setUp(self)
+        self.obs = ['numu', 'mu+', 'pi+']
+        self.run = prompt_run()
+        self.run.solve()
+        self.ref = np.copy(self.run.solution)
+        self.run.set_state_ordering('rcm')
+        self.run.decouple_sinks(True)
+
+    def test_solve(self):
+        int_grid = np.linspace(20., 1000., 12)
+        ref = prompt_run()
+        ref.solve(int_grid=int_grid)
+        for observables in [None, self.obs]:
+            self.run.solve(int_grid=int_grid, observables=observables)
+            self.assertClose(self.run.solution, ref.solution)
+            for idx in xrange(len(int_grid)):
+                for obs in self.obs:
+                    self.assertClose(self.run.get_solution(obs, grid_idx=idx),
+                                     ref.get_solution(obs, grid_idx=idx))
+
+    def test_resume(self):
+        config['checkpoint_interval'] = 500
+        self.run.set_monitor(interrupt)
+        self.assertRaises(Interrupt, self.run.solve)
+        run = prompt_run()
+        run.set_state_ordering('rcm')
+        run.decouple_sinks(True)
+        run.resume()
+        self.assertClose(run.solution, self.ref)
+        # the solution is continued from the current flux of the sinks
+        self.run.set_monitor('none')
+        for run in [self.run, prompt_run()]:
+            run.solve(int_grid=[500.])
+            run.solution = np.copy(run.grid_sol[0])
+            run.solution_X = 500.
+            run.extend_to(run.atm_model.X_surf)
+        self.assertClose(self.run.solution, run.solution)
+
+    def test_adjoint(self):
+        weights = np.random.RandomState(4).rand(self.run.d)
+        for obs in self.obs:
+            psi = self.run.solve_adjoint(obs, weights)
+            self.run.solve()
+            self.assertAlmostEqual(psi.dot(self.run.phi0) / 
+                weights.dot(self.run.get_solution(obs)), 1., 12)
+
+    def test_sensitivity(self):
+        params = [('K+', 'numu'), ('p', 'pi+')]
+        flux, deriv = self.run.solve_sensitivity(params, self.obs)
+        self.assertClose(self.run.solution, self.ref)
+        for param, res in zip(params, deriv):
+            fd = []
+            for factor in [1. + 1e-4, 1. - 1e-4]:
+                run = prompt_run()
+                run.scale_yield(param[0], param[1], factor)
+                run.solve()
+                fd.append(np.array([run.get_solution(o) for o in self.obs]))
+            self.assertClose(res, (fd[0] - fd[1]) / 2e-4, 1e-6)
+
+    def test_ensemble(self):
+        factors = [1., 0.5, 2.]
+        variations = [lambda run, f=f: run.scale_yield('K+', 'numu', f)
+                      for f in factors]
+        res = self.run.solve_ensemble(variations, self.obs)
+        for factor, flux in zip(factors, res):
+            run = prompt_run()
+            run.scale_yield('K+', 'numu', factor)
+            run.solve()
+            self.assertClose(flux, [run.get_solution(o) for o in self.obs])
+
+
+class TestTimeSeries(AtmosphereTestCase):
+
+    def setUp(self):
+        AtmosphereTestCase.setUp(self)
+        self.obs = ['numu', 'mu+']
+        rho = CorsikaAtmosphere.get_density
+        self.atmospheres = [
+            synthetic.atmosphere(30.),
+            ('CORSIKA', 'BK_USStd', None),
+            PerturbedAtmosphere(lambda h: 0.2 * rho(self.run.atm_model, h),
+                                1.)]
+
+    def test_sequential(self):
+        threads = threading.active_count()
+        res = self.run.solve_time_series(self.atmospheres, 30., self.obs)
+        self.assertEqual(res.shape, (len(self.atmospheres), len(self.obs),
+                                     self.run.d))
+        self.assertEqual(threading.active_count(), threads)
+        for atm, flux in zip(self.atmospheres, res):
+            run = synthetic.SyntheticRun()
+            synthetic.set_atmosphere(run, 30.)
+            if isinstance(atm, tuple):
+                run.atm_model = run._create_atm_model(atm)
+            else:
+                run.atm_model = copy(atm)
+            run.atm_model.set_theta(30.)
+            run.solve()
+            self.assertClose(flux, [run.get_solution(o) for o in self.obs])
+
+    def test_error(self):
+        threads = threading.active_count()
+        self.assertRaises(Exception, self.run.solve_time_series,
+                          [synthetic.atmosphere(30.), 
+                           ('CORSIKA', 'Nowhere', None)], 30., self.obs)
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_stop(self):
+        consumed = []
+
+        def atmospheres():
+            while True:
+                consumed.append(None)
+                yield synthetic.atmosphere(0.)
+
+        threads = threading.active_count()
+        paths = self.run._stream_integration_paths(atmospheres(), 0., 
+                                                   prefetch=2)
+        paths.next()
+        paths.close()
+        self.assertEqual(threading.active_count(), threads)
+        # the path being calculated and the full queue
+        self.assertLessEqual(len(consumed), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()